@@ -15,6 +15,7 @@ import datasets.tools.cv2_aug_transforms as cv2_aug_trans
 import datasets.tools.transforms as trans
 from datasets.cls.loader.default_loader import DefaultLoader
 from datasets.tools.collate import collate
+from datasets.tools.tensor_aug_transforms import TensorAugCompose, TensorAugLoader
 from utils.tools.logger import Logger as Log
 
 
@@ -39,6 +40,13 @@ class DataLoader(object):
             Log.error('Not support {} image tool.'.format(self.configer.get('data', 'image_tool')))
             exit(1)
 
+        self.tensor_aug_transform = None
+        if self.configer.exists('train_trans', 'aug_backend') \
+                and self.configer.get('train_trans', 'aug_backend') == 'tensor':
+            # The train augmentations are applied on the collated batch instead of every sample.
+            self.aug_train_transform = None
+            self.tensor_aug_transform = TensorAugCompose(self.configer, split='train')
+
         self.img_transform = trans.Compose([
             trans.ToTensor(),
             trans.Normalize(div_value=self.configer.get('normalize', 'div_value'),
@@ -56,10 +64,11 @@ class DataLoader(object):
                 drop_last=self.configer.get('data', 'drop_last'),
                 collate_fn=lambda *args: collate(
                     *args, trans_dict=self.configer.get('train', 'data_transformer')
-                )
+                ) if self.tensor_aug_transform is None else self.tensor_aug_transform.collate(*args)
             )
 
-            return trainloader
+            return trainloader if self.tensor_aug_transform is None \
+                else TensorAugLoader(trainloader, self.tensor_aug_transform)
 
         else:
             Log.error('{} train loader is invalid.'.format(self.configer.get('train', 'loader')))
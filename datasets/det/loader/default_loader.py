@@ -13,6 +13,8 @@ import torch
 import numpy as np
 import torch.utils.data as data
 
+from datasets.tools.data_packer import PackReader, PACK_DIR
+from datasets.tools.anno_cache import AnnoCache
 from extensions.parallel.data_container import DataContainer
 from utils.helpers.json_helper import JsonHelper
 from utils.helpers.image_helper import ImageHelper
@@ -27,14 +29,26 @@ class DefaultLoader(data.Dataset):
         self.configer = configer
         self.aug_transform = aug_transform
         self.img_transform = img_transform
-        self.img_list, self.json_list = self.__list_dirs(root_dir, dataset)
+        self.pack_reader = None
+        self.anno_cache = None
+        if self.configer.get('data', 'packed'):
+            self.pack_reader = self.__load_pack(root_dir, dataset)
+        else:
+            self.img_list, self.json_list = self.__list_dirs(root_dir, dataset)
+            if self.configer.get('data', 'anno_cache'):
+                self.anno_cache = AnnoCache(sorted(set([os.path.dirname(json_file) for json_file in self.json_list])))
 
     def __getitem__(self, index):
-        img = ImageHelper.read_image(self.img_list[index],
-                                     tool=self.configer.get('data', 'image_tool'),
-                                     mode=self.configer.get('data', 'input_mode'))
-
-        bboxes, labels = self.__read_json_file(self.json_list[index])
+        if self.pack_reader is not None:
+            img = self.pack_reader.read_image(index, 'image',
+                                              tool=self.configer.get('data', 'image_tool'),
+                                              mode=self.configer.get('data', 'input_mode'))
+            bboxes, labels = self.__read_pack_anno(index)
+        else:
+            img = ImageHelper.read_image(self.img_list[index],
+                                         tool=self.configer.get('data', 'image_tool'),
+                                         mode=self.configer.get('data', 'input_mode'))
+            bboxes, labels = self.__read_json_file(self.json_list[index])
 
         if self.aug_transform is not None:
             img, bboxes, labels = self.aug_transform(img, bboxes=bboxes, labels=labels)
@@ -52,15 +66,50 @@ class DefaultLoader(data.Dataset):
         )
 
     def __len__(self):
+        if self.pack_reader is not None:
+            return len(self.pack_reader)
 
         return len(self.img_list)
 
+    def get_aspect_ratios(self):
+        """The width / height of every sample, for the AspectRatioBatchSampler."""
+        if self.pack_reader is not None:
+            img_sizes = [self.pack_reader.read_image_size(i, 'image') for i in range(len(self.pack_reader))]
+        else:
+            img_sizes = [ImageHelper.read_image_size(img_path) for img_path in self.img_list]
+
+        return [width / height for width, height in img_sizes]
+
+    def __read_pack_anno(self, index):
+        bboxes = self.pack_reader.read_array(index, 'bboxes')
+        labels = self.pack_reader.read_array(index, 'labels')
+        if not self.configer.get('data', 'keep_difficult'):
+            keep = self.pack_reader.read_array(index, 'difficult') == 0
+            bboxes, labels = bboxes[keep], labels[keep]
+
+        return bboxes, labels
+
+    def __load_pack(self, root_dir, dataset):
+        pack_dir_list = [os.path.join(root_dir, dataset, PACK_DIR)]
+        if dataset == 'train' and self.configer.get('data', 'include_val'):
+            pack_dir_list.append(os.path.join(root_dir, 'val', PACK_DIR))
+
+        return PackReader(pack_dir_list)
+
     def __read_json_file(self, json_file):
         """
             filename: JSON file
 
             return: three list: key_points list, centers list and scales list.
         """
+        if self.anno_cache is not None:
+            anno_dict = self.anno_cache.get(json_file)
+            if not self.configer.get('data', 'keep_difficult'):
+                keep = anno_dict['difficult'] == 0
+                return anno_dict['bboxes'][keep], anno_dict['labels'][keep]
+
+            return anno_dict['bboxes'], anno_dict['labels']
+
         json_dict = JsonHelper.load_file(json_file)
 
         labels = list()
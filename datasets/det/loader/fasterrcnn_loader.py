@@ -13,6 +13,7 @@ import torch
 import numpy as np
 import torch.utils.data as data
 
+from datasets.tools.anno_cache import AnnoCache
 from extensions.parallel.data_container import DataContainer
 from utils.helpers.json_helper import JsonHelper
 from utils.helpers.image_helper import ImageHelper
@@ -28,6 +29,9 @@ class FasterRCNNLoader(data.Dataset):
         self.aug_transform = aug_transform
         self.img_transform = img_transform
         self.img_list, self.json_list = self.__list_dirs(root_dir, dataset)
+        self.anno_cache = None
+        if self.configer.get('data', 'anno_cache'):
+            self.anno_cache = AnnoCache(sorted(set([os.path.dirname(json_file) for json_file in self.json_list])))
 
     def __getitem__(self, index):
         img = ImageHelper.read_image(self.img_list[index],
@@ -64,12 +68,25 @@ class FasterRCNNLoader(data.Dataset):
 
         return len(self.img_list)
 
+    def get_aspect_ratios(self):
+        """The width / height of every sample, for the AspectRatioBatchSampler."""
+        img_sizes = [ImageHelper.read_image_size(img_path) for img_path in self.img_list]
+        return [width / height for width, height in img_sizes]
+
     def __read_json_file(self, json_file):
         """
             filename: JSON file
 
             return: three list: key_points list, centers list and scales list.
         """
+        if self.anno_cache is not None:
+            anno_dict = self.anno_cache.get(json_file)
+            if not self.configer.get('data', 'keep_difficult'):
+                keep = anno_dict['difficult'] == 0
+                return anno_dict['bboxes'][keep], anno_dict['labels'][keep]
+
+            return anno_dict['bboxes'], anno_dict['labels']
+
         json_dict = JsonHelper.load_file(json_file)
 
         labels = list()
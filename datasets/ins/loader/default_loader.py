@@ -48,6 +48,11 @@ class DefaultLoader(data.Dataset):
             polygons=DataContainer(polygons, stack=False, cpu_only=True)
         )
 
+    def get_aspect_ratios(self):
+        """The width / height of every sample, for the AspectRatioBatchSampler."""
+        img_sizes = [ImageHelper.read_image_size(img_path) for img_path in self.img_list]
+        return [width / height for width, height in img_sizes]
+
     def __read_json_file(self, json_file):
         """
             filename: JSON file
@@ -12,6 +12,7 @@ import numpy as np
 import torch
 import torch.utils.data as data
 
+from datasets.tools.anno_cache import AnnoCache
 from extensions.parallel.data_container import DataContainer
 from utils.layers.pose.heatmap_generator import HeatmapGenerator
 from utils.helpers.json_helper import JsonHelper
@@ -28,6 +29,9 @@ class DefaultLoader(data.Dataset):
         self.img_transform = img_transform
         self.heatmap_generator = HeatmapGenerator(self.configer)
         (self.img_list, self.json_list) = self.__list_dirs(root_dir, dataset)
+        self.anno_cache = None
+        if self.configer.get('data', 'anno_cache'):
+            self.anno_cache = AnnoCache(sorted(set([os.path.dirname(json_file) for json_file in self.json_list])))
 
     def __getitem__(self, index):
         img = ImageHelper.read_image(self.img_list[index],
@@ -59,6 +63,10 @@ class DefaultLoader(data.Dataset):
 
             return: three list: key_points list, centers list and scales list.
         """
+        if self.anno_cache is not None:
+            anno_dict = self.anno_cache.get(json_file)
+            return anno_dict['kpts'], anno_dict['bboxes']
+
         json_dict = JsonHelper.load_file(json_file)
         kpts = list()
         bboxes = list()
@@ -13,6 +13,8 @@ import torch
 import numpy as np
 import torch.utils.data as data
 
+from datasets.tools.data_packer import PackReader, PACK_DIR
+from datasets.tools.anno_cache import AnnoCache
 from extensions.parallel.data_container import DataContainer
 from utils.layers.pose.heatmap_generator import HeatmapGenerator
 from utils.layers.pose.paf_generator import PafGenerator
@@ -30,22 +32,43 @@ class OpenPoseLoader(data.Dataset):
         self.img_transform = img_transform
         self.heatmap_generator = HeatmapGenerator(self.configer)
         self.paf_generator = PafGenerator(self.configer)
-        self.img_list, self.json_list, self.mask_list = self.__list_dirs(root_dir, dataset)
+        self.pack_reader = None
+        self.anno_cache = None
+        if self.configer.get('data', 'packed'):
+            self.pack_reader = self.__load_pack(root_dir, dataset)
+        else:
+            self.img_list, self.json_list, self.mask_list = self.__list_dirs(root_dir, dataset)
+            if self.configer.get('data', 'anno_cache'):
+                self.anno_cache = AnnoCache(sorted(set([os.path.dirname(json_file) for json_file in self.json_list])))
 
     def __getitem__(self, index):
-        img = ImageHelper.read_image(self.img_list[index],
-                                     tool=self.configer.get('data', 'image_tool'),
-                                     mode=self.configer.get('data', 'input_mode'))
-        if os.path.exists(self.mask_list[index]):
-            maskmap = ImageHelper.read_image(self.mask_list[index],
-                                             tool=self.configer.get('data', 'image_tool'), mode='P')
+        maskmap = None
+        if self.pack_reader is not None:
+            img = self.pack_reader.read_image(index, 'image',
+                                              tool=self.configer.get('data', 'image_tool'),
+                                              mode=self.configer.get('data', 'input_mode'))
+            if self.pack_reader.has_field(index, 'mask'):
+                maskmap = self.pack_reader.read_image(index, 'mask',
+                                                      tool=self.configer.get('data', 'image_tool'), mode='P')
+
+            kpts = self.pack_reader.read_array(index, 'kpts')
+            bboxes = self.pack_reader.read_array(index, 'bboxes')
         else:
-            maskmap = np.ones((img.size[1], img.size[0]), dtype=np.uint8)
+            img = ImageHelper.read_image(self.img_list[index],
+                                         tool=self.configer.get('data', 'image_tool'),
+                                         mode=self.configer.get('data', 'input_mode'))
+            if os.path.exists(self.mask_list[index]):
+                maskmap = ImageHelper.read_image(self.mask_list[index],
+                                                 tool=self.configer.get('data', 'image_tool'), mode='P')
+
+            kpts, bboxes = self.__read_json_file(self.json_list[index])
+
+        if maskmap is None:
+            width, height = ImageHelper.get_size(img)
+            maskmap = np.ones((height, width), dtype=np.uint8)
             if self.configer.get('data', 'image_tool') == 'pil':
                 maskmap = ImageHelper.np2img(maskmap)
 
-        kpts, bboxes = self.__read_json_file(self.json_list[index])
-
         if self.aug_transform is not None and len(bboxes) > 0:
             img, maskmap, kpts, bboxes = self.aug_transform(img, maskmap=maskmap, kpts=kpts, bboxes=bboxes)
 
@@ -75,6 +98,8 @@ class OpenPoseLoader(data.Dataset):
         )
 
     def __len__(self):
+        if self.pack_reader is not None:
+            return len(self.pack_reader)
 
         return len(self.img_list)
 
@@ -84,6 +109,10 @@ class OpenPoseLoader(data.Dataset):
 
             return: three list: key_points list, centers list and scales list.
         """
+        if self.anno_cache is not None:
+            anno_dict = self.anno_cache.get(json_file)
+            return anno_dict['kpts'], anno_dict['bboxes']
+
         json_dict = JsonHelper.load_file(json_file)
 
         kpts = list()
@@ -96,6 +125,13 @@ class OpenPoseLoader(data.Dataset):
 
         return np.array(kpts).astype(np.float32), np.array(bboxes).astype(np.float32)
 
+    def __load_pack(self, root_dir, dataset):
+        pack_dir_list = [os.path.join(root_dir, dataset, PACK_DIR)]
+        if dataset == 'train' and self.configer.get('data', 'include_val'):
+            pack_dir_list.append(os.path.join(root_dir, 'val', PACK_DIR))
+
+        return PackReader(pack_dir_list)
+
     def __list_dirs(self, root_dir, dataset):
         img_list = list()
         json_list = list()
@@ -15,7 +15,9 @@ from datasets.seg.loader.default_loader import DefaultLoader
 import datasets.tools.pil_aug_transforms as pil_aug_trans
 import datasets.tools.cv2_aug_transforms as cv2_aug_trans
 import datasets.tools.transforms as trans
+from datasets.tools.batch_sampler import get_train_batch_sampler
 from datasets.tools.collate import collate
+from datasets.tools.tensor_aug_transforms import TensorAugCompose, TensorAugLoader
 from utils.tools.logger import Logger as Log
 
 
@@ -40,6 +42,13 @@ class DataLoader(object):
             Log.error('Not support {} image tool.'.format(self.configer.get('data', 'image_tool')))
             exit(1)
 
+        self.tensor_aug_transform = None
+        if self.configer.exists('train_trans', 'aug_backend') \
+                and self.configer.get('train_trans', 'aug_backend') == 'tensor':
+            # The train augmentations are applied on the collated batch instead of every sample.
+            self.aug_train_transform = None
+            self.tensor_aug_transform = TensorAugCompose(self.configer, split='train')
+
         self.img_transform = trans.Compose([
             trans.ToTensor(),
             trans.Normalize(div_value=self.configer.get('normalize', 'div_value'),
@@ -52,21 +61,21 @@ class DataLoader(object):
 
     def get_trainloader(self):
         if not self.configer.exists('train', 'loader') or self.configer.get('train', 'loader') == 'default':
+            dataset = DefaultLoader(root_dir=self.configer.get('data', 'data_dir'), dataset='train',
+                                    aug_transform=self.aug_train_transform,
+                                    img_transform=self.img_transform,
+                                    label_transform=self.label_transform,
+                                    configer=self.configer)
             trainloader = data.DataLoader(
-                DefaultLoader(root_dir=self.configer.get('data', 'data_dir'), dataset='train',
-                              aug_transform=self.aug_train_transform,
-                              img_transform=self.img_transform,
-                              label_transform=self.label_transform,
-                              configer=self.configer),
-                batch_size=self.configer.get('train', 'batch_size'), shuffle=True,
+                dataset, batch_sampler=get_train_batch_sampler(dataset, self.configer),
                 num_workers=self.configer.get('data', 'workers'), pin_memory=True,
-                drop_last=self.configer.get('data', 'drop_last'),
                 collate_fn=lambda *args: collate(
                     *args, trans_dict=self.configer.get('train', 'data_transformer')
-                )
+                ) if self.tensor_aug_transform is None else self.tensor_aug_transform.collate(*args)
             )
 
-            return trainloader
+            return trainloader if self.tensor_aug_transform is None \
+                else TensorAugLoader(trainloader, self.tensor_aug_transform)
 
         else:
             Log.error('{} train loader is invalid.'.format(self.configer.get('train', 'loader')))
@@ -11,6 +11,7 @@ import os
 import numpy as np
 from torch.utils import data
 
+from datasets.tools.data_packer import PackReader, PACK_DIR
 from extensions.parallel.data_container import DataContainer
 from utils.helpers.image_helper import ImageHelper
 from utils.tools.logger import Logger as Log
@@ -23,18 +24,33 @@ class DefaultLoader(data.Dataset):
         self.aug_transform = aug_transform
         self.img_transform = img_transform
         self.label_transform = label_transform
-        self.img_list, self.label_list = self.__list_dirs(root_dir, dataset)
+        self.pack_reader = None
+        if self.configer.get('data', 'packed'):
+            self.pack_reader = self.__load_pack(root_dir, dataset)
+        else:
+            self.img_list, self.label_list = self.__list_dirs(root_dir, dataset)
 
     def __len__(self):
+        if self.pack_reader is not None:
+            return len(self.pack_reader)
+
         return len(self.img_list)
 
     def __getitem__(self, index):
-        img = ImageHelper.read_image(self.img_list[index],
-                                     tool=self.configer.get('data', 'image_tool'),
-                                     mode=self.configer.get('data', 'input_mode'))
+        if self.pack_reader is not None:
+            img = self.pack_reader.read_image(index, 'image',
+                                              tool=self.configer.get('data', 'image_tool'),
+                                              mode=self.configer.get('data', 'input_mode'))
+            labelmap = self.pack_reader.read_image(index, 'label',
+                                                   tool=self.configer.get('data', 'image_tool'), mode='P')
+        else:
+            img = ImageHelper.read_image(self.img_list[index],
+                                         tool=self.configer.get('data', 'image_tool'),
+                                         mode=self.configer.get('data', 'input_mode'))
+            labelmap = ImageHelper.read_image(self.label_list[index],
+                                              tool=self.configer.get('data', 'image_tool'), mode='P')
+
         img_size = ImageHelper.get_size(img)
-        labelmap = ImageHelper.read_image(self.label_list[index],
-                                          tool=self.configer.get('data', 'image_tool'), mode='P')
         if self.configer.exists('data', 'label_list'):
             labelmap = self._encode_label(labelmap)
 
@@ -66,6 +82,15 @@ class DefaultLoader(data.Dataset):
             meta=DataContainer(meta, stack=False, cpu_only=True),
         )
 
+    def get_aspect_ratios(self):
+        """The width / height of every sample, for the AspectRatioBatchSampler."""
+        if self.pack_reader is not None:
+            img_sizes = [self.pack_reader.read_image_size(i, 'image') for i in range(len(self.pack_reader))]
+        else:
+            img_sizes = [ImageHelper.read_image_size(img_path) for img_path in self.img_list]
+
+        return [width / height for width, height in img_sizes]
+
     def _reduce_zero_label(self, labelmap):
         if not self.configer.get('data', 'reduce_zero_label'):
             return labelmap
@@ -91,6 +116,13 @@ class DefaultLoader(data.Dataset):
 
         return encoded_labelmap
 
+    def __load_pack(self, root_dir, dataset):
+        pack_dir_list = [os.path.join(root_dir, dataset, PACK_DIR)]
+        if dataset == 'train' and self.configer.get('data', 'include_val'):
+            pack_dir_list.append(os.path.join(root_dir, 'val', PACK_DIR))
+
+        return PackReader(pack_dir_list)
+
     def __list_dirs(self, root_dir, dataset):
         img_list = list()
         label_list = list()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Compile the json labels of a split into ragged numpy arrays.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import argparse
+import tempfile
+import numpy as np
+
+from utils.tools.logger import Logger as Log
+
+
+ANNO_CACHE_FILE = 'anno_cache.npz'
+
+
+class AnnoCompiler(object):
+    """Turn a json dir into one npz file.
+
+    Objects with a bbox are concatenated into bboxes/labels/difficult, objects with kpts into kpts,
+    and bbox_offsets/kpts_offsets give the slice of every json file, so a lookup is O(1).
+    """
+    @staticmethod
+    def parse_objects(json_dict):
+        bboxes, labels, difficult, kpts = list(), list(), list(), list()
+        for object in json_dict['objects']:
+            if 'kpts' in object:
+                kpts.append(object['kpts'])
+
+            if 'bbox' not in object:
+                continue
+
+            bboxes.append(object['bbox'])
+            labels.append(object['label'] if 'label' in object else -1)
+            difficult.append(object['difficult'] if 'difficult' in object else 0)
+
+        anno_dict = dict(
+            bboxes=np.array(bboxes, dtype=np.float32).reshape(-1, 4),
+            labels=np.array(labels, dtype=np.int64),
+            difficult=np.array(difficult, dtype=np.uint8),
+        )
+        if len(kpts) > 0:
+            anno_dict['kpts'] = np.array(kpts, dtype=np.float32)
+
+        return anno_dict
+
+    @staticmethod
+    def get_manifest(json_dir):
+        """The names, sizes & mtimes of the json files, the cache is rebuilt once any of them changes."""
+        name_list = sorted(os.listdir(json_dir))
+        stat_list = [os.stat(os.path.join(json_dir, file_name)) for file_name in name_list]
+        return dict(
+            names=np.array(name_list),
+            file_sizes=np.array([stat.st_size for stat in stat_list], dtype=np.int64),
+            file_mtimes=np.array([stat.st_mtime for stat in stat_list], dtype=np.float64),
+        )
+
+    @staticmethod
+    def compile(json_dir, cache_file):
+        # Stat the files before reading them, so the files edited while compiling are compiled again.
+        manifest = AnnoCompiler.get_manifest(json_dir)
+        anno_list = list()
+        for file_name in manifest['names']:
+            with open(os.path.join(json_dir, str(file_name)), 'r') as json_stream:
+                anno_list.append(AnnoCompiler.parse_objects(json.load(json_stream)))
+
+        kpts_shape = [0, 3]
+        for anno_dict in anno_list:
+            if 'kpts' in anno_dict:
+                kpts_shape = list(anno_dict['kpts'].shape[1:])
+                break
+
+        empty_kpts = np.zeros([0] + kpts_shape, dtype=np.float32)
+        bbox_counts = [len(anno_dict['bboxes']) for anno_dict in anno_list]
+        kpts_list = [anno_dict['kpts'] if 'kpts' in anno_dict else empty_kpts for anno_dict in anno_list]
+        kpts_counts = [len(kpts) for kpts in kpts_list]
+        empty_dict = AnnoCompiler.parse_objects(dict(objects=list()))
+        # Written to a temp file and renamed, so the loaders compiling the same dir never read a partial file.
+        fd, temp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(cache_file)))
+        try:
+            with os.fdopen(fd, 'wb') as temp_stream:
+                np.savez(temp_stream,
+                         bbox_offsets=np.cumsum([0] + bbox_counts).astype(np.int64),
+                         kpts_offsets=np.cumsum([0] + kpts_counts).astype(np.int64),
+                         bboxes=np.concatenate([anno_dict['bboxes'] for anno_dict in anno_list + [empty_dict]]),
+                         labels=np.concatenate([anno_dict['labels'] for anno_dict in anno_list + [empty_dict]]),
+                         difficult=np.concatenate([anno_dict['difficult'] for anno_dict in anno_list + [empty_dict]]),
+                         kpts=np.concatenate(kpts_list + [empty_kpts]),
+                         **manifest)
+
+            # mkstemp creates the file readable by the owner only.
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, cache_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+
+class AnnoCache(object):
+    """Ragged annotation arrays of one or more json dirs, indexed by json path.
+
+    The arrays are loaded once in the main process, and shared copy-on-write by the workers.
+    """
+    def __init__(self, json_dir_list):
+        self.cache_list = list()
+        self.path_index = dict()
+        for json_dir in json_dir_list:
+            cache = self.__load_cache(json_dir)
+            for i, name in enumerate(cache['names']):
+                self.path_index[os.path.join(json_dir, str(name))] = (len(self.cache_list), i)
+
+            self.cache_list.append(cache)
+
+    def __load_cache(self, json_dir):
+        cache_file = os.path.join(os.path.dirname(json_dir), ANNO_CACHE_FILE)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as npz_file:
+                cache = {key: npz_file[key] for key in npz_file.files}
+
+            manifest = AnnoCompiler.get_manifest(json_dir)
+            if all(key in cache and np.array_equal(cache[key], manifest[key]) for key in manifest):
+                return cache
+
+        Log.info('Compile json dir: {} into {}.'.format(json_dir, cache_file))
+        AnnoCompiler.compile(json_dir, cache_file)
+        with np.load(cache_file) as npz_file:
+            return {key: npz_file[key] for key in npz_file.files}
+
+    def get(self, json_file):
+        cache_id, i = self.path_index[json_file]
+        cache = self.cache_list[cache_id]
+        bbox_start, bbox_end = cache['bbox_offsets'][i], cache['bbox_offsets'][i + 1]
+        kpts_start, kpts_end = cache['kpts_offsets'][i], cache['kpts_offsets'][i + 1]
+        return dict(
+            bboxes=cache['bboxes'][bbox_start:bbox_end].copy(),
+            labels=cache['labels'][bbox_start:bbox_end].copy(),
+            difficult=cache['difficult'][bbox_start:bbox_end].copy(),
+            kpts=cache['kpts'][kpts_start:kpts_end].copy(),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root_dir', default=None, type=str,
+                        dest='root_dir', help='The root dir of the default data layout.')
+    parser.add_argument('--dataset', default=['train', 'val'], nargs='+', type=str,
+                        dest='dataset', help='The splits that will be compiled.')
+
+    args = parser.parse_args()
+
+    for dataset in args.dataset:
+        AnnoCompiler.compile(os.path.join(args.root_dir, dataset, 'json'),
+                             os.path.join(args.root_dir, dataset, ANNO_CACHE_FILE))
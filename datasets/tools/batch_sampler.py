@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Batch samplers of the train loaders.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import numpy as np
+from torch.utils import data
+
+from utils.tools.logger import Logger as Log
+
+
+class AspectRatioBatchSampler(data.Sampler):
+    """Shuffled batches, whose samples all come from one aspect ratio group.
+
+    The groups are split by the sorted aspect_ratio_bounds (width / height), e.g. [1.0] puts the portrait and
+    the landscape images into different batches, so max_size collate does not pad them to a common square.
+    """
+    def __init__(self, aspect_ratios, batch_size, aspect_ratio_bounds=(1.0,), drop_last=False):
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.group_ids = np.searchsorted(sorted(aspect_ratio_bounds), np.array(aspect_ratios), side='right')
+        self.group_sizes = np.bincount(self.group_ids, minlength=len(aspect_ratio_bounds) + 1)
+
+    def __iter__(self):
+        batch_list = list()
+        for group_id in range(len(self.group_sizes)):
+            indices = np.random.permutation(np.nonzero(self.group_ids == group_id)[0])
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+
+                batch_list.append(batch.tolist())
+
+        for batch_id in np.random.permutation(len(batch_list)):
+            yield batch_list[batch_id]
+
+    def __len__(self):
+        if self.drop_last:
+            return int(np.sum(self.group_sizes // self.batch_size))
+
+        return int(np.sum((self.group_sizes + self.batch_size - 1) // self.batch_size))
+
+
+def get_train_batch_sampler(dataset, configer):
+    """Group the train batches by aspect ratio if train:aspect_ratio_bounds is set, otherwise shuffle as usual."""
+    if not configer.exists('train', 'aspect_ratio_bounds'):
+        return data.BatchSampler(data.RandomSampler(dataset), configer.get('train', 'batch_size'),
+                                 drop_last=configer.get('data', 'drop_last'))
+
+    start_time = time.time()
+    aspect_ratios = dataset.get_aspect_ratios()
+    Log.info('Read the aspect ratios of {} images in {:.2f}s.'.format(len(aspect_ratios), time.time() - start_time))
+    return AspectRatioBatchSampler(aspect_ratios, configer.get('train', 'batch_size'),
+                                   aspect_ratio_bounds=configer.get('train', 'aspect_ratio_bounds'),
+                                   drop_last=configer.get('data', 'drop_last'))
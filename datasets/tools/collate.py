@@ -11,6 +11,7 @@ import random
 import collections
 import torch
 import torch.nn.functional as F
+from torch.utils.data import get_worker_info
 from torch.utils.data.dataloader import default_collate
 from torch._six import string_classes, int_classes
 
@@ -35,6 +36,37 @@ def stack(batch, data_key=None):
         return default_collate([sample[data_key] for sample in batch])
 
 
+# The fill value of the padded area, for the keys that are scaled and padded by collate.
+PAD_VALUE_DICT = {
+    'img': 0,
+    'labelmap': -1,
+    'maskmap': 1
+}
+
+
+def new_batch_tensor(elem, size, fill_value):
+    """Allocate the stacked tensor of a batch once.
+
+    In the workers it is allocated in shared memory, so sending the batch to the main process does not copy it again.
+    """
+    if get_worker_info() is not None:
+        numel = 1
+        for dim in size:
+            numel *= dim
+
+        if hasattr(elem, 'untyped_storage'):
+            storage = elem.untyped_storage()._new_shared(numel * elem.element_size())
+        else:
+            # the torch versions before the untyped storages.
+            storage = elem.storage()._new_shared(numel)
+
+        out = elem.new_empty(0).set_(storage).view(*size)
+    else:
+        out = elem.new_empty(size)
+
+    return out.fill_(fill_value)
+
+
 def collate(batch, trans_dict):
     data_keys = batch[0].keys()
 
@@ -63,17 +95,23 @@ def collate(batch, trans_dict):
         target_width = target_width + pad_w
         target_height = target_height + pad_h
 
+    # The scaled maps are written into their slots of the preallocated batch tensors directly.
+    dense_keys = [key for key in PAD_VALUE_DICT if key in data_keys]
+    out_dict = dict()
+    for key in dense_keys:
+        elem = batch[0][key].data
+        size = [len(batch)] + list(elem.size()[:-2]) + [target_height, target_width]
+        out_dict[key] = new_batch_tensor(elem, size, PAD_VALUE_DICT[key])
+
     for i in range(len(batch)):
         if 'meta' in data_keys:
             batch[i]['meta'].data['input_size'] = [target_width, target_height]
 
+        dense_dict = {key: batch[i][key].data for key in dense_keys}
         channels, height, width = batch[i]['img'].size()
-        if height == target_height and width == target_width:
-            continue
-
         scaled_size = [width, height]
-
-        if trans_dict['align_method'] in ['only_scale', 'scale_and_pad']:
+        if (height != target_height or width != target_width) \
+                and trans_dict['align_method'] in ['only_scale', 'scale_and_pad']:
             w_scale_ratio = target_width / width
             h_scale_ratio = target_height / height
             if trans_dict['align_method'] == 'scale_and_pad':
@@ -100,25 +138,21 @@ def collate(batch, trans_dict):
 
             scaled_size_hw = (scaled_size[1], scaled_size[0])
 
-            batch[i]['img'] = DataContainer(F.interpolate(batch[i]['img'].data.unsqueeze(0), scaled_size_hw,
-                                                          mode='bilinear', align_corners=False).squeeze(0), stack=True)
-            if 'labelmap' in data_keys:
-                labelmap = batch[i]['labelmap'].data.unsqueeze(0).unsqueeze(0).float()
-                labelmap = F.interpolate(labelmap, scaled_size_hw, mode='nearest').long().squeeze(0).squeeze(0)
-                batch[i]['labelmap'] = DataContainer(labelmap, stack=True)
-
-            if 'maskmap' in data_keys:
-                maskmap = batch[i]['maskmap'].data.unsqueeze(0).unsqueeze(0).float()
-                maskmap = F.interpolate(maskmap, scaled_size_hw, mode='nearest').long().squeeze(0).squeeze(0)
-                batch[i]['maskmap'].data = DataContainer(maskmap, stack=True)
+            dense_dict['img'] = F.interpolate(dense_dict['img'].unsqueeze(0), scaled_size_hw,
+                                              mode='bilinear', align_corners=False).squeeze(0)
+            for key in ['labelmap', 'maskmap']:
+                if key in dense_dict:
+                    dense_map = dense_dict[key].unsqueeze(0).unsqueeze(0).float()
+                    dense_map = F.interpolate(dense_map, scaled_size_hw, mode='nearest').squeeze(0).squeeze(0)
+                    dense_dict[key] = dense_map
 
         pad_width = target_width - scaled_size[0]
         pad_height = target_height - scaled_size[1]
         assert pad_height >= 0 and pad_width >= 0
+        left_pad = 0
+        up_pad = 0
         if pad_width > 0 or pad_height > 0:
             assert trans_dict['align_method'] in ['only_pad', 'scale_and_pad']
-            left_pad = 0
-            up_pad = 0
             if 'pad_mode' not in trans_dict or trans_dict['pad_mode'] == 'random':
                 left_pad = random.randint(0, pad_width)  # pad_left
                 up_pad = random.randint(0, pad_height)  # pad_up
@@ -147,16 +181,6 @@ def collate(batch, trans_dict):
                 Log.error('Invalid pad mode: {}'.format(trans_dict['pad_mode']))
                 exit(1)
 
-            pad = (left_pad, pad_width-left_pad, up_pad, pad_height-up_pad)
-
-            batch[i]['img'] = DataContainer(F.pad(batch[i]['img'].data, pad=pad, value=0), stack=True)
-
-            if 'labelmap' in data_keys:
-                batch[i]['labelmap'] = DataContainer(F.pad(batch[i]['labelmap'].data, pad=pad, value=-1), stack=True)
-
-            if 'maskmap' in data_keys:
-                batch[i]['maskmap'] = DataContainer(F.pad(batch[i]['maskmap'].data, pad=pad, value=1), stack=True)
-
             if 'polygons' in data_keys:
                 for object_id in range(len(batch[i]['polygons'])):
                     for polygon_id in range(len(batch[i]['polygons'][object_id])):
@@ -171,9 +195,8 @@ def collate(batch, trans_dict):
                 batch[i]['bboxes'].data[:, 0::2] += left_pad
                 batch[i]['bboxes'].data[:, 1::2] += up_pad
 
-    return dict({key: stack(batch, data_key=key) for key in data_keys})
-
-
-
-
+        for key in dense_keys:
+            out_dict[key][i, ..., up_pad:up_pad + scaled_size[1], left_pad:left_pad + scaled_size[0]] = dense_dict[key]
 
+    out_dict.update({key: stack(batch, data_key=key) for key in data_keys if key not in out_dict})
+    return out_dict
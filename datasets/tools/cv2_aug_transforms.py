@@ -236,6 +236,8 @@ class RandomHFlip(object):
 
 
 class RandomSaturation(object):
+    photometric = 'hsv'
+
     def __init__(self, lower=0.5, upper=1.5, saturation_ratio=0.5):
         self.lower = lower
         self.upper = upper
@@ -243,67 +245,101 @@ class RandomSaturation(object):
         assert self.upper >= self.lower, "saturation upper must be >= lower."
         assert self.lower >= 0, "saturation lower must be non-negative."
 
+    def sample(self):
+        if random.random() > self.ratio:
+            return None
+
+        return random.uniform(self.lower, self.upper)
+
+    @staticmethod
+    def apply_hsv(img_hsv, factor):
+        img_hsv[:, :, 1] *= factor
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
         assert isinstance(img, np.ndarray)
         assert labelmap is None or isinstance(labelmap, np.ndarray)
         assert maskmap is None or isinstance(maskmap, np.ndarray)
 
-        if random.random() > self.ratio:
+        factor = self.sample()
+        if factor is None:
             return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
         img = img.astype(np.float32)
         img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        img[:, :, 1] *= random.uniform(self.lower, self.upper)
+        self.apply_hsv(img, factor)
         img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
         img = np.clip(img, 0, 255).astype(np.uint8)
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
 class RandomHue(object):
+    photometric = 'hsv'
+
     def __init__(self, delta=18, hue_ratio=0.5):
         assert 0 <= delta <= 360
         self.delta = delta
         self.ratio = hue_ratio
 
+    def sample(self):
+        if random.random() > self.ratio:
+            return None
+
+        return random.uniform(-self.delta, self.delta)
+
+    @staticmethod
+    def apply_hsv(img_hsv, delta):
+        img_hsv[:, :, 0] += delta
+        img_hsv[:, :, 0][img_hsv[:, :, 0] > 360] -= 360
+        img_hsv[:, :, 0][img_hsv[:, :, 0] < 0] += 360
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
         assert isinstance(img, np.ndarray)
         assert labelmap is None or isinstance(labelmap, np.ndarray)
         assert maskmap is None or isinstance(maskmap, np.ndarray)
 
-        if random.random() > self.ratio:
+        delta = self.sample()
+        if delta is None:
             return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
         img = img.astype(np.float32)
         img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        img[:, :, 0] += random.uniform(-self.delta, self.delta)
-        img[:, :, 0][img[:, :, 0] > 360] -= 360
-        img[:, :, 0][img[:, :, 0] < 0] += 360
+        self.apply_hsv(img, delta)
         img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
         img = np.clip(img, 0, 255).astype(np.uint8)
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
 class RandomPerm(object):
+    photometric = 'perm'
+
     def __init__(self, perm_ratio=0.5):
         self.ratio = perm_ratio
         self.perms = ((0, 1, 2), (0, 2, 1),
                       (1, 0, 2), (1, 2, 0),
                       (2, 0, 1), (2, 1, 0))
 
+    def sample(self):
+        if random.random() > self.ratio:
+            return None
+
+        return self.perms[random.randint(0, len(self.perms) - 1)]
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
         assert isinstance(img, np.ndarray)
         assert labelmap is None or isinstance(labelmap, np.ndarray)
         assert maskmap is None or isinstance(maskmap, np.ndarray)
 
-        if random.random() > self.ratio:
+        swap = self.sample()
+        if swap is None:
             return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
-        swap = self.perms[random.randint(0, len(self.perms) - 1)]
         img = img[:, :, swap].astype(np.uint8)
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
 class RandomContrast(object):
+    photometric = 'affine'
+
     def __init__(self, lower=0.5, upper=1.5, contrast_ratio=0.5):
         self.lower = lower
         self.upper = upper
@@ -311,36 +347,59 @@ class RandomContrast(object):
         assert self.upper >= self.lower, "contrast upper must be >= lower."
         assert self.lower >= 0, "contrast lower must be non-negative."
 
+    def sample(self):
+        if random.random() > self.ratio:
+            return None
+
+        return random.uniform(self.lower, self.upper)
+
+    @staticmethod
+    def get_affine(alpha):
+        return alpha, 0.0
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
         assert isinstance(img, np.ndarray)
         assert labelmap is None or isinstance(labelmap, np.ndarray)
         assert maskmap is None or isinstance(maskmap, np.ndarray)
 
-        if random.random() > self.ratio:
+        alpha = self.sample()
+        if alpha is None:
             return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
         img = img.astype(np.float32)
-        img *= random.uniform(self.lower, self.upper)
+        img *= alpha
         img = np.clip(img, 0, 255).astype(np.uint8)
 
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
 class RandomBrightness(object):
+    photometric = 'affine'
+
     def __init__(self, shift_value=30, brightness_ratio=0.5):
         self.shift_value = shift_value
         self.ratio = brightness_ratio
 
+    def sample(self):
+        if random.random() > self.ratio:
+            return None
+
+        return random.randint(-self.shift_value, self.shift_value)
+
+    @staticmethod
+    def get_affine(shift):
+        return 1.0, shift
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
         assert isinstance(img, np.ndarray)
         assert labelmap is None or isinstance(labelmap, np.ndarray)
         assert maskmap is None or isinstance(maskmap, np.ndarray)
 
-        if random.random() > self.ratio:
+        shift = self.sample()
+        if shift is None:
             return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
         img = img.astype(np.float32)
-        shift = random.randint(-self.shift_value, self.shift_value)
         img[:, :, :] += shift
         img = np.around(img)
         img = np.clip(img, 0, 255).astype(np.uint8)
@@ -348,6 +407,69 @@ class RandomBrightness(object):
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
+class FusedPhotometric(object):
+    """Apply a run of consecutive photometric transforms in one pass.
+
+    Leading contrast/brightness/perm ops are folded into one uint8 LUT and one channel swap, which is exact.
+    The rest is done with a single float conversion, and consecutive hue/saturation ops share one HSV round trip.
+    Skipping the uint8 rounding between the float ops is the only difference to applying them one by one.
+    """
+    def __call__(self, img, transforms):
+        assert isinstance(img, np.ndarray)
+
+        params = [(transform, transform.sample()) for transform in transforms]
+        params = [(transform, param) for transform, param in params if param is not None]
+        if len(params) == 0:
+            return img
+
+        i = 0
+        lut = np.arange(256, dtype=np.float32)
+        swap = np.arange(3)
+        while i < len(params) and params[i][0].photometric in ('affine', 'perm'):
+            transform, param = params[i]
+            if transform.photometric == 'affine':
+                alpha, beta = transform.get_affine(param)
+                lut = np.floor(np.clip(lut * alpha + beta, 0, 255))
+            else:
+                swap = swap[list(param)]
+
+            i += 1
+
+        if (lut != np.arange(256)).any():
+            img = cv2.LUT(img, lut.astype(np.uint8))
+
+        if (swap != np.arange(3)).any():
+            img = img[:, :, swap]
+
+        if i == len(params):
+            return np.ascontiguousarray(img)
+
+        img = img.astype(np.float32)
+        while i < len(params):
+            transform, param = params[i]
+            if transform.photometric == 'hsv':
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+                while i < len(params) and params[i][0].photometric == 'hsv':
+                    params[i][0].apply_hsv(img, params[i][1])
+                    i += 1
+
+                img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
+                np.clip(img, 0, 255, out=img)
+                continue
+
+            if transform.photometric == 'affine':
+                alpha, beta = transform.get_affine(param)
+                img *= alpha
+                img += beta
+                np.clip(img, 0, 255, out=img)
+            else:
+                img = img[:, :, list(param)]
+
+            i += 1
+
+        return np.ascontiguousarray(img.astype(np.uint8))
+
+
 class RandomResizedCrop(object):
     """Crop the given PIL Image to random size and aspect ratio.
 
@@ -1067,6 +1189,8 @@ class Resize(object):
         return img, labelmap, maskmap, kpts, bboxes, labels, polygons
 
 
+PHOTOMETRIC_TRANS_LIST = ['random_saturation', 'random_hue', 'random_perm', 'random_contrast', 'random_brightness']
+
 CV2_AUGMENTATIONS_DICT = {
     'random_saturation': RandomSaturation,
     'random_hue': RandomHue,
@@ -1121,6 +1245,12 @@ class CV2AugCompose(object):
             for trans in self.configer.get('val_trans', 'trans_seq'):
                 self.transforms[trans] = CV2_AUGMENTATIONS_DICT[trans](**self.configer.get('val', trans))
 
+        # Fuse the consecutive photometric transforms into one pass, unless {split}_trans:fuse_photometric is false.
+        trans_dict_key = 'train_trans' if self.split == 'train' else 'val_trans'
+        self.fuse_photometric = not self.configer.exists(trans_dict_key, 'fuse_photometric') \
+                                or self.configer.get(trans_dict_key, 'fuse_photometric')
+        self.fused_photometric = FusedPhotometric()
+
     def __call__(self, img, labelmap=None, maskmap=None, kpts=None, bboxes=None, labels=None, polygons=None):
 
         if self.configer.get('data', 'input_mode') == 'RGB':
@@ -1136,16 +1266,26 @@ class CV2AugCompose(object):
                     shuffle_trans_seq = self.configer.get('train_trans', 'shuffle_trans_seq')
                     random.shuffle(shuffle_trans_seq)
 
-            for trans_key in (shuffle_trans_seq + self.configer.get('train_trans', 'trans_seq')):
-                (img, labelmap, maskmap, kpts,
-                 bboxes, labels, polygons) = self.transforms[trans_key](img, labelmap, maskmap,
-                                                                           kpts, bboxes, labels, polygons)
+            trans_seq = shuffle_trans_seq + self.configer.get('train_trans', 'trans_seq')
 
         else:
-            for trans_key in self.configer.get('val_trans', 'trans_seq'):
-                (img, labelmap, maskmap, kpts,
-                 bboxes, labels, polygons) = self.transforms[trans_key](img, labelmap, maskmap,
-                                                                           kpts, bboxes, labels, polygons)
+            trans_seq = self.configer.get('val_trans', 'trans_seq')
+
+        i = 0
+        while i < len(trans_seq):
+            if self.fuse_photometric and trans_seq[i] in PHOTOMETRIC_TRANS_LIST:
+                j = i
+                while j < len(trans_seq) and trans_seq[j] in PHOTOMETRIC_TRANS_LIST:
+                    j += 1
+
+                img = self.fused_photometric(img, [self.transforms[trans_key] for trans_key in trans_seq[i:j]])
+                i = j
+                continue
+
+            (img, labelmap, maskmap, kpts,
+             bboxes, labels, polygons) = self.transforms[trans_seq[i]](img, labelmap, maskmap,
+                                                                       kpts, bboxes, labels, polygons)
+            i += 1
 
         if self.configer.get('data', 'input_mode') == 'RGB':
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Pack the image/json/label/mask layout into large shard files, and read them back through mmap.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import json
+import mmap
+import argparse
+import numpy as np
+from PIL import Image
+
+from datasets.tools.anno_cache import AnnoCompiler
+from utils.helpers.image_helper import ImageHelper
+from utils.tools.logger import Logger as Log
+
+
+PACK_DIR = 'pack'
+INDEX_FILE = 'index.npy'
+META_FILE = 'meta.json'
+NAME_FILE = 'names.txt'
+SHARD_FILE = 'shard_{:05d}.bin'
+
+FILE_FIELDS = ['image', 'label', 'mask']
+ARRAY_FIELDS = ['bboxes', 'labels', 'difficult', 'kpts']
+ARRAY_DTYPES = {
+    'bboxes': 'float32',
+    'labels': 'int64',
+    'difficult': 'uint8',
+    'kpts': 'float32'
+}
+
+ALIGN_BYTES = 8
+DEFAULT_SHARD_SIZE = 1 << 30
+
+
+class DataPacker(object):
+    """Pack one split of the default layout into shard files.
+
+    Layout of ``root_dir/dataset/pack``:
+        shard_xxxxx.bin: concatenated raw file bytes and annotation arrays.
+        index.npy: int64 array of shape [num_samples, num_fields, 3], (shard_id, offset, nbytes) per field,
+                   shard_id is -1 if the field is missing for the sample.
+        meta.json: field names, array dtypes and trailing shapes.
+        names.txt: sample names in index order, only for reference.
+    """
+    def __init__(self, root_dir, dataset, shard_size=DEFAULT_SHARD_SIZE):
+        self.data_dir = os.path.join(root_dir, dataset)
+        self.pack_dir = os.path.join(self.data_dir, PACK_DIR)
+        self.shard_size = shard_size
+        self.fields = FILE_FIELDS + ARRAY_FIELDS
+        self.array_shapes = dict(bboxes=[4], labels=[], difficult=[], kpts=None)
+        if not os.path.exists(self.pack_dir):
+            os.makedirs(self.pack_dir)
+
+    def pack(self):
+        name_list, path_list = self.__list_dirs()
+        index = np.full((len(name_list), len(self.fields), 3), -1, dtype=np.int64)
+        shard_id, shard_stream = 0, open(os.path.join(self.pack_dir, SHARD_FILE.format(0)), 'wb')
+        for i, name in enumerate(name_list):
+            if shard_stream.tell() >= self.shard_size:
+                shard_stream.close()
+                shard_id += 1
+                shard_stream = open(os.path.join(self.pack_dir, SHARD_FILE.format(shard_id)), 'wb')
+
+            blob_dict = dict()
+            for field in FILE_FIELDS:
+                if path_list[field][i] is not None:
+                    with open(path_list[field][i], 'rb') as file_stream:
+                        blob_dict[field] = file_stream.read()
+
+            if path_list['json'][i] is not None:
+                for field, arr in self.__read_json_file(path_list['json'][i]).items():
+                    blob_dict[field] = arr.tobytes()
+
+            for field_id, field in enumerate(self.fields):
+                if field not in blob_dict:
+                    continue
+
+                offset = shard_stream.tell()
+                shard_stream.write(blob_dict[field])
+                shard_stream.write(b'\0' * (-len(blob_dict[field]) % ALIGN_BYTES))
+                index[i, field_id] = (shard_id, offset, len(blob_dict[field]))
+
+            if i % 1000 == 0:
+                Log.info('Packed {} of {}'.format(i, len(name_list)))
+
+        shard_stream.close()
+        np.save(os.path.join(self.pack_dir, INDEX_FILE), index)
+        with open(os.path.join(self.pack_dir, NAME_FILE), 'w') as name_stream:
+            name_stream.write('\n'.join(name_list))
+
+        meta_dict = dict(
+            num_samples=len(name_list),
+            num_shards=shard_id + 1,
+            fields=self.fields,
+            array_dtypes=ARRAY_DTYPES,
+            array_shapes=self.array_shapes
+        )
+        with open(os.path.join(self.pack_dir, META_FILE), 'w') as meta_stream:
+            meta_stream.write(json.dumps(meta_dict))
+
+    def __read_json_file(self, json_file):
+        with open(json_file, 'r') as json_stream:
+            anno_dict = AnnoCompiler.parse_objects(json.load(json_stream))
+
+        if 'kpts' in anno_dict:
+            if self.array_shapes['kpts'] is None:
+                self.array_shapes['kpts'] = list(anno_dict['kpts'].shape[1:])
+
+            assert list(anno_dict['kpts'].shape[1:]) == self.array_shapes['kpts']
+
+        return anno_dict
+
+    def __list_dirs(self):
+        image_dir = os.path.join(self.data_dir, 'image')
+        json_dir = os.path.join(self.data_dir, 'json')
+        label_dir = os.path.join(self.data_dir, 'label')
+        mask_dir = os.path.join(self.data_dir, 'mask')
+        img_extension = os.listdir(image_dir)[0].split('.')[-1]
+        key_dir = json_dir if os.path.exists(json_dir) else label_dir
+
+        name_list = list()
+        path_list = dict(image=list(), json=list(), label=list(), mask=list())
+        for file_name in sorted(os.listdir(key_dir)):
+            image_name = '.'.join(file_name.split('.')[:-1])
+            img_path = os.path.join(image_dir, '{}.{}'.format(image_name, img_extension))
+            if not os.path.exists(img_path):
+                Log.warn('Image Path: {} not exists.'.format(img_path))
+                continue
+
+            name_list.append(image_name)
+            path_list['image'].append(img_path)
+            for field, file_dir, extension in [('json', json_dir, 'json'),
+                                               ('label', label_dir, 'png'), ('mask', mask_dir, 'png')]:
+                file_path = os.path.join(file_dir, '{}.{}'.format(image_name, extension))
+                path_list[field].append(file_path if os.path.exists(file_path) else None)
+
+        return name_list, path_list
+
+
+class PackReader(object):
+    """Random access to the samples of one or more packs.
+
+    The index is loaded with mmap_mode, and shards are mapped lazily in each worker process,
+    so the startup cost does not depend on the number of samples.
+    """
+    def __init__(self, pack_dir_list):
+        self.pack_dir_list = pack_dir_list
+        self.meta_list = list()
+        for pack_dir in self.pack_dir_list:
+            with open(os.path.join(pack_dir, META_FILE), 'r') as meta_stream:
+                self.meta_list.append(json.load(meta_stream))
+
+        self.cum_sizes = np.cumsum([meta['num_samples'] for meta in self.meta_list])
+        self.index_list = None
+        self.shard_dict = dict()
+
+    def __len__(self):
+        return int(self.cum_sizes[-1]) if len(self.cum_sizes) > 0 else 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['index_list'] = None
+        state['shard_dict'] = dict()
+        return state
+
+    def _locate(self, index):
+        pack_id = int(np.searchsorted(self.cum_sizes, index, side='right'))
+        local_index = index - (int(self.cum_sizes[pack_id - 1]) if pack_id > 0 else 0)
+        return pack_id, local_index
+
+    def _get_buffer(self, index, field):
+        if self.index_list is None:
+            self.index_list = [np.load(os.path.join(pack_dir, INDEX_FILE), mmap_mode='r')
+                               for pack_dir in self.pack_dir_list]
+
+        pack_id, local_index = self._locate(index)
+        meta = self.meta_list[pack_id]
+        if field not in meta['fields']:
+            return None
+
+        shard_id, offset, nbytes = self.index_list[pack_id][local_index, meta['fields'].index(field)]
+        if shard_id < 0:
+            return None
+
+        if (pack_id, shard_id) not in self.shard_dict:
+            shard_file = os.path.join(self.pack_dir_list[pack_id], SHARD_FILE.format(shard_id))
+            with open(shard_file, 'rb') as shard_stream:
+                self.shard_dict[(pack_id, shard_id)] = mmap.mmap(shard_stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return memoryview(self.shard_dict[(pack_id, shard_id)])[offset:offset + nbytes]
+
+    def has_field(self, index, field):
+        return self._get_buffer(index, field) is not None
+
+    def read_bytes(self, index, field):
+        return self._get_buffer(index, field)
+
+    def read_array(self, index, field):
+        buf = self._get_buffer(index, field)
+        meta = self.meta_list[self._locate(index)[0]]
+        dtype = np.dtype(meta['array_dtypes'][field])
+        shape = meta['array_shapes'][field] or []
+        if buf is None:
+            return np.zeros([0] + shape, dtype=dtype)
+
+        # Copy out of the read-only mapping, annotations are small and augmented in place.
+        return np.frombuffer(buf, dtype=dtype).reshape([-1] + shape).copy()
+
+    def read_image_size(self, index, field):
+        with Image.open(io.BytesIO(self._get_buffer(index, field))) as img:
+            return list(img.size)
+
+    def read_image(self, index, field, tool='pil', mode='RGB'):
+        return ImageHelper.decode_image(self._get_buffer(index, field), tool=tool, mode=mode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root_dir', default=None, type=str,
+                        dest='root_dir', help='The root dir of the default data layout.')
+    parser.add_argument('--dataset', default=['train', 'val'], nargs='+', type=str,
+                        dest='dataset', help='The splits that will be packed.')
+    parser.add_argument('--shard_size', default=DEFAULT_SHARD_SIZE, type=int,
+                        dest='shard_size', help='The max bytes of each shard file.')
+
+    args = parser.parse_args()
+
+    for dataset in args.dataset:
+        data_packer = DataPacker(args.root_dir, dataset, shard_size=args.shard_size)
+        data_packer.pack()
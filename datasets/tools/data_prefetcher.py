@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You (youansheng@gmail.com)
+# Prefetch the batches of a data loader to the device.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+
+class DataPrefetcher(object):
+    """Iterate a data loader with the tensors of every batch already on the device.
+
+    On gpus the copy of the next batch is issued on a side stream with non-blocking copies from the pinned
+    batches of the loader, so it overlaps with the compute of the current batch.
+    """
+    def __init__(self, data_loader, device):
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def _to_device(self, data_dict):
+        return {key: value.to(self.device, non_blocking=True) if isinstance(value, torch.Tensor) else value
+                for key, value in data_dict.items()}
+
+    def _preload(self, data_iter, stream):
+        try:
+            data_dict = next(data_iter)
+        except StopIteration:
+            return None
+
+        with torch.cuda.stream(stream):
+            return self._to_device(data_dict)
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            for data_dict in self.data_loader:
+                yield self._to_device(data_dict)
+
+            return
+
+        stream = torch.cuda.Stream()
+        data_iter = iter(self.data_loader)
+        next_dict = self._preload(data_iter, stream)
+        while next_dict is not None:
+            torch.cuda.current_stream().wait_stream(stream)
+            data_dict = next_dict
+            for value in data_dict.values():
+                if isinstance(value, torch.Tensor):
+                    # the memory is allocated on the side stream but used on the current one.
+                    value.record_stream(torch.cuda.current_stream())
+
+            next_dict = self._preload(data_iter, stream)
+            yield data_dict
@@ -0,0 +1,887 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You (youansheng@gmail.com)
+# Batched augmentations on the collated tensors, which run on the GPU or vectorized on the CPU.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from datasets.tools.collate import collate
+from utils.tools.logger import Logger as Log
+
+
+# Collated without resizing, so that the geometric transforms see the original images.
+RAW_TRANS_DICT = dict(size_mode='max_size', align_method='only_pad', pad_mode='pad_right_down')
+BORDER_KEY = 'aug_border_size'
+
+
+def _rand(size, device, low=0.0, high=1.0):
+    return torch.rand(size, device=device) * (high - low) + low
+
+
+def _randint(low, high):
+    """Uniform integers in [low, high] for every element, same as random.randint."""
+    low, high = low.float(), high.float()
+    return torch.max(torch.min(low + torch.floor(torch.rand_like(low) * (high - low + 1)), high), low)
+
+
+def _translate(offset):
+    mat = torch.eye(3, device=offset.device).repeat(offset.size(0), 1, 1)
+    mat[:, 0, 2] = offset[:, 0]
+    mat[:, 1, 2] = offset[:, 1]
+    return mat
+
+
+def _scale(scale):
+    # Scale the pixel corners, (x + 0.5) * s - 0.5 in the pixel index coordinates.
+    mat = torch.eye(3, device=scale.device).repeat(scale.size(0), 1, 1)
+    mat[:, 0, 0] = scale[:, 0]
+    mat[:, 1, 1] = scale[:, 1]
+    mat[:, 0, 2] = 0.5 * scale[:, 0] - 0.5
+    mat[:, 1, 2] = 0.5 * scale[:, 1] - 0.5
+    return mat
+
+
+class AugState(object):
+    """Geometric state of one batch.
+
+    mat maps the pixel index coordinates of the collated input to the augmented image of every sample,
+    border is the (width, height) of every augmented image. The bboxes and kpts of the whole batch are
+    concatenated, and updated eagerly with the batch index of every row.
+    """
+    def __init__(self, border, bboxes=None, labels=None, kpts=None):
+        self.batch_size = border.size(0)
+        self.device = border.device
+        self.mat = torch.eye(3, device=self.device).repeat(self.batch_size, 1, 1)
+        self.in_border = border.float()
+        self.border = border.float()
+        self.flip = torch.zeros(self.batch_size, dtype=torch.bool, device=self.device)
+        self.bboxes, self.bbox_index = self.__cat(bboxes, [4])
+        self.bbox_keep = None if bboxes is None else torch.ones(len(self.bboxes), dtype=torch.bool, device=self.device)
+        self.labels = None if labels is None else torch.cat([label.view(-1) for label in labels]).to(self.device)
+        num_kpts = [tensor.size(1) for tensor in kpts if tensor.numel() > 0] if kpts is not None else []
+        self.kpts, self.kpts_index = self.__cat(kpts, [num_kpts[0] if len(num_kpts) > 0 else 0, 3])
+
+    def __cat(self, tensor_list, shape):
+        if tensor_list is None:
+            return None, None
+
+        tensor_list = [tensor.float().view([-1] + shape) if tensor.numel() > 0 else torch.zeros([0] + shape)
+                       for tensor in tensor_list]
+        index = torch.cat([torch.full((len(tensor),), i, dtype=torch.long) for i, tensor in enumerate(tensor_list)])
+        return torch.cat(tensor_list).to(self.device), index.to(self.device)
+
+    def apply(self, mat, border):
+        """Compose the [B, 3, 3] mat, and move the annotations with it."""
+        self.mat = torch.bmm(mat, self.mat)
+        self.border = border.float()
+        if self.bboxes is not None and self.bboxes.numel() > 0:
+            corners = torch.stack([self.bboxes[:, [0, 1]], self.bboxes[:, [2, 1]],
+                                   self.bboxes[:, [0, 3]], self.bboxes[:, [2, 3]]], 1)
+            corners = self.__transform(corners, self.bbox_index, mat)
+            self.bboxes = torch.cat([corners.min(1)[0], corners.max(1)[0]], 1)
+
+        if self.kpts is not None and self.kpts.numel() > 0:
+            self.kpts[:, :, :2] = self.__transform(self.kpts[:, :, :2], self.kpts_index, mat)
+
+    @staticmethod
+    def __transform(points, index, mat):
+        mat = mat[index]
+        return torch.matmul(points, mat[:, :2, :2].transpose(1, 2)) + mat[:, None, :2, 2]
+
+    def crop(self, offset, target_size, apply_mask, allow_outside_center=True, clip_bboxes=True, mark_kpts=False):
+        """Move the [B, 2] offset to the origin, and crop every sample to the [B, 2] target_size."""
+        offset = torch.where(apply_mask[:, None], offset, torch.zeros_like(offset))
+        target_size = torch.where(apply_mask[:, None], target_size, self.border)
+        if self.bboxes is not None and self.bboxes.numel() > 0 and not allow_outside_center:
+            center = (self.bboxes[:, :2] + self.bboxes[:, 2:]) / 2
+            crop_lt, crop_rb = offset[self.bbox_index], (offset + target_size)[self.bbox_index]
+            inside = ((crop_lt <= center) & (center < crop_rb)).all(1)
+            self.bbox_keep &= inside | ~apply_mask[self.bbox_index]
+
+        self.apply(_translate(-offset), target_size)
+        if self.bboxes is not None and self.bboxes.numel() > 0 and clip_bboxes:
+            max_xy = (self.border - 1)[self.bbox_index].repeat(1, 2)
+            clipped = torch.max(torch.min(self.bboxes, max_xy), torch.zeros_like(self.bboxes))
+            self.bboxes = torch.where(apply_mask[self.bbox_index][:, None], clipped, self.bboxes)
+            valid = (self.bboxes[:, :2] < self.bboxes[:, 2:]).all(1)
+            self.bbox_keep &= valid | ~apply_mask[self.bbox_index]
+
+        if self.kpts is not None and self.kpts.numel() > 0 and mark_kpts:
+            border = self.border[self.kpts_index][:, None]
+            outside = ((self.kpts[:, :, :2] < 0) | (self.kpts[:, :, :2] >= border)).any(2)
+            outside &= apply_mask[self.kpts_index][:, None]
+            self.kpts[:, :, 2][outside] = -1
+
+    def padded_bboxes(self):
+        """The kept bboxes as a [B, M, 4] tensor, and the [B, M] mask of the valid rows."""
+        keep = self.bbox_keep
+        counts = torch.bincount(self.bbox_index[keep], minlength=self.batch_size)
+        max_count = max(int(counts.max()), 1) if self.batch_size > 0 else 1
+        bboxes = torch.zeros(self.batch_size, max_count, 4, device=self.device)
+        valid = torch.zeros(self.batch_size, max_count, dtype=torch.bool, device=self.device)
+        rows = torch.nonzero(keep).view(-1)
+        if rows.numel() > 0:
+            starts = torch.cumsum(counts, 0) - counts
+            slot = torch.arange(rows.numel(), device=self.device) - starts[self.bbox_index[rows]]
+            bboxes[self.bbox_index[rows], slot] = self.bboxes[rows]
+            valid[self.bbox_index[rows], slot] = True
+
+        return bboxes, valid, rows
+
+
+class RandomPad(object):
+    """Pad every sample to a random up scaled size, the padding is filled with the mean."""
+    def __init__(self, up_scale_range=None, pad_ratio=0.5, mean=(104, 117, 123)):
+        assert isinstance(up_scale_range, (list, tuple))
+        self.up_scale_range = up_scale_range
+        self.ratio = pad_ratio
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) <= self.ratio
+        size = (state.batch_size, 50)
+        scale = _rand(size, state.device, *self.up_scale_range)
+        min_ratio = torch.clamp(1. / scale / scale, min=0.5)
+        max_ratio = torch.clamp(scale * scale, max=2.0)
+        ratio = torch.sqrt(_rand(size, state.device) * (max_ratio - min_ratio) + min_ratio)
+        ws, hs = scale * ratio, scale / ratio
+        ok = (ws >= 1) & (hs >= 1)
+        first = torch.argmax(torch.cat([ok, torch.ones_like(ok[:, :1])], 1).int(), 1)
+        fallback = _rand(state.batch_size, state.device, *self.up_scale_range)
+        ws = torch.cat([ws, fallback[:, None]], 1).gather(1, first[:, None])[:, 0]
+        hs = torch.cat([hs, fallback[:, None]], 1).gather(1, first[:, None])[:, 0]
+
+        up_size = torch.floor(torch.stack([ws, hs], 1) * state.border)
+        pad_size = _randint(torch.zeros_like(up_size), up_size - state.border)
+        left_up = _randint(torch.zeros_like(pad_size), pad_size)
+        state.crop(-left_up, state.border + pad_size, apply_mask, clip_bboxes=False)
+
+
+class Padding(object):
+    """Pad every sample with the fixed (left, up, right, down) pad."""
+    def __init__(self, pad=None, pad_ratio=0.5, mean=(104, 117, 123), allow_outside_center=True):
+        self.pad = pad
+        self.ratio = pad_ratio
+        self.allow_outside_center = allow_outside_center
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) <= self.ratio
+        left_pad, up_pad, right_pad, down_pad = self.pad
+        offset = torch.tensor([-left_pad, -up_pad], dtype=torch.float, device=state.device)
+        offset = offset.repeat(state.batch_size, 1)
+        target_size = state.border + torch.tensor([left_pad + right_pad, up_pad + down_pad],
+                                                  dtype=torch.float, device=state.device)
+        state.crop(offset, target_size, apply_mask,
+                   allow_outside_center=self.allow_outside_center, mark_kpts=True)
+
+
+class RandomHFlip(object):
+    def __init__(self, swap_pair=None, flip_ratio=0.5):
+        self.swap_pair = swap_pair
+        self.ratio = flip_ratio
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) <= self.ratio
+        mat = torch.eye(3, device=state.device).repeat(state.batch_size, 1, 1)
+        mat[:, 0, 0] = torch.where(apply_mask, -torch.ones_like(state.border[:, 0]), mat[:, 0, 0])
+        mat[:, 0, 2] = torch.where(apply_mask, state.border[:, 0] - 1, mat[:, 0, 2])
+        state.flip ^= apply_mask
+        state.apply(mat, state.border)
+
+
+class RandomResize(object):
+    """Resize every sample with a random scale and aspect ratio."""
+    def __init__(self, scale_range=(0.75, 1.25), aspect_range=(0.9, 1.1), target_size=None,
+                 resize_bound=None, method='random', resize_ratio=0.5):
+        self.scale_range = scale_range
+        self.aspect_range = aspect_range
+        self.resize_bound = resize_bound
+        self.method = method
+        self.ratio = resize_ratio
+
+        if target_size is not None:
+            if isinstance(target_size, int):
+                self.input_size = (target_size, target_size)
+            elif isinstance(target_size, (list, tuple)) and len(target_size) == 2:
+                self.input_size = target_size
+            else:
+                raise TypeError('Got inappropriate size arg: {}'.format(target_size))
+        else:
+            self.input_size = None
+
+        if self.method not in ['random', 'focus', 'bound']:
+            Log.error('Resize method {} is invalid.'.format(self.method))
+            exit(1)
+
+    def get_scale(self, state):
+        scale_ratio = _rand(state.batch_size, state.device, *self.scale_range)
+        if self.method == 'focus' and self.input_size is not None and state.bboxes is not None:
+            bboxes, valid, _ = state.padded_bboxes()
+            border = (bboxes[:, :, 2:] - bboxes[:, :, :2]) * valid[:, :, None].float()
+            input_size = torch.tensor(self.input_size, dtype=torch.float, device=state.device)
+            max_border = (border.max(1)[0] / input_size).max(1)[0]
+            has_bboxes = valid.any(1)
+            return torch.where(has_bboxes, scale_ratio * 0.6 / max_border.clamp(min=1e-6), scale_ratio)
+
+        elif self.method == 'bound':
+            scale1 = self.resize_bound[0] / state.border.min(1)[0]
+            scale2 = self.resize_bound[1] / state.border.max(1)[0]
+            return torch.min(scale1, scale2)
+
+        return scale_ratio
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) < self.ratio
+        scale_ratio = self.get_scale(state)
+        aspect_ratio = _rand(state.batch_size, state.device, *self.aspect_range)
+        scale = torch.stack([torch.sqrt(aspect_ratio) * scale_ratio,
+                             torch.sqrt(1.0 / aspect_ratio) * scale_ratio], 1)
+        scale = torch.where(apply_mask[:, None], scale, torch.ones_like(scale))
+        converted_size = torch.floor(state.border * scale).clamp(min=1)
+        state.apply(_scale(converted_size / state.border), converted_size)
+
+
+class RandomRotate(object):
+    """Rotate every sample around its center, the canvas is enlarged to keep the whole image."""
+    def __init__(self, max_degree, rotate_ratio=0.5, mean=(104, 117, 123)):
+        assert isinstance(max_degree, int)
+        self.max_degree = max_degree
+        self.ratio = rotate_ratio
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) < self.ratio
+        rotate_degree = _rand(state.batch_size, state.device, -self.max_degree, self.max_degree)
+        rotate_degree = torch.where(apply_mask, rotate_degree, torch.zeros_like(rotate_degree))
+        # The same matrix as cv2.getRotationMatrix2D.
+        alpha = torch.cos(rotate_degree * math.pi / 180)
+        beta = torch.sin(rotate_degree * math.pi / 180)
+        center = state.border / 2.0
+        new_size = torch.stack([state.border[:, 1] * beta.abs() + state.border[:, 0] * alpha.abs(),
+                                state.border[:, 1] * alpha.abs() + state.border[:, 0] * beta.abs()], 1)
+        new_size = torch.where(apply_mask[:, None], torch.floor(new_size + 1e-4), state.border)
+        mat = torch.eye(3, device=state.device).repeat(state.batch_size, 1, 1)
+        mat[:, 0, 0], mat[:, 0, 1] = alpha, beta
+        mat[:, 1, 0], mat[:, 1, 1] = -beta, alpha
+        mat[:, 0, 2] = (1 - alpha) * center[:, 0] - beta * center[:, 1] + new_size[:, 0] / 2.0 - center[:, 0]
+        mat[:, 1, 2] = beta * center[:, 0] + (1 - alpha) * center[:, 1] + new_size[:, 1] / 2.0 - center[:, 1]
+        state.apply(mat, new_size)
+
+
+class RandomCrop(object):
+    """Crop every sample at a random location.
+
+    Args:
+        size (int or tuple): Desired output size of the crop.(w, h)
+    """
+    def __init__(self, crop_size, crop_ratio=0.5, method='random', grid=None, allow_outside_center=True):
+        self.ratio = crop_ratio
+        self.method = method
+        self.grid = grid
+        self.allow_outside_center = allow_outside_center
+
+        if isinstance(crop_size, float):
+            self.size = (crop_size, crop_size)
+        elif isinstance(crop_size, (list, tuple)) and len(crop_size) == 2:
+            self.size = crop_size
+        else:
+            raise TypeError('Got inappropriate size arg: {}'.format(crop_size))
+
+        if self.method not in ['center', 'random', 'grid']:
+            Log.error('Crop method {} is invalid.'.format(self.method))
+            exit(1)
+
+    def get_lefttop(self, crop_size, img_size):
+        if self.method == 'center':
+            return torch.floor((img_size - crop_size) / 2)
+
+        elif self.method == 'random':
+            return _randint(torch.zeros_like(img_size), img_size - crop_size)
+
+        grid = torch.tensor(self.grid, dtype=torch.float, device=img_size.device)
+        grid_xy = _randint(torch.zeros_like(img_size), (grid - 1).expand_as(img_size))
+        return grid_xy * torch.floor((img_size - crop_size) / (grid - 1))
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) <= self.ratio
+        crop_size = torch.tensor(self.size, dtype=torch.float, device=state.device)
+        target_size = torch.min(crop_size.expand_as(state.border), state.border)
+        offset = self.get_lefttop(target_size, state.border)
+        state.crop(offset, target_size, apply_mask, allow_outside_center=self.allow_outside_center)
+
+
+class RandomFocusCrop(object):
+    """Crop every sample around the center of its largest bbox."""
+    def __init__(self, crop_size, crop_ratio=0.5, center_jitter=None, mean=(104, 117, 123), allow_outside_center=True):
+        self.ratio = crop_ratio
+        self.center_jitter = center_jitter
+        self.allow_outside_center = allow_outside_center
+
+        if isinstance(crop_size, float):
+            self.size = (crop_size, crop_size)
+        elif isinstance(crop_size, (list, tuple)) and len(crop_size) == 2:
+            self.size = crop_size
+        else:
+            raise TypeError('Got inappropriate size arg: {}'.format(crop_size))
+
+    def get_center(self, state, crop_size):
+        half_size = torch.floor(crop_size / 2).expand_as(state.border)
+        center = torch.where(state.border > crop_size,
+                             _randint(half_size, state.border - half_size), torch.floor(state.border / 2))
+        if state.bboxes is None:
+            return center
+
+        bboxes, valid, _ = state.padded_bboxes()
+        area = (bboxes[:, :, 2] - bboxes[:, :, 0]) * (bboxes[:, :, 3] - bboxes[:, :, 1])
+        area[~valid] = -1
+        max_bboxes = bboxes.gather(1, area.argmax(1)[:, None, None].expand(-1, 1, 4))[:, 0]
+        max_center = (max_bboxes[:, :2] + max_bboxes[:, 2:]) / 2
+        if self.center_jitter is not None:
+            jitter = torch.full_like(max_center, self.center_jitter)
+            max_center += _randint(-jitter, jitter)
+
+        return torch.where(valid.any(1)[:, None], max_center, center)
+
+    def __call__(self, state):
+        apply_mask = torch.rand(state.batch_size, device=state.device) <= self.ratio
+        crop_size = torch.tensor(self.size, dtype=torch.float, device=state.device)
+        offset = torch.floor(self.get_center(state, crop_size) - torch.floor(crop_size / 2))
+        state.crop(offset, crop_size.expand_as(state.border), apply_mask,
+                   allow_outside_center=self.allow_outside_center, mark_kpts=True)
+
+
+class RandomDetCrop(object):
+    """The ssd crop, with the 50 trials of every sample drawn at once.
+
+    A sample that fails all the trials draws a new mode, like the while loop of the per sample version,
+    up to max_rounds times.
+    """
+    def __init__(self, det_crop_ratio=0.5, mean=(104, 117, 123), allow_outside_center=True, max_rounds=10):
+        self.ratio = det_crop_ratio
+        self.max_rounds = max_rounds
+        # using entire original input image, then the min jaccard of (.1, .3, .5, .7, .9), randomly sample a patch.
+        self.min_ious = (None, 0.1, 0.3, 0.5, 0.7, 0.9, float('-inf'))
+
+    def sample_rects(self, state, num_trials=50):
+        size = (state.batch_size, num_trials)
+        scale = _rand(size, state.device, 0.3, 1.)
+        min_ratio = torch.clamp(scale * scale, min=0.5)
+        max_ratio = torch.clamp(1. / scale / scale, max=2.0)
+        ratio = torch.sqrt(_rand(size, state.device) * (max_ratio - min_ratio) + min_ratio)
+        width, height = state.border[:, 0:1], state.border[:, 1:2]
+        w = torch.floor(scale * ratio * width)
+        h = torch.floor((scale / ratio) * height)
+        left = _randint(torch.zeros_like(w), width - w)
+        top = _randint(torch.zeros_like(h), height - h)
+        return torch.stack([left, top, left + w, top + h], 2)
+
+    def __call__(self, state):
+        assert state.bboxes is not None
+        bboxes, valid, _ = state.padded_bboxes()
+        pending = (torch.rand(state.batch_size, device=state.device) <= self.ratio) & valid.any(1)
+        crop_rect = torch.cat([torch.zeros_like(state.border), state.border], 1)
+        apply_mask = torch.zeros_like(pending)
+        area_a = ((bboxes[:, :, 2] - bboxes[:, :, 0]) * (bboxes[:, :, 3] - bboxes[:, :, 1]))[:, :, None]
+        centers = ((bboxes[:, :, :2] + bboxes[:, :, 2:]) / 2.0)[:, :, None]
+        for _ in range(self.max_rounds):
+            if not pending.any():
+                break
+
+            mode = torch.randint(0, len(self.min_ious), (state.batch_size,), device=state.device)
+            pending &= mode != 0
+            min_iou = torch.tensor([-1.0 if iou is None else iou for iou in self.min_ious],
+                                   device=state.device)[mode]
+            rects = self.sample_rects(state)[:, None]
+            max_xy = torch.min(bboxes[:, :, None, 2:], rects[:, :, :, 2:])
+            min_xy = torch.max(bboxes[:, :, None, :2], rects[:, :, :, :2])
+            inter = (max_xy - min_xy).clamp(min=0).prod(3)
+            area_b = (rects[:, :, :, 2] - rects[:, :, :, 0]) * (rects[:, :, :, 3] - rects[:, :, :, 1])
+            overlap = inter / (area_a + area_b - inter)
+            overlap[~valid] = float('inf')
+            ok = overlap.min(1)[0] >= min_iou[:, None]
+            in_rect = ((rects[:, :, :, :2] < centers) & (rects[:, :, :, 2:] > centers)).all(3) & valid[:, :, None]
+            ok &= in_rect.any(1)
+            found = ok.any(1) & pending
+            trial = ok.int().argmax(1)
+            rect = rects[:, 0].gather(1, trial[:, None, None].expand(-1, 1, 4))[:, 0]
+            crop_rect = torch.where(found[:, None], rect, crop_rect)
+            apply_mask |= found
+            pending &= ~found
+
+        if state.bboxes.numel() > 0:
+            rect = crop_rect[state.bbox_index]
+            center = (state.bboxes[:, :2] + state.bboxes[:, 2:]) / 2.0
+            inside = ((rect[:, :2] < center) & (rect[:, 2:] > center)).all(1)
+            crop_mask = apply_mask[state.bbox_index]
+            state.bbox_keep &= inside | ~crop_mask
+            clipped = torch.cat([torch.max(state.bboxes[:, :2], rect[:, :2]),
+                                 torch.min(state.bboxes[:, 2:], rect[:, 2:])], 1)
+            state.bboxes = torch.where(crop_mask[:, None], clipped, state.bboxes)
+
+        state.crop(crop_rect[:, :2], crop_rect[:, 2:] - crop_rect[:, :2], apply_mask, clip_bboxes=False)
+
+
+class RandomResizedCrop(object):
+    """Crop the given samples to random size and aspect ratio, and resize them to the given size."""
+    def __init__(self, size, scale_range=(0.08, 1.0), aspect_range=(3. / 4., 4. / 3.), interpolation=None):
+        self.size = tuple(size)
+        self.scale = scale_range
+        self.ratio = aspect_range
+
+    def get_params(self, state, num_trials=10):
+        size = (state.batch_size, num_trials)
+        width, height = state.border[:, 0:1], state.border[:, 1:2]
+        target_area = _rand(size, state.device, *self.scale) * width * height
+        aspect_ratio = _rand(size, state.device, *self.ratio)
+        w = torch.round(torch.sqrt(target_area * aspect_ratio))
+        h = torch.round(torch.sqrt(target_area / aspect_ratio))
+        swap = torch.rand(size, device=state.device) < 0.5
+        w, h = torch.where(swap, h, w), torch.where(swap, w, h)
+        ok = (w <= width) & (h <= height)
+        trial = ok.int().argmax(1)[:, None]
+        found = ok.any(1)
+        w, h = w.gather(1, trial)[:, 0], h.gather(1, trial)[:, 0]
+        # Fallback to the center square.
+        side = state.border.min(1)[0]
+        crop_size = torch.where(found[:, None], torch.stack([w, h], 1), torch.stack([side, side], 1))
+        offset = torch.where(found[:, None], _randint(torch.zeros_like(crop_size), state.border - crop_size),
+                             torch.floor((state.border - crop_size) / 2))
+        return offset, crop_size
+
+    def __call__(self, state):
+        offset, crop_size = self.get_params(state)
+        state.crop(offset, crop_size, torch.ones(state.batch_size, dtype=torch.bool, device=state.device))
+        target_size = torch.tensor(self.size, dtype=torch.float, device=state.device).expand_as(state.border)
+        state.apply(_scale(target_size / state.border), target_size)
+
+
+class Resize(object):
+    def __init__(self, target_size=None, min_side_length=None, max_side_length=None):
+        self.target_size = target_size
+        self.min_side_length = min_side_length
+        self.max_side_length = max_side_length
+
+    def __call__(self, state):
+        if self.target_size is not None:
+            target_size = torch.tensor(self.target_size, dtype=torch.float, device=state.device)
+            target_size = target_size.expand_as(state.border)
+
+        elif self.min_side_length is not None:
+            scale_ratio = self.min_side_length / state.border.min(1, keepdim=True)[0]
+            target_size = torch.round(state.border * scale_ratio)
+
+        else:
+            scale_ratio = self.max_side_length / state.border.max(1, keepdim=True)[0]
+            target_size = torch.round(state.border * scale_ratio)
+
+        state.apply(_scale(target_size / state.border), target_size)
+
+
+class RandomSaturation(object):
+    photometric = 'hsv'
+
+    def __init__(self, lower=0.5, upper=1.5, saturation_ratio=0.5):
+        self.lower = lower
+        self.upper = upper
+        self.ratio = saturation_ratio
+        assert self.upper >= self.lower, "saturation upper must be >= lower."
+        assert self.lower >= 0, "saturation lower must be non-negative."
+
+    def __call__(self, img):
+        apply_mask = torch.rand(img.size(0), device=img.device) <= self.ratio
+        factor = _rand(img.size(0), img.device, self.lower, self.upper)
+        hue, saturation, value = TensorColor.bgr2hsv(img)
+        saturation = saturation * torch.where(apply_mask, factor, torch.ones_like(factor))[:, None, None]
+        return torch.where(apply_mask[:, None, None, None],
+                           TensorColor.hsv2bgr(hue, saturation, value).clamp(0, 255), img)
+
+
+class RandomHue(object):
+    photometric = 'hsv'
+
+    def __init__(self, delta=18, hue_ratio=0.5):
+        assert 0 <= delta <= 360
+        self.delta = delta
+        self.ratio = hue_ratio
+
+    def __call__(self, img):
+        apply_mask = torch.rand(img.size(0), device=img.device) <= self.ratio
+        delta = _rand(img.size(0), img.device, -self.delta, self.delta)
+        hue, saturation, value = TensorColor.bgr2hsv(img)
+        hue = torch.remainder(hue + torch.where(apply_mask, delta, torch.zeros_like(delta))[:, None, None], 360)
+        return torch.where(apply_mask[:, None, None, None],
+                           TensorColor.hsv2bgr(hue, saturation, value).clamp(0, 255), img)
+
+
+class RandomPerm(object):
+    photometric = 'perm'
+
+    def __init__(self, perm_ratio=0.5):
+        self.ratio = perm_ratio
+        self.perms = ((0, 1, 2), (0, 2, 1),
+                      (1, 0, 2), (1, 2, 0),
+                      (2, 0, 1), (2, 1, 0))
+
+    def __call__(self, img):
+        apply_mask = torch.rand(img.size(0), device=img.device) <= self.ratio
+        perms = torch.tensor(self.perms, device=img.device)
+        swap = perms[torch.randint(0, len(self.perms), (img.size(0),), device=img.device)]
+        swap = torch.where(apply_mask[:, None], swap, perms[0].expand_as(swap))
+        return img.gather(1, swap[:, :, None, None].expand_as(img))
+
+
+class RandomContrast(object):
+    photometric = 'affine'
+
+    def __init__(self, lower=0.5, upper=1.5, contrast_ratio=0.5):
+        self.lower = lower
+        self.upper = upper
+        self.ratio = contrast_ratio
+        assert self.upper >= self.lower, "contrast upper must be >= lower."
+        assert self.lower >= 0, "contrast lower must be non-negative."
+
+    def __call__(self, img):
+        apply_mask = torch.rand(img.size(0), device=img.device) <= self.ratio
+        alpha = _rand(img.size(0), img.device, self.lower, self.upper)
+        alpha = torch.where(apply_mask, alpha, torch.ones_like(alpha))
+        return (img * alpha[:, None, None, None]).clamp(0, 255)
+
+
+class RandomBrightness(object):
+    photometric = 'affine'
+
+    def __init__(self, shift_value=30, brightness_ratio=0.5):
+        self.shift_value = shift_value
+        self.ratio = brightness_ratio
+
+    def __call__(self, img):
+        apply_mask = torch.rand(img.size(0), device=img.device) <= self.ratio
+        shift_value = torch.full((img.size(0),), self.shift_value, device=img.device)
+        shift = torch.where(apply_mask, _randint(-shift_value, shift_value), torch.zeros_like(shift_value))
+        return torch.round(img + shift[:, None, None, None]).clamp(0, 255)
+
+
+class TensorColor(object):
+    """HSV conversions of [B, 3, H, W] BGR tensors, with the ranges of cv2 on float32 images."""
+    @staticmethod
+    def bgr2hsv(img):
+        value, max_index = img.max(1)
+        chroma = value - img.min(1)[0]
+        saturation = torch.where(value > 0, chroma / value.clamp(min=1e-6), torch.zeros_like(value))
+        blue, green, red = img[:, 0], img[:, 1], img[:, 2]
+        safe_chroma = chroma.clamp(min=1e-6)
+        hue = torch.where(max_index == 2, (green - blue) / safe_chroma,
+                          torch.where(max_index == 1, 2.0 + (blue - red) / safe_chroma,
+                                      4.0 + (red - green) / safe_chroma))
+        hue = torch.where(chroma > 0, torch.remainder(hue * 60.0, 360.0), torch.zeros_like(hue))
+        return hue, saturation, value
+
+    @staticmethod
+    def hsv2bgr(hue, saturation, value):
+        channels = list()
+        for n in (1, 3, 5):
+            k = torch.remainder(n + hue / 60.0, 6)
+            channels.append(value - value * saturation * torch.min(torch.min(k, 4 - k), torch.ones_like(k)).clamp(min=0))
+
+        return torch.stack(channels, 1)
+
+
+TENSOR_AUGMENTATIONS_DICT = {
+    'random_saturation': RandomSaturation,
+    'random_hue': RandomHue,
+    'random_perm': RandomPerm,
+    'random_contrast': RandomContrast,
+    'random_brightness': RandomBrightness,
+    'random_pad': RandomPad,
+    'padding': Padding,
+    'random_hflip': RandomHFlip,
+    'random_resize': RandomResize,
+    'random_crop': RandomCrop,
+    'random_focus_crop': RandomFocusCrop,
+    'random_det_crop': RandomDetCrop,
+    'random_resized_crop': RandomResizedCrop,
+    'random_rotate': RandomRotate,
+    'resize': Resize
+}
+
+
+class TensorAugCompose(object):
+    """Apply the train_trans of a collated batch at once, selected with train_trans:aug_backend = 'tensor'.
+
+    The samples are collated at their original size (collate), the geometric transforms compose one affine
+    matrix per sample, and img, labelmap & maskmap are warped with a single grid_sample, followed by the
+    scaling and padding of train:data_transformer. The photometric transforms run on the warped images in
+    their order of the trans_seq, and the area outside of the images is filled with the mean again.
+    The shuffle_trans_seq is shuffled once for a batch.
+    """
+    def __init__(self, configer, split='train'):
+        self.configer = configer
+        self.split = split
+        self.trans_dict_key = 'train_trans' if self.split == 'train' else 'val_trans'
+
+        self.transforms = dict()
+        for trans in self.__get_trans_seq(shuffle=False):
+            if trans not in TENSOR_AUGMENTATIONS_DICT:
+                Log.error('Tensor aug backend does not support {}.'.format(trans))
+                exit(1)
+
+            self.transforms[trans] = TENSOR_AUGMENTATIONS_DICT[trans](**self.configer.get(self.split, trans))
+
+        self.geometric = any([not hasattr(transform, 'photometric') for transform in self.transforms.values()])
+
+    def __get_trans_seq(self, shuffle=True):
+        if self.split != 'train':
+            return self.configer.get('val_trans', 'trans_seq')
+
+        shuffle_trans_seq = []
+        if self.configer.exists('train_trans', 'shuffle_trans_seq'):
+            shuffle_trans_seq_list = self.configer.get('train_trans', 'shuffle_trans_seq')
+            if isinstance(shuffle_trans_seq_list[0], list):
+                if not shuffle:
+                    shuffle_trans_seq = [trans for trans_seq in shuffle_trans_seq_list for trans in trans_seq]
+                else:
+                    shuffle_trans_seq = shuffle_trans_seq_list[np.random.randint(0, len(shuffle_trans_seq_list))]
+
+            else:
+                shuffle_trans_seq = list(shuffle_trans_seq_list)
+                if shuffle:
+                    np.random.shuffle(shuffle_trans_seq)
+
+        return shuffle_trans_seq + self.configer.get('train_trans', 'trans_seq')
+
+    def collate(self, batch):
+        """Collate the samples without resizing, and keep their sizes for the geometric transforms."""
+        if not self.geometric:
+            return collate(batch, trans_dict=self.configer.get(self.split, 'data_transformer'))
+
+        border_size = [[sample['img'].size(2), sample['img'].size(1)] for sample in batch]
+        data_dict = collate(batch, trans_dict=RAW_TRANS_DICT)
+        data_dict[BORDER_KEY] = torch.tensor(border_size, dtype=torch.float)
+        return data_dict
+
+    def __call__(self, data_dict):
+        img = data_dict['img']
+        border = data_dict.pop(BORDER_KEY, None)
+        if border is None:
+            border = torch.tensor([img.size(3), img.size(2)], dtype=torch.float).repeat(img.size(0), 1)
+
+        trans_seq = self.__get_trans_seq()
+        valid = None
+        if self.geometric:
+            state = AugState(border.to(img.device), bboxes=data_dict.get('bboxes', None),
+                             labels=data_dict.get('labels', None), kpts=data_dict.get('kpts', None))
+            for trans in trans_seq:
+                if not hasattr(self.transforms[trans], 'photometric'):
+                    self.transforms[trans](state)
+
+            target_size, scaled_border = self.__fit_canvas(state)
+            valid = self.__warp(data_dict, state, target_size)
+            self.__update_anno(data_dict, state, target_size, scaled_border)
+
+        photometric_seq = [trans for trans in trans_seq if hasattr(self.transforms[trans], 'photometric')]
+        if len(photometric_seq) > 0:
+            img = self.__to_bgr(data_dict['img'])
+            for trans in photometric_seq:
+                img = self.transforms[trans](img)
+
+            img = self.__from_bgr(img)
+            data_dict['img'] = img if valid is None else img * valid
+
+        return data_dict
+
+    def __normalize_params(self, img):
+        shape = (1, -1, 1, 1)
+        mean = torch.tensor(self.configer.get('normalize', 'mean'), dtype=img.dtype, device=img.device).view(shape)
+        std = torch.tensor(self.configer.get('normalize', 'std'), dtype=img.dtype, device=img.device).view(shape)
+        return self.configer.get('normalize', 'div_value'), mean, std
+
+    def __to_bgr(self, img):
+        div_value, mean, std = self.__normalize_params(img)
+        img = (img * std + mean) * div_value
+        return img.flip(1) if self.configer.get('data', 'input_mode') == 'RGB' else img
+
+    def __from_bgr(self, img):
+        div_value, mean, std = self.__normalize_params(img)
+        img = img.flip(1) if self.configer.get('data', 'input_mode') == 'RGB' else img
+        return (img / div_value - mean) / std
+
+    def __fit_canvas(self, state):
+        """Scale and pad every sample to the canvas of data_transformer, in the same way as collate."""
+        trans_dict = self.configer.get(self.split, 'data_transformer')
+        if trans_dict['size_mode'] == 'random_size':
+            target_size = state.border[0].tolist()
+
+        elif trans_dict['size_mode'] == 'fix_size':
+            target_size = trans_dict['input_size']
+
+        elif trans_dict['size_mode'] == 'multi_size':
+            ms_input_size = trans_dict['ms_input_size']
+            target_size = ms_input_size[np.random.randint(0, len(ms_input_size))]
+
+        elif trans_dict['size_mode'] == 'max_size':
+            target_size = state.border.max(0)[0].tolist()
+
+        else:
+            raise NotImplementedError('Size Mode {} is invalid!'.format(trans_dict['size_mode']))
+
+        target_size = [int(target_size[0]), int(target_size[1])]
+        if 'fit_stride' in trans_dict:
+            stride = trans_dict['fit_stride']
+            target_size = [int(math.ceil(size / stride)) * stride for size in target_size]
+
+        canvas = torch.tensor(target_size, dtype=torch.float, device=state.device).expand_as(state.border)
+        if trans_dict['align_method'] in ['only_scale', 'scale_and_pad']:
+            scale = canvas / state.border
+            if trans_dict['align_method'] == 'scale_and_pad':
+                scale = scale.min(1, keepdim=True)[0].expand_as(scale)
+
+            scaled_size = torch.round(state.border * scale)
+            state.apply(_scale(scaled_size / state.border), scaled_size)
+
+        pad_size = canvas - state.border
+        if (pad_size < 0).any():
+            Log.error('The augmented size is larger than the input size {}.'.format(target_size))
+            exit(1)
+
+        pad_mode = trans_dict['pad_mode'] if 'pad_mode' in trans_dict else 'random'
+        if pad_mode == 'random':
+            left_up = _randint(torch.zeros_like(pad_size), pad_size)
+        elif pad_mode == 'pad_border':
+            left_up = pad_size * (torch.rand(state.batch_size, 1, device=state.device) < 0.5).float()
+        elif pad_mode == 'pad_left_up':
+            left_up = pad_size
+        elif pad_mode == 'pad_right_down':
+            left_up = torch.zeros_like(pad_size)
+        elif pad_mode == 'pad_center':
+            left_up = torch.floor(pad_size / 2)
+        else:
+            Log.error('Invalid pad mode: {}'.format(pad_mode))
+            exit(1)
+
+        scaled_border = state.border
+        state.apply(_translate(left_up), canvas)
+        return target_size, scaled_border
+
+    def __warp(self, data_dict, state, target_size):
+        img = data_dict['img']
+        in_height, in_width = img.size(2), img.size(3)
+        out_width, out_height = target_size
+        # Pixel index coordinates to the normalized coordinates of grid_sample (align_corners=False).
+        norm_in = torch.tensor([[2.0 / in_width, 0, 1.0 / in_width - 1],
+                                [0, 2.0 / in_height, 1.0 / in_height - 1],
+                                [0, 0, 1]], device=state.device)
+        denorm_out = torch.tensor([[out_width / 2.0, 0, (out_width - 1) / 2.0],
+                                   [0, out_height / 2.0, (out_height - 1) / 2.0],
+                                   [0, 0, 1]], device=state.device)
+        theta = torch.matmul(torch.matmul(norm_in, torch.inverse(state.mat)), denorm_out)[:, :2]
+        grid = F.affine_grid(theta, [img.size(0), 1, out_height, out_width], align_corners=False)
+
+        # The extra channel is the mask of the original images, 0 on the padding.
+        xs = torch.arange(in_width, device=img.device, dtype=img.dtype)[None, None, :]
+        ys = torch.arange(in_height, device=img.device, dtype=img.dtype)[None, :, None]
+        inside = ((xs < state.in_border[:, 0, None, None]) & (ys < state.in_border[:, 1, None, None])).to(img.dtype)
+        warped = F.grid_sample(torch.cat([img, inside[:, None]], 1), grid,
+                               mode='bilinear', padding_mode='zeros', align_corners=False)
+        data_dict['img'] = warped[:, :-1]
+        valid = warped[:, -1:]
+
+        nearest_list = list()
+        # Shift the labels, so that zero padding gives -1 for labelmap and 1 for maskmap.
+        if 'labelmap' in data_dict:
+            nearest_list.append(data_dict['labelmap'].float() + 1)
+
+        if 'maskmap' in data_dict:
+            nearest_list.append(data_dict['maskmap'].float() - 1)
+
+        if len(nearest_list) > 0:
+            nearest = F.grid_sample(torch.stack(nearest_list, 1).to(img.device), grid,
+                                    mode='nearest', padding_mode='zeros', align_corners=False)
+            if 'labelmap' in data_dict:
+                data_dict['labelmap'] = (nearest[:, 0] - 1).round().to(data_dict['labelmap'].dtype)
+
+            if 'maskmap' in data_dict:
+                data_dict['maskmap'] = (nearest[:, -1] + 1).round().to(data_dict['maskmap'].dtype)
+
+        return valid
+
+    def __update_anno(self, data_dict, state, target_size, scaled_border):
+        if state.bboxes is not None:
+            keep = state.bbox_keep
+            bboxes, index = state.bboxes[keep].cpu(), state.bbox_index[keep].cpu()
+            data_dict['bboxes'] = [bboxes[index == i] for i in range(state.batch_size)]
+            if state.labels is not None:
+                labels = state.labels[keep].cpu()
+                data_dict['labels'] = [labels[index == i] for i in range(state.batch_size)]
+
+            if 'polygons' in data_dict:
+                self.__update_polygons(data_dict, state, keep.cpu(), target_size)
+
+        if state.kpts is not None:
+            kpts, index = state.kpts.cpu(), state.kpts_index.cpu()
+            flip = state.flip.cpu()
+            kpts_list = list()
+            for i in range(state.batch_size):
+                sample_kpts = kpts[index == i]
+                if flip[i] and 'random_hflip' in self.transforms and self.transforms['random_hflip'].swap_pair:
+                    for pair in self.transforms['random_hflip'].swap_pair:
+                        sample_kpts[:, [pair[0] - 1, pair[1] - 1]] = sample_kpts[:, [pair[1] - 1, pair[0] - 1]]
+
+                kpts_list.append(sample_kpts)
+
+            data_dict['kpts'] = kpts_list
+
+        if 'meta' in data_dict:
+            border = scaled_border.round().int().cpu().tolist()
+            for i, meta in enumerate(data_dict['meta']):
+                meta['input_size'] = list(target_size)
+                if 'border_size' in meta:
+                    meta['border_size'] = border[i]
+
+    @staticmethod
+    def __update_polygons(data_dict, state, keep, target_size):
+        mat = state.mat.cpu().numpy()
+        sample_keep = [keep[state.bbox_index.cpu() == i] for i in range(state.batch_size)]
+        for i, polygons in enumerate(data_dict['polygons']):
+            new_polygons = list()
+            for object_id in range(len(polygons)):
+                if not sample_keep[i][object_id]:
+                    continue
+
+                for polygon_id in range(len(polygons[object_id])):
+                    polygon = np.array(polygons[object_id][polygon_id], dtype=np.float32).reshape(-1, 2)
+                    polygon = polygon.dot(mat[i, :2, :2].T) + mat[i, :2, 2]
+                    polygon[:, 0] = np.clip(polygon[:, 0], 0, target_size[0] - 1)
+                    polygon[:, 1] = np.clip(polygon[:, 1], 0, target_size[1] - 1)
+                    polygons[object_id][polygon_id] = polygon.reshape(-1)
+
+                new_polygons.append(polygons[object_id])
+
+            data_dict['polygons'][i] = new_polygons
+
+
+class TensorAugLoader(object):
+    """Wrap a train loader, move every batch to the device and apply the TensorAugCompose.
+
+    The device is cuda when gpu is set, otherwise the transforms run vectorized on the cpu.
+    """
+    def __init__(self, data_loader, aug_transform):
+        self.data_loader = data_loader
+        self.aug_transform = aug_transform
+        self.device = torch.device('cpu' if aug_transform.configer.get('gpu') is None else 'cuda')
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self):
+        for data_dict in self.data_loader:
+            for key in ['img', 'labelmap', 'maskmap']:
+                if key in data_dict:
+                    data_dict[key] = data_dict[key].to(self.device, non_blocking=True)
+
+            yield self.aug_transform(data_dict)
@@ -6,6 +6,7 @@ import model.ICNet_model as ICNet_model
 import cv2
 import os
 
+from models.tools.module_helper import ModuleHelper
 from utils.helpers.video_helper import VideoReader
 from utils.tools.configer import Configer
 
@@ -19,21 +20,18 @@ class PersonSegmentor(object):
 
     def _load_model(self):
         self.fabby_net = ICNet_model.ICNet(32)
-        self.fabby_net.load_state_dict(torch.load(self.configer.get('fabby_model'),
-                                       map_location=lambda storage, loc: storage))
+        self.fabby_net.load_state_dict(ModuleHelper.load_checkpoint(self.configer.get('fabby_model')))
         self.fabby_net.to(self.device)
         self.fabby_net.eval()
         # trimap net
         self.trimap_net = ICNet_model.TrimapNet(64)
-        self.trimap_net.load_state_dict(torch.load(self.configer.get('trimap_model'),
-                                        map_location=lambda storage, loc: storage))
+        self.trimap_net.load_state_dict(ModuleHelper.load_checkpoint(self.configer.get('trimap_model')))
         self.trimap_net.to(self.device)
         self.trimap_net.eval()
 
         # matting net
         self.mat_net = l_Net(16, 64, dmTpye='small')
-        self.mat_net.load_state_dict(torch.load(self.configer.get('mat_model'),
-                                   map_location=lambda storage, loc: storage))
+        self.mat_net.load_state_dict(ModuleHelper.load_checkpoint(self.configer.get('mat_model')))
         self.mat_net.to(self.device)
         self.mat_net.eval()
 
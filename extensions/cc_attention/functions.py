@@ -4,7 +4,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd.function import once_differentiable
 
-from . import _ext
+from extensions.registry import OP_REGISTRY
+
+_ext = None
 
 
 # from libs import InPlaceABN, InPlaceABNSync
@@ -71,8 +73,54 @@ class CA_Map(autograd.Function):
 
         return dw, dg
 
-ca_weight = CA_Weight.apply
-ca_map = CA_Map.apply
+def _skip_own_row(height, device):
+    """The row of every column entry of the weights, the entries skip the row of the position itself."""
+    rows = torch.arange(height - 1, device=device)[:, None]
+    positions = torch.arange(height, device=device)[None, :]
+    return rows + (rows >= positions).long()  # [H-1, H]
+
+
+def ca_weight_torch(t, f):
+    """The criss-cross energies of CA_Weight with tensor ops: the W entries of the row,
+    then the H-1 entries of the column without the position itself, sized [N, H+W-1, H, W]."""
+    n, c, h, w = t.size()
+    row = torch.einsum('ncyx,ncyz->nzyx', (t, f))
+    column = torch.einsum('ncyx,ncix->niyx', (t, f))
+    index = _skip_own_row(h, t.device)[None, :, :, None].expand(n, h - 1, h, w)
+    return torch.cat((row, column.gather(1, index)), 1)
+
+
+def ca_map_torch(weight, g):
+    """The criss-cross aggregation of CA_Map with tensor ops."""
+    n, c, h, w = g.size()
+    out = torch.einsum('nzyx,ncyz->ncyx', (weight[:, :w], g))
+    index = _skip_own_row(h, g.device)[None, :, :, None].expand(n, h - 1, h, w)
+    column = weight.new_zeros((n, h, h, w)).scatter(1, index, weight[:, w:])
+    return out + torch.einsum('niyx,ncix->ncyx', (column, g))
+
+
+def _load_ext(fn):
+    def _loader():
+        global _ext
+        from extensions.cc_attention import _ext as ext
+        _ext = ext
+        return fn
+
+    return _loader
+
+
+OP_REGISTRY.register('ca_weight', 'cuda', _load_ext(CA_Weight.apply))
+OP_REGISTRY.register('ca_weight', 'torch', lambda: ca_weight_torch)
+OP_REGISTRY.register('ca_map', 'cuda', _load_ext(CA_Map.apply))
+OP_REGISTRY.register('ca_map', 'torch', lambda: ca_map_torch)
+
+
+def ca_weight(t, f):
+    return OP_REGISTRY.get('ca_weight', t.device.type)(t, f)
+
+
+def ca_map(weight, g):
+    return OP_REGISTRY.get('ca_map', g.device.type)(weight, g)
 
 
 class CrossAttention(nn.Module):
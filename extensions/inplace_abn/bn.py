@@ -7,7 +7,8 @@ try:
 except ImportError:
     from Queue import Queue
 
-from lib.extensions.inplace_abn.functions import *
+from extensions.inplace_abn.functions import *
+from extensions.registry import OP_REGISTRY
 
 
 class ABN(nn.Module):
@@ -105,8 +106,9 @@ class InPlaceABN(ABN):
         super(InPlaceABN, self).__init__(num_features, eps, momentum, affine, activation, slope)
 
     def forward(self, x):
-        return inplace_abn(x, self.weight, self.bias, self.running_mean, self.running_var,
-                           self.training, self.momentum, self.eps, self.activation, self.slope)
+        return OP_REGISTRY.get("inplace_abn", x.device.type)(
+            x, self.weight, self.bias, self.running_mean, self.running_var,
+            self.training, self.momentum, self.eps, self.activation, self.slope)
 
 
 class InPlaceABNSync(ABN):
@@ -145,6 +147,11 @@ class InPlaceABNSync(ABN):
         self.worker_queues = [Queue(1) for _ in self.worker_ids]
 
     def forward(self, x):
+        backend, abn_sync = OP_REGISTRY.resolve("inplace_abn_sync", x.device.type)
+        if backend == "torch":
+            return abn_sync(x, self.weight, self.bias, self.running_mean, self.running_var,
+                            None, self.training, self.momentum, self.eps, self.activation, self.slope)
+
         if x.get_device() == self.devices[0]:
             # Master mode
             extra = {
@@ -161,8 +168,8 @@ class InPlaceABNSync(ABN):
                 "worker_queue": self.worker_queues[self.worker_ids.index(x.get_device())]
             }
 
-        return inplace_abn_sync(x, self.weight, self.bias, self.running_mean, self.running_var,
-                                extra, self.training, self.momentum, self.eps, self.activation, self.slope)
+        return abn_sync(x, self.weight, self.bias, self.running_mean, self.running_var,
+                        extra, self.training, self.momentum, self.eps, self.activation, self.slope)
 
     def __repr__(self):
         rep = '{name}({num_features}, eps={eps}, momentum={momentum},' \
@@ -2,18 +2,20 @@ from os import path
 
 import torch.autograd as autograd
 import torch.cuda.comm as comm
+import torch.nn.functional as functional
 from torch.autograd.function import once_differentiable
-from torch.utils.cpp_extension import load
+
+from extensions.registry import CppExtension, OP_REGISTRY
 
 _src_path = path.join(path.dirname(path.abspath(__file__)), "src")
-_backend = load(name="inplace_abn",
-                extra_cflags=["-O3"],
-                sources=[path.join(_src_path, f) for f in [
-                    "inplace_abn.cpp",
-                    "inplace_abn_cpu.cpp",
-                    "inplace_abn_cuda.cu"
-                ]],
-                extra_cuda_cflags=["--expt-extended-lambda"])
+_backend = CppExtension(name="inplace_abn",
+                        extra_cflags=["-O3"],
+                        sources=[path.join(_src_path, f) for f in [
+                            "inplace_abn.cpp",
+                            "inplace_abn_cpu.cpp",
+                            "inplace_abn_cuda.cu"
+                        ]],
+                        extra_cuda_cflags=["--expt-extended-lambda"])
 
 # Activation names
 ACT_RELU = "relu"
@@ -253,4 +255,39 @@ class InPlaceABNSync(autograd.Function):
 inplace_abn = InPlaceABN.apply
 inplace_abn_sync = InPlaceABNSync.apply
 
-__all__ = ["inplace_abn", "inplace_abn_sync", "ACT_RELU", "ACT_LEAKY_RELU", "ACT_ELU", "ACT_NONE"]
+
+def abn_torch(x, weight, bias, running_mean, running_var,
+              training=True, momentum=0.1, eps=1e-05, activation=ACT_LEAKY_RELU, slope=0.01):
+    """The fallback of inplace_abn: batch norm and activation with the functional ops, not in place."""
+    x = functional.batch_norm(x, running_mean, running_var, weight, bias, training, momentum, eps)
+    if activation == ACT_RELU:
+        return functional.relu(x, inplace=True)
+    elif activation == ACT_LEAKY_RELU:
+        return functional.leaky_relu(x, negative_slope=slope, inplace=True)
+    elif activation == ACT_ELU:
+        return functional.elu(x, inplace=True)
+    else:
+        return x
+
+
+def abn_sync_torch(x, weight, bias, running_mean, running_var, extra, *args):
+    """The fallback of inplace_abn_sync, the statistics are not synchronized across the gpus."""
+    return abn_torch(x, weight, bias, running_mean, running_var, *args)
+
+
+def _load_backend(fn):
+    def _loader():
+        _backend.load()
+        return fn
+
+    return _loader
+
+
+OP_REGISTRY.register("inplace_abn", "cuda", _load_backend(inplace_abn))
+OP_REGISTRY.register("inplace_abn", "cpu", _load_backend(inplace_abn))
+OP_REGISTRY.register("inplace_abn", "torch", lambda: abn_torch)
+OP_REGISTRY.register("inplace_abn_sync", "cuda", _load_backend(inplace_abn_sync))
+OP_REGISTRY.register("inplace_abn_sync", "torch", lambda: abn_sync_torch)
+
+__all__ = ["inplace_abn", "inplace_abn_sync", "abn_torch", "abn_sync_torch",
+           "ACT_RELU", "ACT_LEAKY_RELU", "ACT_ELU", "ACT_NONE"]
@@ -1,13 +1,121 @@
 import numpy as np
 import torch
 
-from extensions.nms.src.cpu_nms import cpu_nms
-from extensions.nms.src.cpu_soft_nms import cpu_soft_nms
-from extensions.nms.src.gpu_nms import gpu_nms
+from extensions.registry import OP_REGISTRY
+
+
+def _load_gpu_nms():
+    from extensions.nms.src.gpu_nms import gpu_nms
+    return lambda dets, thresh, device_id: gpu_nms(dets, thresh, device_id=device_id)
+
+
+def _load_cpu_nms():
+    from extensions.nms.src.cpu_nms import cpu_nms
+    return lambda dets, thresh, device_id: cpu_nms(dets, thresh)
+
+
+def _load_cpu_soft_nms():
+    from extensions.nms.src.cpu_soft_nms import cpu_soft_nms
+    return cpu_soft_nms
+
+
+OP_REGISTRY.register('nms', 'cuda', _load_gpu_nms)
+OP_REGISTRY.register('nms', 'cpu', _load_cpu_nms)
+OP_REGISTRY.register('nms', 'torch', lambda: torch_nms)
+OP_REGISTRY.register('soft_nms', 'cpu', _load_cpu_soft_nms)
+OP_REGISTRY.register('soft_nms', 'torch', lambda: torch_soft_nms)
+
+
+def _overlaps(boxes1, areas1, boxes2, areas2):
+    # The +1 pixel convention of cpu_nms.
+    lt = torch.max(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = torch.min(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = (rb - lt + 1).clamp(min=0).prod(2)
+    return inter / (areas1[:, None] + areas2[None, :] - inter)
+
+
+def torch_nms(dets, thresh, block_size=1024):
+    """The greedy nms of cpu_nms with tensor ops on the device of dets.
+
+    The boxes are visited in blocks of the score order. A block is first suppressed by the kept boxes of the
+    previous blocks, then its own greedy result is the fixed point of keep[j] = not any(keep[i] & overlap[i, j])
+    over i < j, which is reached by iterating from the unsuppressed boxes.
+
+    Return:
+      keep(tensor): indices of the kept boxes in descending score order.
+
+    """
+    if dets.size(0) == 0:
+        return torch.zeros((0,), dtype=torch.long, device=dets.device)
+
+    order = dets[:, 4].sort(0, descending=True)[1]
+    boxes = dets[order, :4]
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    kept_boxes, kept_areas = boxes[:0], areas[:0]
+    keep_list = list()
+    for start in range(0, boxes.size(0), block_size):
+        block_boxes = boxes[start:start + block_size]
+        block_areas = areas[start:start + block_size]
+        keep = torch.ones((block_boxes.size(0),), dtype=torch.bool, device=dets.device)
+        if kept_boxes.size(0) > 0:
+            keep = ~(_overlaps(kept_boxes, kept_areas, block_boxes, block_areas) >= thresh).any(0)
+
+        positions = torch.arange(block_boxes.size(0), device=dets.device)
+        suppress = (_overlaps(block_boxes, block_areas, block_boxes, block_areas) >= thresh) \
+            & (positions[:, None] < positions[None, :])
+        candidate = keep
+        while True:
+            new_keep = candidate & ~(suppress & keep[:, None]).any(0)
+            if bool((new_keep == keep).all()):
+                break
+
+            keep = new_keep
+
+        keep_list.append(keep.nonzero(as_tuple=True)[0] + start)
+        kept_boxes = torch.cat((kept_boxes, block_boxes[keep]), 0)
+        kept_areas = torch.cat((kept_areas, block_areas[keep]), 0)
+
+    return order[torch.cat(keep_list, 0)]
+
+
+def torch_soft_nms(dets, sigma=0.5, Nt=0.3, threshold=0.001, method=0):
+    """The soft nms of cpu_soft_nms with tensor ops, returns the boxes with the decayed scores and their indices."""
+    boxes = dets[:, :4]
+    scores = dets[:, 4].clone()
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    remaining = torch.ones((dets.size(0),), dtype=torch.bool, device=dets.device)
+    keep_list = list()
+    while bool(remaining.any()):
+        top = scores.masked_fill(~remaining, float('-inf')).argmax()
+        keep_list.append(top.view(1))
+        remaining[top] = False
+        overlap = _overlaps(boxes[top].view(1, 4), areas[top].view(1), boxes, areas)[0]
+        if method == 1:
+            weight = torch.where(overlap > Nt, 1 - overlap, torch.ones_like(overlap))
+        elif method == 2:
+            weight = torch.exp(-(overlap * overlap) / sigma)
+        else:
+            weight = (overlap <= Nt).to(scores.dtype)
+
+        scores = torch.where(remaining, scores * weight, scores)
+        remaining &= scores >= threshold
+
+    if len(keep_list) == 0:
+        return dets[:0], torch.zeros((0,), dtype=torch.long, device=dets.device)
+
+    keep = torch.cat(keep_list, 0)
+    return torch.cat((boxes[keep], scores[keep].unsqueeze(1)), 1), keep
 
 
 def nms(dets, thresh, device_id=None):
     """Dispatch to either CPU or GPU NMS implementations."""
+    is_cuda = device_id is not None or (isinstance(dets, torch.Tensor) and dets.is_cuda)
+    backend, nms_fn = OP_REGISTRY.resolve('nms', 'cuda' if is_cuda else 'cpu')
+    if backend == 'torch':
+        if isinstance(dets, np.ndarray):
+            dets = torch.from_numpy(dets)
+
+        return torch_nms(dets.detach().float(), thresh).cpu().numpy()
 
     if isinstance(dets, torch.Tensor):
         if dets.is_cuda:
@@ -19,23 +127,40 @@ def nms(dets, thresh, device_id=None):
     if dets.shape[0] == 0:
         inds = []
     else:
-        inds = (gpu_nms(dets, thresh, device_id=device_id)
-                if device_id is not None else cpu_nms(dets, thresh))
+        inds = nms_fn(dets, thresh, device_id)
+
+    return np.array(inds, dtype=np.int64)
 
-    return np.array(inds, dtype=np.int)
+
+def tensor_nms(dets, thresh):
+    """NMS of a tensor, the kept indices stay on the device of dets with the torch backend."""
+    if OP_REGISTRY.backend('nms', dets.device.type) == 'torch':
+        return torch_nms(dets.detach().float(), thresh)
+
+    return torch.from_numpy(nms(dets, thresh)).to(dets.device)
 
 
 def soft_nms(dets, max_threshold=0.3, method='linear', sigma=0.5, min_score=0):
+    methods = {'hard': 0, 'linear': 1, 'gaussian': 2}
+    assert method in methods, 'Unknown soft_nms method: {}'.format(method)
+
+    backend, soft_nms_fn = OP_REGISTRY.resolve('soft_nms', 'cpu')
+    if backend == 'torch':
+        _dets = dets.detach().float() if isinstance(dets, torch.Tensor) else torch.from_numpy(dets).float()
+        new_dets, inds = torch_soft_nms(_dets, Nt=max_threshold, method=methods[method],
+                                        sigma=sigma, threshold=min_score)
+        if isinstance(dets, torch.Tensor):
+            return inds, new_dets.to(dets.dtype)
+        else:
+            return inds.numpy(), new_dets.numpy()
+
     if isinstance(dets, torch.Tensor):
         _dets = dets.detach().cpu().numpy()
     else:
         _dets = dets.copy()
     assert isinstance(_dets, np.ndarray)
 
-    methods = {'hard': 0, 'linear': 1, 'gaussian': 2}
-    assert method in methods, 'Unknown soft_nms method: {}'.format(method)
-
-    new_dets, inds = cpu_soft_nms(
+    new_dets, inds = soft_nms_fn(
         _dets, Nt=max_threshold, method=methods[method], sigma=sigma, threshold=min_score)
 
     if isinstance(dets, torch.Tensor):
@@ -43,5 +168,5 @@ def soft_nms(dets, max_threshold=0.3, method='linear', sigma=0.5, min_score=0):
             inds, dtype=torch.long), dets.new_tensor(new_dets)
     else:
         return np.array(
-            inds, dtype=np.int), np.array(
+            inds, dtype=np.int64), np.array(
                 new_dets, dtype=np.float32)
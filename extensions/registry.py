@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Lazy registry of the compiled extensions and their pure torch fallbacks.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import threading
+
+import torch
+
+from utils.tools.logger import Logger as Log
+
+
+BACKENDS = ('cuda', 'cpu', 'torch')
+# The compiled cpu backends can't take cuda tensors, so the cuda tensors fall back to torch directly.
+BACKEND_ORDER = {
+    'cuda': ('cuda', 'torch'),
+    'cpu': ('cpu', 'torch'),
+}
+# e.g. PYTORCHCV_OP_BACKEND=torch skips all the compiled extensions.
+FORCED_BACKEND = os.environ.get('PYTORCHCV_OP_BACKEND', None)
+BUILD_DIR = os.environ.get('PYTORCHCV_EXT_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'pytorchcv', 'extensions'))
+
+
+class CppExtension(object):
+    """A torch cpp extension, which is only compiled (or loaded from the build cache) at its first use.
+
+    The build directory is keyed by the hash of the sources, the files next to them (e.g. the headers and the
+    included .cpp files), the build flags and the torch version, so every version of the sources is compiled
+    once and shared by all the processes.
+    """
+    def __init__(self, name, sources, **kwargs):
+        self.name = name
+        self.sources = sources
+        self.kwargs = kwargs
+        self.module = None
+        self.lock = threading.Lock()
+
+    def source_hash(self):
+        md5 = hashlib.md5()
+        src_dirs = sorted(set(os.path.dirname(source) for source in self.sources))
+        headers = [os.path.join(src_dir, file_name) for src_dir in src_dirs for file_name in sorted(os.listdir(src_dir))
+                   if os.path.splitext(file_name)[1] in ('.h', '.hpp', '.cuh', '.cpp', '.cu')]
+        for file_path in list(self.sources) + [header for header in headers if header not in self.sources]:
+            with open(file_path, 'rb') as f:
+                md5.update(f.read())
+
+        md5.update(repr(sorted(self.kwargs.items())).encode('utf-8'))
+        md5.update(torch.__version__.encode('utf-8'))
+        return md5.hexdigest()[:16]
+
+    def load(self):
+        with self.lock:
+            if self.module is None:
+                from torch.utils.cpp_extension import load, CUDA_HOME
+                if any(source.endswith('.cu') for source in self.sources) and CUDA_HOME is None:
+                    raise RuntimeError('CUDA toolkit is not found for the {} extension.'.format(self.name))
+
+                build_path = os.path.join(BUILD_DIR, '{}_{}'.format(self.name, self.source_hash()))
+                if not os.path.exists(build_path):
+                    os.makedirs(build_path)
+
+                Log.info('Loading {} extension from {}.'.format(self.name, build_path))
+                self.module = load(name=self.name, sources=self.sources,
+                                   build_directory=build_path, verbose=False, **self.kwargs)
+
+        return self.module
+
+    def __getattr__(self, name):
+        if name in ('name', 'sources', 'kwargs', 'module', 'lock'):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+
+class OpRegistry(object):
+    """Resolves every op to the best available backend at its first use on a device type.
+
+    The backends are tried in the order of BACKEND_ORDER, a backend is available if its loader returns the op
+    function without raising, so importing an op module never compiles anything.
+    """
+    def __init__(self):
+        self.loader_dict = dict()
+        self.op_dict = dict()
+        self.lock = threading.Lock()
+
+    def register(self, op_name, backend, loader):
+        assert backend in BACKENDS, 'Unknown backend: {}'.format(backend)
+        self.loader_dict.setdefault(op_name, dict())[backend] = loader
+
+    def resolve(self, op_name, device_type='cpu'):
+        """Return the (backend, function) pair of the op on the device type."""
+        key = (op_name, device_type)
+        if key in self.op_dict:
+            return self.op_dict[key]
+
+        with self.lock:
+            if key not in self.op_dict:
+                backends = BACKEND_ORDER[device_type]
+                if FORCED_BACKEND in backends:
+                    backends = (FORCED_BACKEND,)
+
+                loaders = self.loader_dict.get(op_name, dict())
+                for backend in backends:
+                    if backend not in loaders:
+                        continue
+
+                    try:
+                        self.op_dict[key] = (backend, loaders[backend]())
+                    except Exception as e:
+                        Log.warn('{} backend of {} is not available: {}'.format(backend, op_name, e))
+                        continue
+
+                    Log.info('Use {} backend of {} on {}.'.format(backend, op_name, device_type))
+                    break
+
+                else:
+                    Log.error('No available backend of {} on {}.'.format(op_name, device_type))
+                    exit(1)
+
+        return self.op_dict[key]
+
+    def get(self, op_name, device_type='cpu'):
+        return self.resolve(op_name, device_type)[1]
+
+    def backend(self, op_name, device_type='cpu'):
+        return self.resolve(op_name, device_type)[0]
+
+
+OP_REGISTRY = OpRegistry()
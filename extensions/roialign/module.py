@@ -7,17 +7,16 @@ from torch.autograd.function import once_differentiable
 
 torch_ver = torch.__version__[:3]
 
-from torch.utils.cpp_extension import load
+from extensions.registry import CppExtension, OP_REGISTRY
 
-print('compiling/loading roi_align')
-build_path = '/tmp/bulid'
-if not os.path.exists(build_path):
-    os.makedirs(build_path)
-
-roialign = load(name='roialign', sources=['extensions/roialign/src/roi_align_binding.cpp',
-                                          'extensions/roialign/src/roi_align_forward_cuda.cu',
-                                          'extensions/roialign/src/roi_align_backward_cuda.cu'],
-                build_directory=build_path, verbose=True)
+_src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+roialign = CppExtension(name='roialign', sources=[os.path.join(_src_path, f) for f in [
+    'roi_align_binding.cpp',
+    'roi_align_forward_cuda.cu',
+    'roi_align_backward_cuda.cu'
+]])
+# The cpu kernels only, so they are built on the hosts without the CUDA toolkit.
+roialign_cpu = CppExtension(name='roialign_cpu', sources=[os.path.join(_src_path, 'roi_align_cpu_binding.cpp')])
 
 
 class RoIAlignFunction(Function):
@@ -45,12 +44,12 @@ class RoIAlignFunction(Function):
                                                      sampling_ratio)
 
         elif features.is_cuda == False and rois.is_cuda == False:
-            output = roialign.roi_align_forward_cpu(features,
-                                                    rois,
-                                                    pooled_height,
-                                                    pooled_width,
-                                                    spatial_scale,
-                                                    sampling_ratio)
+            output = roialign_cpu.roi_align_forward_cpu(features,
+                                                        rois,
+                                                        pooled_height,
+                                                        pooled_width,
+                                                        spatial_scale,
+                                                        sampling_ratio)
 
         else:
             raise TypeError('features and rois should be on same device (CPU or GPU)')
@@ -82,16 +81,16 @@ class RoIAlignFunction(Function):
                                                           sampling_ratio)
 
         else:
-            grad_input = roialign.roi_align_backward_cpu(rois,
-                                                         grad_output,
-                                                         features_size[0],
-                                                         features_size[1],
-                                                         features_size[2],
-                                                         features_size[3],
-                                                         pooled_height,
-                                                         pooled_width,
-                                                         spatial_scale,
-                                                         sampling_ratio)
+            grad_input = roialign_cpu.roi_align_backward_cpu(rois,
+                                                             grad_output,
+                                                             features_size[0],
+                                                             features_size[1],
+                                                             features_size[2],
+                                                             features_size[3],
+                                                             pooled_height,
+                                                             pooled_width,
+                                                             spatial_scale,
+                                                             sampling_ratio)
 
         return grad_input, None, None, None, None, None
 
@@ -109,24 +108,94 @@ class RoIAlign2D(Module):
         # features is a Variable/FloatTensor of size BxCxHxW
         # rois is a (optional: list of) Variable/FloatTensor IDX,Xmin,Ymin,Xmax,Ymax (normalized to [0,1])
         rois = preprocess_rois(rois)
-        if scale is None:
-            output = RoIAlignFunction.apply(features,
-                                            rois,
-                                            self.pooled_height,
-                                            self.pooled_width,
-                                            self.spatial_scale,
-                                            self.sampling_ratio)
-        else:
-            output = RoIAlignFunction.apply(features,
-                                            rois,
-                                            self.pooled_height,
-                                            self.pooled_width,
-                                            scale,
-                                            self.sampling_ratio)
+        backend, roi_align = OP_REGISTRY.resolve('roi_align', features.device.type)
+        if backend != 'torch':
+            # the compiled kernels only take float features, e.g. under autocast.
+            features = features.float()
+
+        output = roi_align(features,
+                           rois,
+                           self.pooled_height,
+                           self.pooled_width,
+                           self.spatial_scale if scale is None else scale,
+                           self.sampling_ratio)
 
         return output
 
 
+def _bilinear_axis(coords, size):
+    """The two neighbours and their weights of every sample along an axis, as the RoIAlign kernels."""
+    valid = ((coords >= -1.0) & (coords <= size)).to(coords.dtype)
+    coords = coords.clamp(min=0)
+    low = coords.floor().long()
+    edge = low >= size - 1
+    low = low.clamp(max=size - 1)
+    high = torch.where(edge, low, low + 1)
+    coords = torch.where(edge, low.to(coords.dtype), coords)
+    high_weight = coords - low.to(coords.dtype)
+    return low, high, (1 - high_weight) * valid, high_weight * valid
+
+
+def roi_align_torch(features, rois, pooled_height, pooled_width, spatial_scale, sampling_ratio):
+    """RoIAlign of the compiled kernels with tensor ops, the backward comes from autograd.
+
+    All the rois are sampled at once on a grid of the max sampling number, the samples beyond the adaptive
+    sampling number (ceil(roi_size / pooled_size), for sampling_ratio <= 0) of every roi are masked out.
+    """
+    height, width = features.size(2), features.size(3)
+    batch_index = rois[:, 0].long()
+    boxes = rois[:, 1:5] * spatial_scale
+    roi_width = (boxes[:, 2] - boxes[:, 0]).clamp(min=1.0)
+    roi_height = (boxes[:, 3] - boxes[:, 1]).clamp(min=1.0)
+    bin_width = roi_width / pooled_width
+    bin_height = roi_height / pooled_height
+    if sampling_ratio > 0:
+        grid_width = torch.full_like(bin_width, sampling_ratio)
+        grid_height = torch.full_like(bin_height, sampling_ratio)
+    else:
+        grid_width = bin_width.ceil()
+        grid_height = bin_height.ceil()
+
+    def _samples(start, bin_size, grid, pooled_size):
+        max_grid = max(int(grid.max().item()), 1) if grid.numel() > 0 else 1
+        bins = torch.arange(pooled_size, dtype=start.dtype, device=start.device)
+        steps = torch.arange(max_grid, dtype=start.dtype, device=start.device)
+        coords = start[:, None, None] + bins[None, :, None] * bin_size[:, None, None] \
+            + (steps[None, None, :] + 0.5) * bin_size[:, None, None] / grid[:, None, None]
+        mask = (steps[None, None, :] < grid[:, None, None]).to(start.dtype).expand_as(coords)
+        return coords.contiguous().view(coords.size(0), -1), mask.contiguous().view(coords.size(0), -1), max_grid
+
+    ys, y_mask, max_grid_h = _samples(boxes[:, 1], bin_height, grid_height, pooled_height)
+    xs, x_mask, max_grid_w = _samples(boxes[:, 0], bin_width, grid_width, pooled_width)
+    y_low, y_high, wy_low, wy_high = _bilinear_axis(ys, height)
+    x_low, x_high, wx_low, wx_high = _bilinear_axis(xs, width)
+    wy_low, wy_high = wy_low * y_mask, wy_high * y_mask
+    wx_low, wx_high = wx_low * x_mask, wx_high * x_mask
+
+    feat = features.permute(0, 2, 3, 1)  # [B, H, W, C]
+    b = batch_index[:, None, None]
+    output = 0
+    for y_index, y_weight in ((y_low, wy_low), (y_high, wy_high)):
+        for x_index, x_weight in ((x_low, wx_low), (x_high, wx_high)):
+            weight = (y_weight[:, :, None] * x_weight[:, None, :]).unsqueeze(3)
+            output = output + feat[b, y_index[:, :, None], x_index[:, None, :]] * weight  # [R, Sy, Sx, C]
+
+    num_rois, channels = rois.size(0), features.size(1)
+    output = output.view(num_rois, pooled_height, max_grid_h, pooled_width, max_grid_w, channels).sum(4).sum(2)
+    output = output / (grid_height * grid_width).view(-1, 1, 1, 1)
+    return output.permute(0, 3, 1, 2).contiguous()
+
+
+def _load_roi_align(extension):
+    extension.load()
+    return RoIAlignFunction.apply
+
+
+OP_REGISTRY.register('roi_align', 'cuda', lambda: _load_roi_align(roialign))
+OP_REGISTRY.register('roi_align', 'cpu', lambda: _load_roi_align(roialign_cpu))
+OP_REGISTRY.register('roi_align', 'torch', lambda: roi_align_torch)
+
+
 def preprocess_rois(rois):
     # do some verifications on what has been passed as rois
     if isinstance(rois, list):  # if list, convert to single tensor (used for multiscale)
@@ -7,18 +7,18 @@ import os
 import torch
 from torch.nn import Module
 from torch.autograd import Function
-from torch.utils.cpp_extension import load
 
-torch_ver = torch.__version__[:3]
+from extensions.registry import CppExtension, OP_REGISTRY
 
-print('compiling/loading roi_pool')
-build_path = '/tmp/bulid/roipool'
-if not os.path.exists(build_path):
-    os.makedirs(build_path)
+torch_ver = torch.__version__[:3]
 
-roipool = load(name='roipool', sources=['extensions/roipool/src/roi_pool_binding.cpp',
-                                        'extensions/roipool/src/roi_pool_kernel.cu'],
-               build_directory=build_path, verbose=True)
+_src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+roipool = CppExtension(name='roipool', sources=[os.path.join(_src_path, f) for f in [
+    'roi_pool_binding.cpp',
+    'roi_pool_kernel.cu'
+]])
+# The cpu kernels only, so they are built on the hosts without the CUDA toolkit.
+roipool_cpu = CppExtension(name='roipool_cpu', sources=[os.path.join(_src_path, 'roi_pool_cpu_binding.cpp')])
 
 
 class ROIPoolFunction(Function):
@@ -36,7 +36,7 @@ class ROIPoolFunction(Function):
             ctx.memory = ctx.memory.cuda()
             output = roipool.forward_cuda(feat, rois, pool_h, pool_w, scale, ctx.memory)
         else:
-            output = roipool.forward_cpu(feat, rois, pool_h, pool_w, scale, ctx.memory)
+            output = roipool_cpu.forward_cpu(feat, rois, pool_h, pool_w, scale, ctx.memory)
         return output
 
     @staticmethod
@@ -52,8 +52,8 @@ class ROIPoolFunction(Function):
                                                   feat_size[3], pool_h, pool_w, memory)
 
         else:
-            grad_in = roipool.backward_cpu(rois, grad_out, feat_size[0], feat_size[1], feat_size[2],
-                                           feat_size[3], pool_h, pool_w, memory)
+            grad_in = roipool_cpu.backward_cpu(rois, grad_out, feat_size[0], feat_size[1], feat_size[2],
+                                               feat_size[3], pool_h, pool_w, memory)
 
         # Note: the backward return number is corresponding to the ctx variable
         return grad_in, None, None, None, None, None
@@ -67,14 +67,68 @@ class RoIPool2D(Module):
 
     # feat: BxCxHxW,  rois: Kx5 (batch_idx, xmin, ymin, xmax, ymax) without normalize
     def forward(self, feat, rois, scale=None):
-        if scale is None:
-            output = ROIPoolFunction.apply(feat, rois, self.pool_h, self.pool_w, self.scale, self.training)
-        else:
-            output = ROIPoolFunction.apply(feat, rois, self.pool_h, self.pool_w, scale, self.training)
+        backend, roi_pool = OP_REGISTRY.resolve('roi_pool', feat.device.type)
+        if backend != 'torch':
+            # the compiled kernels only take float features, e.g. under autocast.
+            feat = feat.float()
 
+        output = roi_pool(feat, rois, self.pool_h, self.pool_w, self.scale if scale is None else scale, self.training)
         return output
 
 
+def roi_pool_torch(feat, rois, pool_h, pool_w, scale, train=False, max_elements=1 << 24):
+    """RoIPool of the compiled kernels with tensor ops, the backward comes from autograd.
+
+    The max of every bin is separable: the max over the columns of each column bin, then over the rows of each
+    row bin. The rois are processed in chunks of at most max_elements features.
+    """
+    channels, height, width = feat.size(1), feat.size(2), feat.size(3)
+    batch_index = rois[:, 0].long()
+    # round half away from zero as the kernels, the coordinates are non-negative.
+    start_w, start_h = (rois[:, 1] * scale + 0.5).floor(), (rois[:, 2] * scale + 0.5).floor()
+    end_w, end_h = (rois[:, 3] * scale + 0.5).floor(), (rois[:, 4] * scale + 0.5).floor()
+    bin_w = (end_w - start_w + 1).clamp(min=1) / pool_w
+    bin_h = (end_h - start_h + 1).clamp(min=1) / pool_h
+
+    def _bins(start, bin_size, pool_size, size):
+        bins = torch.arange(pool_size, dtype=start.dtype, device=start.device)
+        bin_start = ((bins[None, :] * bin_size[:, None]).floor() + start[:, None]).clamp(0, size)
+        bin_end = (((bins[None, :] + 1) * bin_size[:, None]).ceil() + start[:, None]).clamp(0, size)
+        positions = torch.arange(size, dtype=start.dtype, device=start.device)
+        mask = (positions[None, None, :] >= bin_start[:, :, None]) & (positions[None, None, :] < bin_end[:, :, None])
+        return mask, bin_end <= bin_start  # [R, pool_size, size], [R, pool_size]
+
+    col_mask, col_empty = _bins(start_w, bin_w, pool_w, width)
+    row_mask, row_empty = _bins(start_h, bin_h, pool_h, height)
+    empty = row_empty[:, :, None] | col_empty[:, None, :]  # [R, pool_h, pool_w]
+
+    chunk_size = max(max_elements // max(channels * height * width, 1), 1)
+    output_list = list()
+    for start in range(0, rois.size(0), chunk_size):
+        end = start + chunk_size
+        chunk_feat = feat[batch_index[start:end]]  # [r, C, H, W]
+        cols = torch.stack([chunk_feat.masked_fill(~col_mask[start:end, None, None, i], float('-inf')).max(3)[0]
+                            for i in range(pool_w)], 3)  # [r, C, H, pool_w]
+        pooled = torch.stack([cols.masked_fill(~row_mask[start:end, None, i, :, None], float('-inf')).max(2)[0]
+                              for i in range(pool_h)], 2)  # [r, C, pool_h, pool_w]
+        output_list.append(pooled.masked_fill(empty[start:end, None], 0))
+
+    if len(output_list) == 0:
+        return feat.new_zeros((0, channels, pool_h, pool_w))
+
+    return torch.cat(output_list, 0)
+
+
+def _load_roi_pool(extension):
+    extension.load()
+    return ROIPoolFunction.apply
+
+
+OP_REGISTRY.register('roi_pool', 'cuda', lambda: _load_roi_pool(roipool))
+OP_REGISTRY.register('roi_pool', 'cpu', lambda: _load_roi_pool(roipool_cpu))
+OP_REGISTRY.register('roi_pool', 'torch', lambda: roi_pool_torch)
+
+
 if __name__ == '__main__':
     import torch
 
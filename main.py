@@ -51,6 +51,10 @@ if __name__ == "__main__":
                         dest='data:include_val', help='Include validation set for final training.')
     parser.add_argument('--drop_last', type=str2bool, nargs='?', default=False,
                         dest='data:drop_last', help='Fix bug for syncbn.')
+    parser.add_argument('--packed', type=str2bool, nargs='?', default=False,
+                        dest='data:packed', help='Read samples from the packed shards.')
+    parser.add_argument('--anno_cache', type=str2bool, nargs='?', default=False,
+                        dest='data:anno_cache', help='Read json labels from the compiled annotation cache.')
     parser.add_argument('--workers', default=None, type=int,
                         dest='data:workers', help='The number of workers to load data.')
     parser.add_argument('--train_batch_size', default=None, type=int,
@@ -20,7 +20,6 @@ from methods.tools.blob_helper import BlobHelper
 from methods.tools.runner_helper import RunnerHelper
 from models.cls_model_manager import ClsModelManager
 from utils.helpers.image_helper import ImageHelper
-from utils.helpers.json_helper import JsonHelper
 from utils.tools.logger import Logger as Log
 from vis.parser.cls_parser import ClsParser
 
@@ -34,6 +33,7 @@ class FCClassifierTest(object):
         self.cls_data_loader = DataLoader(configer)
         self.cls_parser = ClsParser(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.cls_net = None
         if self.configer.get('dataset') == 'imagenet':
             with open(os.path.join(self.configer.get('project_dir'),
@@ -49,7 +49,7 @@ class FCClassifierTest(object):
         self.cls_net = RunnerHelper.load_net(self, self.cls_net)
         self.cls_net.eval()
 
-    def __test_img(self, image_path, json_path, raw_path, vis_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         img = ImageHelper.read_image(image_path,
                                      tool=self.configer.get('data', 'image_tool'),
@@ -70,21 +70,23 @@ class FCClassifierTest(object):
 
         ori_img_bgr = ImageHelper.get_cv2_bgr(img, mode=self.configer.get('data', 'input_mode'))
 
-        inputs = self.blob_helper.make_input(img,
-                                             input_size=self.configer.get('test', 'input_size'), scale=1.0)
+        inputs = self.blob_helper.make_input(img, input_size=self.configer.get('test', 'input_size'),
+                                             scale=1.0, device='cpu')
+        return dict(img=inputs, image_path=image_path, ori_img_bgr=ori_img_bgr)
 
-        with torch.no_grad():
-            outputs = self.cls_net(inputs)
+    def _infer(self, batch_dict):
+        return self.cls_net(batch_dict['img']).float().cpu()
 
-        json_dict = self.__get_info_tree(outputs, image_path)
+    def _write(self, outputs, data_dict, path_dict, sink):
+        json_dict = self.__get_info_tree(outputs, data_dict['image_path'])
 
-        image_canvas = self.cls_parser.draw_label(ori_img_bgr.copy(), json_dict['label'])
-        cv2.imwrite(vis_path, image_canvas)
-        cv2.imwrite(raw_path, ori_img_bgr)
+        ori_img_bgr = data_dict['ori_img_bgr']
+        if sink.need_vis(path_dict):
+            image_canvas = self.cls_parser.draw_label(ori_img_bgr.copy(), json_dict['label'])
+            sink.save_vis(image_canvas, path_dict)
 
-        Log.info('Json Path: {}'.format(json_path))
-        JsonHelper.save_file(json_dict, json_path)
-        return json_dict
+        sink.save_raw(ori_img_bgr, path_dict)
+        sink.save_json(json_dict, path_dict)
 
     def __get_info_tree(self, outputs, image_path=None):
         json_dict = dict()
@@ -95,6 +97,7 @@ class FCClassifierTest(object):
         maxk = max(topk)
 
         _, pred = outputs.topk(maxk, 0, True, True)
+        pred = pred.tolist()
         for k in topk:
             if k == 1:
                 json_dict['label'] = pred[0]
@@ -8,17 +8,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import time
 import torch
 
 from datasets.det.data_loader import DataLoader
 from loss.loss_manager import LossManager
 from methods.det.faster_rcnn_test import FastRCNNTest
+from methods.tools.engine import Engine
 from methods.tools.runner_helper import RunnerHelper
 from methods.tools.trainer import Trainer
 from models.det_model_manager import DetModelManager
 from utils.layers.det.fr_priorbox_layer import FRPriorBoxLayer
-from utils.tools.average_meter import AverageMeter
 from utils.tools.logger import Logger as Log
 from metric.det.det_running_score import DetRunningScore
 from vis.visualizer.det_visualizer import DetVisualizer
@@ -31,10 +30,6 @@ class FasterRCNN(object):
     """
     def __init__(self, configer):
         self.configer = configer
-        self.batch_time = AverageMeter()
-        self.data_time = AverageMeter()
-        self.train_losses = AverageMeter()
-        self.val_losses = AverageMeter()
         self.det_visualizer = DetVisualizer(configer)
         self.det_loss_manager = LossManager(configer)
         self.det_model_manager = DetModelManager(configer)
@@ -47,6 +42,8 @@ class FasterRCNN(object):
         self.val_loader = None
         self.optimizer = None
         self.scheduler = None
+        self.scaler = None
+        self.engine = None
         self.runner_state = dict()
 
         self._init_model()
@@ -59,6 +56,7 @@ class FasterRCNN(object):
 
         self.train_loader = self.det_data_loader.get_trainloader()
         self.val_loader = self.det_data_loader.get_valloader()
+        self.engine = Engine(self.configer)
 
     def _get_parameters(self):
         lr_1 = []
@@ -79,119 +77,53 @@ class FasterRCNN(object):
         """
           Train function of every epoch during train phase.
         """
-        self.det_net.train()
-        start_time = time.time()
-        # Adjust the learning rate after every epoch.
-        self.runner_state['epoch'] += 1
-
-        for i, data_dict in enumerate(self.train_loader):
-            Trainer.update(self)
-            batch_gt_bboxes = data_dict['bboxes']
-            batch_gt_labels = data_dict['labels']
-            metas = data_dict['meta']
-            data_dict['bboxes'] = DCHelper.todc(batch_gt_bboxes, gpu_list=self.configer.get('gpu'), cpu_only=True)
-            data_dict['labels'] = DCHelper.todc(batch_gt_labels, gpu_list=self.configer.get('gpu'), cpu_only=True)
-            data_dict['meta'] = DCHelper.todc(metas, gpu_list=self.configer.get('gpu'), cpu_only=True)
-            self.data_time.update(time.time() - start_time)
-            # Forward pass.
-            loss = self.det_net(data_dict)
-            loss = loss.mean()
-            self.train_losses.update(loss.item(), data_dict['img'].size(0))
-
-            self.optimizer.zero_grad()
-            loss.backward()
-            RunnerHelper.clip_grad(self.det_net, 10.)
-            self.optimizer.step()
-
-            # Update the vars of the train phase.
-            self.batch_time.update(time.time() - start_time)
-            start_time = time.time()
-            self.runner_state['iters'] += 1
-
-            # Print the log info & reset the states.
-            if self.runner_state['iters'] % self.configer.get('solver', 'display_iter') == 0:
-                Log.info('Train Epoch: {0}\tTrain Iteration: {1}\t'
-                         'Time {batch_time.sum:.3f}s / {2}iters, ({batch_time.avg:.3f})\t'
-                         'Data load {data_time.sum:.3f}s / {2}iters, ({data_time.avg:3f})\n'
-                         'Learning rate = {3}\tLoss = {loss.val:.8f} (ave = {loss.avg:.8f})\n'.format(
-                    self.runner_state['epoch'], self.runner_state['iters'],
-                    self.configer.get('solver', 'display_iter'),
-                    RunnerHelper.get_lr(self.optimizer), batch_time=self.batch_time,
-                    data_time=self.data_time, loss=self.train_losses))
-                self.batch_time.reset()
-                self.data_time.reset()
-                self.train_losses.reset()
-
-            if self.configer.get('lr', 'metric') == 'iters' \
-                    and self.runner_state['iters'] == self.configer.get('solver', 'max_iters'):
-                break
-
-            # Check to val the current model.
-            if self.runner_state['iters'] % self.configer.get('solver', 'test_interval') == 0:
-                self.val()
+        self.engine.train(self, self.det_net, max_grad=10.)
 
     def val(self):
         """
           Validation function during the train phase.
         """
-        self.det_net.eval()
-        start_time = time.time()
-        with torch.no_grad():
-            for j, data_dict in enumerate(self.val_loader):
-                inputs = data_dict['img']
-                batch_gt_bboxes = data_dict['bboxes']
-                batch_gt_labels = data_dict['labels']
-                metas = data_dict['meta']
-                data_dict['bboxes'] = DCHelper.todc(batch_gt_bboxes, gpu_list=self.configer.get('gpu'), cpu_only=True)
-                data_dict['labels'] = DCHelper.todc(batch_gt_labels, gpu_list=self.configer.get('gpu'), cpu_only=True)
-                data_dict['meta'] = DCHelper.todc(metas, gpu_list=self.configer.get('gpu'), cpu_only=True)
-                # Forward pass.
-                inputs = RunnerHelper.to_device(self, inputs)
-                loss, test_group = self.det_net(data_dict)
-                # Compute the loss of the train batch & backward.
-                loss = loss.mean()
-                self.val_losses.update(loss.item(), inputs.size(0))
-                test_indices_and_rois, test_roi_locs, test_roi_scores, test_rois_num = test_group
-                batch_detections = FastRCNNTest.decode(test_roi_locs,
-                                                       test_roi_scores,
-                                                       test_indices_and_rois,
-                                                       test_rois_num,
-                                                       self.configer,
-                                                       metas)
-                batch_pred_bboxes = self.__get_object_list(batch_detections)
-                self.det_running_score.update(batch_pred_bboxes, batch_gt_bboxes, batch_gt_labels)
-
-                # Update the vars of the val phase.
-                self.batch_time.update(time.time() - start_time)
-                start_time = time.time()
-
-            RunnerHelper.save_net(self, self.det_net, iters=self.runner_state['iters'])
-            # Print the log info & reset the states.
-            Log.info(
-                'Test Time {batch_time.sum:.3f}s, ({batch_time.avg:.3f})\t'
-                'Loss {loss.avg:.8f}\n'.format(
-                    batch_time=self.batch_time, loss=self.val_losses))
-            Log.info('Val mAP: {}\n'.format(self.det_running_score.get_mAP()))
-            self.det_running_score.reset()
-            self.batch_time.reset()
-            self.val_losses.reset()
-            self.det_net.train()
+        self.engine.val(self, self.det_net)
+
+    def _forward(self, data_dict):
+        net_dict = dict(data_dict)
+        for key in ('bboxes', 'labels', 'meta'):
+            net_dict[key] = DCHelper.todc(data_dict[key], gpu_list=self.configer.get('gpu'), cpu_only=True)
+
+        return self.det_net(net_dict)
+
+    def _loss(self, outputs, data_dict):
+        if not self.det_net.training:
+            outputs = outputs[0]
+
+        return outputs.mean()
+
+    def _postprocess(self, outputs, data_dict):
+        test_indices_and_rois, test_roi_locs, test_roi_scores, test_rois_num = outputs[1]
+        batch_detections = FastRCNNTest.decode(test_roi_locs,
+                                               test_roi_scores,
+                                               test_indices_and_rois,
+                                               test_rois_num,
+                                               self.configer,
+                                               data_dict['meta'])
+        batch_pred_bboxes = self.__get_object_list(batch_detections)
+        self.det_running_score.update(batch_pred_bboxes, data_dict['bboxes'], data_dict['labels'])
+
+    def _evaluate(self):
+        Log.info('Val mAP: {}\n'.format(self.det_running_score.get_mAP()))
+        self.det_running_score.reset()
+        return dict(iters=self.runner_state['iters'])
 
     def __get_object_list(self, batch_detections):
+        """[x1, y1, x2, y2, label, score] tensors of every image, on the device of the detections."""
         batch_pred_bboxes = list()
         for idx, detections in enumerate(batch_detections):
-            object_list = list()
-            if detections is not None:
-                for x1, y1, x2, y2, conf, cls_pred in detections:
-                    xmin = x1.cpu().item()
-                    ymin = y1.cpu().item()
-                    xmax = x2.cpu().item()
-                    ymax = y2.cpu().item()
-                    cf = conf.cpu().item()
-                    cls_pred = int(cls_pred.cpu().item()) - 1
-                    object_list.append([xmin, ymin, xmax, ymax, cls_pred, float('%.2f' % cf)])
-
-            batch_pred_bboxes.append(object_list)
+            if detections is None:
+                batch_pred_bboxes.append(None)
+                continue
+
+            batch_pred_bboxes.append(torch.cat((detections[:, :4], detections[:, 5:6] - 1,
+                                                (detections[:, 4:5] * 100).round() / 100), 1))
 
         return batch_pred_bboxes
 
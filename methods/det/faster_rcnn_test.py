@@ -19,7 +19,6 @@ from methods.tools.runner_helper import RunnerHelper
 from models.det_model_manager import DetModelManager
 from utils.helpers.det_helper import DetHelper
 from utils.helpers.image_helper import ImageHelper
-from utils.helpers.json_helper import JsonHelper
 from utils.layers.det.fr_priorbox_layer import FRPriorBoxLayer
 from utils.layers.det.fr_roi_generator import FRROIGenerator
 from utils.layers.det.fr_roi_sampler import FRROISampler
@@ -44,6 +43,7 @@ class FastRCNNTest(object):
         self.fr_priorbox_layer = FRPriorBoxLayer(configer)
         self.fr_roi_generator = FRROIGenerator(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.det_net = None
 
         self._init_model()
@@ -53,17 +53,17 @@ class FastRCNNTest(object):
         self.det_net = RunnerHelper.load_net(self, self.det_net)
         self.det_net.eval()
 
-    def __test_img(self, image_path, json_path, raw_path, vis_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         image = ImageHelper.read_image(image_path,
-                                     tool=self.configer.get('data', 'image_tool'),
-                                     mode=self.configer.get('data', 'input_mode'))
+                                       tool=self.configer.get('data', 'image_tool'),
+                                       mode=self.configer.get('data', 'input_mode'))
         ori_img_bgr = ImageHelper.get_cv2_bgr(image, mode=self.configer.get('data', 'input_mode'))
         width, height = ImageHelper.get_size(image)
         scale1 = self.configer.get('test', 'resize_bound')[0] / min(width, height)
         scale2 = self.configer.get('test', 'resize_bound')[1] / max(width, height)
         scale = min(scale1, scale2)
-        inputs = self.blob_helper.make_input(image, scale=scale)
+        inputs = self.blob_helper.make_input(image, scale=scale, device='cpu')
         b, c, h, w = inputs.size()
         border_wh = [w, h]
         if self.configer.exists('test', 'fit_stride'):
@@ -72,41 +72,44 @@ class FastRCNNTest(object):
             pad_w = 0 if (w % stride == 0) else stride - (w % stride)  # right
             pad_h = 0 if (h % stride == 0) else stride - (h % stride)  # down
 
-            expand_image = torch.zeros((b, c, h + pad_h, w + pad_w)).to(inputs.device)
+            expand_image = torch.zeros((b, c, h + pad_h, w + pad_w))
             expand_image[:, :, 0:h, 0:w] = inputs
-            inputs= expand_image
+            inputs = expand_image
 
+        meta = dict(ori_img_size=ImageHelper.get_size(ori_img_bgr),
+                    border_size=border_wh,
+                    aug_img_size=border_wh,
+                    img_scale=scale,
+                    input_size=[inputs.size(3), inputs.size(2)])
+        return dict(img=inputs, ori_img_bgr=ori_img_bgr, scale=scale, meta=meta)
+
+    def _infer(self, batch_dict):
         data_dict = dict(
-            img=inputs,
-            meta=DataContainer([[dict(ori_img_size=ImageHelper.get_size(ori_img_bgr),
-                                      aug_img_size=border_wh,
-                                      img_scale=scale,
-                                      input_size=[inputs.size(3), inputs.size(2)])]], cpu_only=True)
+            img=batch_dict['img'],
+            meta=DataContainer([batch_dict['meta']], cpu_only=True)
         )
-
-        with torch.no_grad():
-            # Forward pass.
-            test_group = self.det_net(data_dict)
-
-            test_indices_and_rois, test_roi_locs, test_roi_scores, test_rois_num = test_group
-
-        batch_detections = self.decode(test_roi_locs,
-                                       test_roi_scores,
+        # Forward pass.
+        test_indices_and_rois, test_roi_locs, test_roi_scores, test_rois_num = self.det_net(data_dict)
+        batch_detections = self.decode(test_roi_locs.float(),
+                                       test_roi_scores.float(),
                                        test_indices_and_rois,
                                        test_rois_num,
                                        self.configer,
                                        DCHelper.tolist(data_dict['meta']))
-        json_dict = self.__get_info_tree(batch_detections[0], ori_img_bgr, scale=scale)
+        return [None if detections is None else detections.cpu() for detections in batch_detections]
 
-        image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
-                                                   json_dict,
-                                                   conf_threshold=self.configer.get('res', 'vis_conf_thre'))
-        cv2.imwrite(vis_path, image_canvas)
-        cv2.imwrite(raw_path, ori_img_bgr)
+    def _write(self, detections, data_dict, path_dict, sink):
+        ori_img_bgr = data_dict['ori_img_bgr']
+        json_dict = self.__get_info_tree(detections, ori_img_bgr, scale=data_dict['scale'])
 
-        Log.info('Json Path: {}'.format(json_path))
-        JsonHelper.save_file(json_dict, json_path)
-        return json_dict
+        if sink.need_vis(path_dict):
+            image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
+                                                       json_dict,
+                                                       conf_threshold=self.configer.get('res', 'vis_conf_thre'))
+            sink.save_vis(image_canvas, path_dict)
+
+        sink.save_raw(ori_img_bgr, path_dict)
+        sink.save_json(json_dict, path_dict)
 
     @staticmethod
     def decode(roi_locs, roi_scores, indices_and_rois, test_rois_num, configer, metas):
@@ -132,56 +135,36 @@ class FastRCNNTest(object):
         else:
             cls_prob = roi_scores
 
-        cls_label = torch.LongTensor([i for i in range(num_classes)])\
-            .contiguous().view(1, num_classes).repeat(indices_and_rois.size(0), 1).to(roi_locs.device)
-
-        output = [None for _ in range(test_rois_num.size(0))]
-        start_index = 0
-        for i in range(test_rois_num.size(0)):
-            # batch_index = (indices_and_rois[:, 0] == i).nonzero().contiguous().view(-1,)
-            # tmp_dst_bbox = dst_bbox[batch_index]
-            # tmp_cls_prob = cls_prob[batch_index]
-            # tmp_cls_label = cls_label[batch_index]
-            tmp_dst_bbox = dst_bbox[start_index:start_index+test_rois_num[i]]
-            # clip bounding box
-            tmp_dst_bbox[:, :, 0::2] = tmp_dst_bbox[:, :, 0::2].clamp(min=0, max=metas[i]['border_size'][0] - 1)
-            tmp_dst_bbox[:, :, 1::2] = tmp_dst_bbox[:, :, 1::2].clamp(min=0, max=metas[i]['border_size'][1] - 1)
-
-            tmp_cls_prob = cls_prob[start_index:start_index+test_rois_num[i]]
-            tmp_cls_label = cls_label[start_index:start_index+test_rois_num[i]]
-            start_index += test_rois_num[i]
-
-            mask = (tmp_cls_prob > configer.get('res', 'val_conf_thre')) & (tmp_cls_label > 0)
-
-            tmp_dst_bbox = tmp_dst_bbox[mask].contiguous().view(-1, 4)
-            if tmp_dst_bbox.numel() == 0:
-                continue
-
-            tmp_cls_prob = tmp_cls_prob[mask].contiguous().view(-1,).unsqueeze(1)
-            tmp_cls_label = tmp_cls_label[mask].contiguous().view(-1,).unsqueeze(1)
-
-            valid_preds = torch.cat((tmp_dst_bbox, tmp_cls_prob.float(), tmp_cls_label.float()), 1)
-
-            output[i] = DetHelper.cls_nms(valid_preds,
-                                          labels=valid_preds[:, 5],
-                                          max_threshold=configer.get('nms', 'max_threshold'))
-
-        return output
+        # clip bounding box
+        border_size = torch.Tensor([meta['border_size'] for meta in metas]).to(roi_locs.device)
+        batch_index = indices_and_rois[:, 0].long()
+        dst_bbox = torch.min(dst_bbox.clamp(min=0), border_size[batch_index].repeat(1, 2).unsqueeze(1) - 1)
+
+        # Filter by the confidence before gathering the boxes of the foreground classes.
+        roi_index, cls_label = (cls_prob[:, 1:] > configer.get('res', 'val_conf_thre')).nonzero(as_tuple=True)
+        cls_label = cls_label + 1
+        batch_index = batch_index[roi_index]
+        valid_preds = torch.cat((dst_bbox[roi_index, cls_label], cls_prob[roi_index, cls_label].unsqueeze(1).float(),
+                                 cls_label.unsqueeze(1).float()), 1)
+        keep = DetHelper.batch_nms(valid_preds[:, :5],
+                                   group_ids=batch_index * num_classes + cls_label,
+                                   max_threshold=configer.get('nms', 'max_threshold'))
+        return DetHelper.split_batch(valid_preds[keep], batch_index[keep], test_rois_num.size(0))
 
     def __get_info_tree(self, detections, image_raw, scale=1.0):
         height, width, _ = image_raw.shape
         json_dict = dict()
         object_list = list()
         if detections is not None:
-            for x1, y1, x2, y2, conf, cls_pred in detections:
+            for x1, y1, x2, y2, conf, cls_pred in detections.cpu().tolist():
                 object_dict = dict()
-                xmin = min(x1.cpu().item() / scale, width - 1)
-                ymin = min(y1.cpu().item() / scale, height - 1)
-                xmax = min(x2.cpu().item() / scale, width - 1)
-                ymax = min(y2.cpu().item() / scale, height - 1)
+                xmin = min(x1 / scale, width - 1)
+                ymin = min(y1 / scale, height - 1)
+                xmax = min(x2 / scale, width - 1)
+                ymax = min(y2 / scale, height - 1)
                 object_dict['bbox'] = [xmin, ymin, xmax, ymax]
-                object_dict['label'] = int(cls_pred.cpu().item()) - 1
-                object_dict['score'] = float('%.2f' % conf.cpu().item())
+                object_dict['label'] = int(cls_pred) - 1
+                object_dict['score'] = float('%.2f' % conf)
 
                 object_list.append(object_dict)
 
@@ -20,7 +20,6 @@ from methods.tools.runner_helper import RunnerHelper
 from models.det_model_manager import DetModelManager
 from utils.helpers.det_helper import DetHelper
 from utils.helpers.image_helper import ImageHelper
-from utils.helpers.json_helper import JsonHelper
 from utils.layers.det.ssd_priorbox_layer import SSDPriorBoxLayer
 from utils.layers.det.ssd_target_generator import SSDTargetGenerator
 from utils.tools.logger import Logger as Log
@@ -39,6 +38,7 @@ class SingleShotDetectorTest(object):
         self.ssd_priorbox_layer = SSDPriorBoxLayer(configer)
         self.ssd_target_generator = SSDTargetGenerator(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.det_net = None
 
         self._init_model()
@@ -48,33 +48,36 @@ class SingleShotDetectorTest(object):
         self.det_net = RunnerHelper.load_net(self, self.det_net)
         self.det_net.eval()
 
-    def __test_img(self, image_path, json_path, raw_path, vis_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         img = ImageHelper.read_image(image_path,
                                      tool=self.configer.get('data', 'image_tool'),
                                      mode=self.configer.get('data', 'input_mode'))
         ori_img_bgr = ImageHelper.get_cv2_bgr(img, mode=self.configer.get('data', 'input_mode'))
 
-        inputs = self.blob_helper.make_input(img,
-                                             input_size=self.configer.get('test', 'input_size'), scale=1.0)
+        inputs = self.blob_helper.make_input(img, input_size=self.configer.get('test', 'input_size'),
+                                             scale=1.0, device='cpu')
+        return dict(img=inputs, ori_img_bgr=ori_img_bgr, input_size=[inputs.size(3), inputs.size(2)])
 
-        with torch.no_grad():
-            feat_list, bbox, cls = self.det_net(inputs)
-
-        batch_detections = self.decode(bbox, cls,
+    def _infer(self, batch_dict):
+        feat_list, bbox, cls = self.det_net(batch_dict['img'])
+        batch_detections = self.decode(bbox.float(), cls.float(),
                                        self.ssd_priorbox_layer(feat_list, self.configer.get('test', 'input_size')),
-                                       self.configer, [inputs.size(3), inputs.size(2)])
-        json_dict = self.__get_info_tree(batch_detections[0], ori_img_bgr, [inputs.size(3), inputs.size(2)])
+                                       self.configer, batch_dict['input_size'][0])
+        return [None if detections is None else detections.cpu() for detections in batch_detections]
 
-        image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
-                                                   json_dict,
-                                                   conf_threshold=self.configer.get('res', 'vis_conf_thre'))
-        cv2.imwrite(vis_path, image_canvas)
-        cv2.imwrite(raw_path, ori_img_bgr)
+    def _write(self, detections, data_dict, path_dict, sink):
+        ori_img_bgr = data_dict['ori_img_bgr']
+        json_dict = self.__get_info_tree(detections, ori_img_bgr, data_dict['input_size'])
 
-        Log.info('Json Path: {}'.format(json_path))
-        JsonHelper.save_file(json_dict, json_path)
-        return json_dict
+        if sink.need_vis(path_dict):
+            image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
+                                                       json_dict,
+                                                       conf_threshold=self.configer.get('res', 'vis_conf_thre'))
+            sink.save_vis(image_canvas, path_dict)
+
+        sink.save_raw(ori_img_bgr, path_dict)
+        sink.save_json(json_dict, path_dict)
 
     @staticmethod
     def decode(bbox, conf, default_boxes, configer, input_size):
@@ -82,51 +85,37 @@ class SingleShotDetectorTest(object):
         if configer.get('phase') != 'debug':
             conf = F.softmax(conf, dim=-1)
 
-        default_boxes = default_boxes.unsqueeze(0).repeat(loc.size(0), 1, 1).to(bbox.device)
+        default_boxes = default_boxes.unsqueeze(0).to(bbox.device)
 
         variances = [0.1, 0.2]
         wh = torch.exp(loc[:, :, 2:] * variances[1]) * default_boxes[:, :, 2:]
         cxcy = loc[:, :, :2] * variances[0] * default_boxes[:, :, 2:] + default_boxes[:, :, :2]
         boxes = torch.cat([cxcy - wh / 2, cxcy + wh / 2], 2)  # [b, 8732,4]
 
-        batch_size, num_priors, _ = boxes.size()
-        boxes = boxes.unsqueeze(2).repeat(1, 1, configer.get('data', 'num_classes'), 1)
-        boxes = boxes.contiguous().view(boxes.size(0), -1, 4)
-
         # clip bounding box
         boxes[:, :, 0::2] = boxes[:, :, 0::2].clamp(min=0, max=input_size[0] - 1)
         boxes[:, :, 1::2] = boxes[:, :, 1::2].clamp(min=0, max=input_size[1] - 1)
 
-        labels = torch.Tensor([i for i in range(configer.get('data', 'num_classes'))]).to(boxes.device)
-        labels = labels.view(1, 1, -1, 1).repeat(batch_size, num_priors, 1, 1).contiguous().view(batch_size, -1, 1)
-        max_conf = conf.contiguous().view(batch_size, -1, 1)
-
-        # max_conf, labels = conf.max(2, keepdim=True)  # [b, 8732,1]
-        predictions = torch.cat((boxes, max_conf.float(), labels.float()), 2)
-        output = [None for _ in range(len(predictions))]
-        for image_i, image_pred in enumerate(predictions):
-            ids = labels[image_i].squeeze(1).nonzero().contiguous().view(-1,)
-            if ids.numel() == 0:
-                continue
-
-            valid_preds = image_pred[ids]
-            _, order = valid_preds[:, 4].sort(0, descending=True)
-            order = order[:configer.get('nms', 'pre_nms')]
-            valid_preds = valid_preds[order]
-            valid_preds = valid_preds[valid_preds[:, 4] > configer.get('res', 'val_conf_thre')]
-            if valid_preds.numel() == 0:
-                continue
-
-            valid_preds = DetHelper.cls_nms(valid_preds[:, :6],
-                                            labels=valid_preds[:, 5],
-                                            max_threshold=configer.get('nms', 'max_threshold'),
-                                            cls_keep_num=configer.get('res', 'cls_keep_num'))
-
-            _, order = valid_preds[:, 4].sort(0, descending=True)
-            order = order[:configer.get('res', 'max_per_image')]
-            output[image_i] = valid_preds[order]
-
-        return output
+        # Filter by the confidence before expanding the boxes to the foreground classes.
+        conf_mask = conf[:, :, 1:] > configer.get('res', 'val_conf_thre')
+        batch_index, prior_index, labels = conf_mask.nonzero(as_tuple=True)
+        labels = labels + 1
+        scores = conf[batch_index, prior_index, labels]
+        order, rank = DetHelper.group_sort(batch_index, scores)
+        order = order[rank < configer.get('nms', 'pre_nms')]
+        batch_index, labels = batch_index[order], labels[order]
+        predictions = torch.cat((boxes[batch_index, prior_index[order]], scores[order].unsqueeze(1).float(),
+                                 labels.unsqueeze(1).float()), 1)
+
+        keep = DetHelper.batch_nms(predictions[:, :5],
+                                   group_ids=batch_index * configer.get('data', 'num_classes') + labels,
+                                   max_threshold=configer.get('nms', 'max_threshold'),
+                                   group_keep_num=configer.get('res', 'cls_keep_num'))
+        predictions, batch_index = predictions[keep], batch_index[keep]
+
+        order, rank = DetHelper.group_sort(batch_index, predictions[:, 4])
+        order = order[rank < configer.get('res', 'max_per_image')]
+        return DetHelper.split_batch(predictions[order], batch_index[order], loc.size(0))
 
     def __get_info_tree(self, detections, image_raw, input_size):
         height, width, _ = image_raw.shape
@@ -134,15 +123,15 @@ class SingleShotDetectorTest(object):
         json_dict = dict()
         object_list = list()
         if detections is not None:
-            for x1, y1, x2, y2, conf, cls_pred in detections:
+            for x1, y1, x2, y2, conf, cls_pred in detections.cpu().tolist():
                 object_dict = dict()
-                xmin = x1.cpu().item() / in_width * width
-                ymin = y1.cpu().item() / in_height * height
-                xmax = x2.cpu().item() / in_width * width
-                ymax = y2.cpu().item() / in_height * height
+                xmin = x1 / in_width * width
+                ymin = y1 / in_height * height
+                xmax = x2 / in_width * width
+                ymax = y2 / in_height * height
                 object_dict['bbox'] = [xmin, ymin, xmax, ymax]
-                object_dict['label'] = int(cls_pred.cpu().item()) - 1
-                object_dict['score'] = float('%.2f' % conf.cpu().item())
+                object_dict['label'] = int(cls_pred) - 1
+                object_dict['score'] = float('%.2f' % conf)
 
                 object_list.append(object_dict)
 
@@ -8,18 +8,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import time
 import torch
 
 from datasets.det.data_loader import DataLoader
 from loss.loss_manager import LossManager
 from methods.det.yolov3_test import YOLOv3Test
+from methods.tools.engine import Engine
 from methods.tools.runner_helper import RunnerHelper
 from methods.tools.trainer import Trainer
 from models.det_model_manager import DetModelManager
 from utils.layers.det.yolo_detection_layer import YOLODetectionLayer
 from utils.layers.det.yolo_target_generator import YOLOTargetGenerator
-from utils.tools.average_meter import AverageMeter
 from utils.tools.logger import Logger as Log
 from metric.det.det_running_score import DetRunningScore
 from vis.visualizer.det_visualizer import DetVisualizer
@@ -31,10 +30,6 @@ class YOLOv3(object):
     """
     def __init__(self, configer):
         self.configer = configer
-        self.batch_time = AverageMeter()
-        self.data_time = AverageMeter()
-        self.train_losses = AverageMeter()
-        self.val_losses = AverageMeter()
         self.det_visualizer = DetVisualizer(configer)
         self.det_loss_manager = LossManager(configer)
         self.det_model_manager = DetModelManager(configer)
@@ -48,6 +43,8 @@ class YOLOv3(object):
         self.val_loader = None
         self.optimizer = None
         self.scheduler = None
+        self.scaler = None
+        self.engine = None
         self.runner_state = dict()
 
         self._init_model()
@@ -62,6 +59,7 @@ class YOLOv3(object):
         self.val_loader = self.det_data_loader.get_valloader()
 
         self.det_loss = self.det_loss_manager.get_det_loss()
+        self.engine = Engine(self.configer)
 
     def _get_parameters(self):
         lr_1 = []
@@ -82,125 +80,47 @@ class YOLOv3(object):
         """
           Train function of every epoch during train phase.
         """
-        self.det_net.train()
-        start_time = time.time()
-        # Adjust the learning rate after every epoch.
-        self.runner_state['epoch'] += 1
-
-        # data_tuple: (inputs, heatmap, maskmap, vecmap)
-        for i, data_dict in enumerate(self.train_loader):
-            Trainer.update(self, backbone_list=(0, ))
-            inputs = data_dict['img']
-            batch_gt_bboxes = data_dict['bboxes']
-            batch_gt_labels = data_dict['labels']
-            input_size = [inputs.size(3), inputs.size(2)]
-
-            self.data_time.update(time.time() - start_time)
-            # Change the data type.
-            inputs = RunnerHelper.to_device(self, inputs)
-
-            # Forward pass.
-            feat_list, predictions, _ = self.det_net(inputs)
-
-            targets, objmask, noobjmask = self.yolo_target_generator(feat_list, batch_gt_bboxes,
-                                                                     batch_gt_labels, input_size)
-            targets, objmask, noobjmask = RunnerHelper.to_device(self, targets, objmask, noobjmask)
-            # Compute the loss of the train batch & backward.
-            loss = self.det_loss(predictions, targets, objmask, noobjmask)
-
-            self.train_losses.update(loss.item(), inputs.size(0))
-
-            self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
-
-            # Update the vars of the train phase.
-            self.batch_time.update(time.time() - start_time)
-            start_time = time.time()
-            self.runner_state['iters'] += 1
-
-            # Print the log info & reset the states.
-            if self.configer.get('iters') % self.configer.get('solver', 'display_iter') == 0:
-                Log.info('Train Epoch: {0}\tTrain Iteration: {1}\t'
-                         'Time {batch_time.sum:.3f}s / {2}iters, ({batch_time.avg:.3f})\t'
-                         'Data load {data_time.sum:.3f}s / {2}iters, ({data_time.avg:3f})\n'
-                         'Learning rate = {3}\tLoss = {loss.val:.8f} (ave = {loss.avg:.8f})\n'.format(
-                    self.runner_state['epoch'], self.runner_state['iters'],
-                    self.configer.get('solver', 'display_iter'),
-                    RunnerHelper.get_lr(self.optimizer), batch_time=self.batch_time,
-                    data_time=self.data_time, loss=self.train_losses))
-                self.batch_time.reset()
-                self.data_time.reset()
-                self.train_losses.reset()
-
-            if self.configer.get('lr', 'metric') == 'iters' \
-                    and self.runner_state['iters'] == self.configer.get('solver', 'max_iters'):
-                break
-
-            # Check to val the current model.
-            if self.runner_state['iters'] % self.configer.get('solver', 'test_interval') == 0:
-                self.val()
+        self.engine.train(self, self.det_net, backbone_list=(0, ))
 
     def val(self):
         """
           Validation function during the train phase.
         """
-        self.det_net.eval()
-        start_time = time.time()
-        with torch.no_grad():
-            for i, data_dict in enumerate(self.val_loader):
-                inputs = data_dict['img']
-                batch_gt_bboxes = data_dict['bboxes']
-                batch_gt_labels = data_dict['labels']
-                input_size = [inputs.size(3), inputs.size(2)]
-                # Forward pass.
-                inputs = RunnerHelper.to_device(self, inputs)
-                feat_list, predictions, detections = self.det_net(inputs)
-
-                targets, objmask, noobjmask = self.yolo_target_generator(feat_list, batch_gt_bboxes,
-                                                                         batch_gt_labels, input_size)
-                targets, objmask, noobjmask = RunnerHelper.to_device(self, targets, objmask, noobjmask)
-
-                # Compute the loss of the val batch.
-                loss = self.det_loss(predictions, targets, objmask, noobjmask)
-                self.val_losses.update(loss.item(), inputs.size(0))
-
-                batch_detections = YOLOv3Test.decode(detections, self.configer, input_size)
-                batch_pred_bboxes = self.__get_object_list(batch_detections, input_size)
-
-                self.det_running_score.update(batch_pred_bboxes, batch_gt_bboxes, batch_gt_labels)
-
-                # Update the vars of the val phase.
-                self.batch_time.update(time.time() - start_time)
-                start_time = time.time()
-
-            RunnerHelper.save_net(self, self.det_net, iters=self.runner_state['iters'])
-            # Print the log info & reset the states.
-            Log.info(
-                'Test Time {batch_time.sum:.3f}s, ({batch_time.avg:.3f})\t'
-                'Loss {loss.avg:.8f}\n'.format(
-                    batch_time=self.batch_time, loss=self.val_losses))
-            Log.info('Val mAP: {}'.format(self.det_running_score.get_mAP()))
-            self.det_running_score.reset()
-            self.batch_time.reset()
-            self.val_losses.reset()
-            self.det_net.train()
+        self.engine.val(self, self.det_net)
+
+    def _forward(self, data_dict):
+        return self.det_net(data_dict['img'])
+
+    def _loss(self, outputs, data_dict):
+        inputs = data_dict['img']
+        feat_list, predictions, _ = outputs
+        targets, objmask, noobjmask = self.yolo_target_generator(feat_list, data_dict['bboxes'],
+                                                                 data_dict['labels'], [inputs.size(3), inputs.size(2)])
+        targets, objmask, noobjmask = RunnerHelper.to_device(self, targets, objmask, noobjmask)
+        return self.det_loss(predictions, targets, objmask, noobjmask)
+
+    def _postprocess(self, outputs, data_dict):
+        inputs = data_dict['img']
+        input_size = [inputs.size(3), inputs.size(2)]
+        batch_detections = YOLOv3Test.decode(outputs[2], self.configer, input_size)
+        batch_pred_bboxes = self.__get_object_list(batch_detections, input_size)
+        self.det_running_score.update(batch_pred_bboxes, data_dict['bboxes'], data_dict['labels'])
+
+    def _evaluate(self):
+        Log.info('Val mAP: {}'.format(self.det_running_score.get_mAP()))
+        self.det_running_score.reset()
+        return dict(iters=self.runner_state['iters'])
 
     def __get_object_list(self, batch_detections, input_size):
+        """[x1, y1, x2, y2, label, score] tensors of every image, on the device of the detections."""
         batch_pred_bboxes = list()
         for idx, detections in enumerate(batch_detections):
-            object_list = list()
-            if detections is not None:
-                for x1, y1, x2, y2, conf, cls_conf, cls_pred in detections:
-                    xmin = x1.cpu().item()
-                    ymin = y1.cpu().item()
-                    xmax = x2.cpu().item()
-                    ymax = y2.cpu().item()
-                    cf = conf.cpu().item()
-                    cls_pred = cls_pred.cpu().item()
-                    object_list.append([xmin, ymin, xmax, ymax, int(cls_pred), float('%.2f' % cf)])
-
-            batch_pred_bboxes.append(object_list)
+            if detections is None:
+                batch_pred_bboxes.append(None)
+                continue
+
+            batch_pred_bboxes.append(torch.cat((detections[:, :4], detections[:, 6:7],
+                                                (detections[:, 4:5] * 100).round() / 100), 1))
 
         return batch_pred_bboxes
 
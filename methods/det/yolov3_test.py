@@ -18,7 +18,6 @@ from methods.tools.runner_helper import RunnerHelper
 from models.det_model_manager import DetModelManager
 from utils.helpers.det_helper import DetHelper
 from utils.helpers.image_helper import ImageHelper
-from utils.helpers.json_helper import JsonHelper
 from utils.layers.det.yolo_detection_layer import YOLODetectionLayer
 from utils.layers.det.yolo_target_generator import YOLOTargetGenerator
 from utils.tools.logger import Logger as Log
@@ -37,6 +36,7 @@ class YOLOv3Test(object):
         self.yolo_target_generator = YOLOTargetGenerator(configer)
         self.yolo_detection_layer = YOLODetectionLayer(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.det_net = None
 
         self._init_model()
@@ -46,32 +46,34 @@ class YOLOv3Test(object):
         self.det_net = RunnerHelper.load_net(self, self.det_net)
         self.det_net.eval()
 
-    def __test_img(self, image_path, json_path, raw_path, vis_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         img = ImageHelper.read_image(image_path,
                                      tool=self.configer.get('data', 'image_tool'),
                                      mode=self.configer.get('data', 'input_mode'))
         ori_img_bgr = ImageHelper.get_cv2_bgr(img, mode=self.configer.get('data', 'input_mode'))
 
-        inputs = self.blob_helper.make_input(img,
-                                             input_size=self.configer.get('data', 'input_size'), scale=1.0)
+        inputs = self.blob_helper.make_input(img, input_size=self.configer.get('data', 'input_size'),
+                                             scale=1.0, device='cpu')
+        return dict(img=inputs, ori_img_bgr=ori_img_bgr, input_size=[inputs.size(3), inputs.size(2)])
 
-        with torch.no_grad():
-            inputs = inputs.unsqueeze(0).to(self.device)
-            _, _, detections = self.det_net(inputs)
+    def _infer(self, batch_dict):
+        _, _, detections = self.det_net(batch_dict['img'])
+        batch_detections = self.decode(detections.float(), self.configer, batch_dict['input_size'][0])
+        return [None if detections is None else detections.cpu() for detections in batch_detections]
 
-        batch_detections = self.decode(detections, self.configer)
-        json_dict = self.__get_info_tree(batch_detections[0], ori_img_bgr)
+    def _write(self, detections, data_dict, path_dict, sink):
+        ori_img_bgr = data_dict['ori_img_bgr']
+        json_dict = self.__get_info_tree(detections, ori_img_bgr, data_dict['input_size'])
 
-        image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
-                                                   json_dict,
-                                                   conf_threshold=self.configer.get('res', 'vis_conf_thre'))
-        ImageHelper.save(ori_img_bgr, raw_path)
-        ImageHelper.save(image_canvas, vis_path)
+        if sink.need_vis(path_dict):
+            image_canvas = self.det_parser.draw_bboxes(ori_img_bgr.copy(),
+                                                       json_dict,
+                                                       conf_threshold=self.configer.get('res', 'vis_conf_thre'))
+            sink.save_vis(image_canvas, path_dict)
 
-        Log.info('Json Path: {}'.format(json_path))
-        JsonHelper.save_file(json_dict, json_path)
-        return json_dict
+        sink.save_raw(ori_img_bgr, path_dict)
+        sink.save_json(json_dict, path_dict)
 
     @staticmethod
     def decode(batch_pred_bboxes, configer, input_size):
@@ -88,40 +90,33 @@ class YOLOv3Test(object):
         batch_pred_bboxes[:, :, :4] = box_corner[:, :, :4]
         batch_pred_bboxes[:, :, 0::2] *= input_size[0]
         batch_pred_bboxes[:, :, 1::2] *= input_size[1]
-        output = [None for _ in range(len(batch_pred_bboxes))]
-        for image_i, image_pred in enumerate(batch_pred_bboxes):
-            # Filter out confidence scores below threshold
-            conf_mask = (image_pred[:, 4] > configer.get('res', 'val_conf_thre')).squeeze()
-            image_pred = image_pred[conf_mask]
-            # If none are remaining => process next image
-            if image_pred.numel() == 0:
-                continue
-
-            # Get score and class with highest confidence
-            class_conf, class_pred = torch.max(
-                image_pred[:, 5:5 + configer.get('data', 'num_classes')], 1, keepdim=True)
-            # Detections ordered as (x1, y1, x2, y2, obj_conf, class_conf, class_pred)
-            detections = torch.cat((image_pred[:, :5], class_conf.float(), class_pred.float()), 1)
-            output[image_i] = DetHelper.cls_nms(detections,
-                                                labels=class_pred.squeeze(1),
-                                                max_threshold=configer.get('nms', 'max_threshold'))
-
-        return output
+        # Filter out confidence scores below threshold
+        conf_mask = batch_pred_bboxes[:, :, 4] > configer.get('res', 'val_conf_thre')
+        batch_index, pred_index = conf_mask.nonzero(as_tuple=True)
+        image_pred = batch_pred_bboxes[batch_index, pred_index]
+        # Get score and class with highest confidence
+        class_conf, class_pred = torch.max(image_pred[:, 5:5 + configer.get('data', 'num_classes')], 1, keepdim=True)
+        # Detections ordered as (x1, y1, x2, y2, obj_conf, class_conf, class_pred)
+        detections = torch.cat((image_pred[:, :5], class_conf.float(), class_pred.float()), 1)
+        keep = DetHelper.batch_nms(detections[:, :5],
+                                   group_ids=batch_index * configer.get('data', 'num_classes') + class_pred.squeeze(1),
+                                   max_threshold=configer.get('nms', 'max_threshold'))
+        return DetHelper.split_batch(detections[keep], batch_index[keep], batch_pred_bboxes.size(0))
 
     def __get_info_tree(self, detections, image_raw, input_size):
         height, width, _ = image_raw.shape
         json_dict = dict()
         object_list = list()
         if detections is not None:
-            for x1, y1, x2, y2, conf, cls_conf, cls_pred in detections:
+            for x1, y1, x2, y2, conf, cls_conf, cls_pred in detections.cpu().tolist():
                 object_dict = dict()
-                xmin = x1.cpu().item() / input_size[0] * width
-                ymin = y1.cpu().item() / input_size[1] * height
-                xmax = x2.cpu().item() / input_size[0] * width
-                ymax = y2.cpu().item() / input_size[1] * height
+                xmin = x1 / input_size[0] * width
+                ymin = y1 / input_size[1] * height
+                xmax = x2 / input_size[0] * width
+                ymax = y2 / input_size[1] * height
                 object_dict['bbox'] = [xmin, ymin, xmax, ymax]
-                object_dict['label'] = int(cls_pred.cpu().item())
-                object_dict['score'] = float('%.2f' % conf.cpu().item())
+                object_dict['label'] = int(cls_pred)
+                object_dict['score'] = float('%.2f' % conf)
 
                 object_list.append(object_dict)
 
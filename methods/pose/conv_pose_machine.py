@@ -8,17 +8,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import time
-import torch
-
 from datasets.pose.data_loader import DataLoader
 from loss.loss_manager import LossManager
+from methods.tools.engine import Engine
 from methods.tools.runner_helper import RunnerHelper
 from methods.tools.trainer import Trainer
 from models.pose_model_manager import PoseModelManager
 from utils.layers.pose.heatmap_generator import HeatmapGenerator
-from utils.tools.average_meter import AverageMeter
-from utils.tools.logger import Logger as Log
 from vis.visualizer.pose_visualizer import PoseVisualizer
 
 
@@ -28,10 +24,6 @@ class ConvPoseMachine(object):
     """
     def __init__(self, configer):
         self.configer = configer
-        self.batch_time = AverageMeter()
-        self.data_time = AverageMeter()
-        self.train_losses = AverageMeter()
-        self.val_losses = AverageMeter()
         self.pose_visualizer = PoseVisualizer(configer)
         self.pose_loss_manager = LossManager(configer)
         self.pose_model_manager = PoseModelManager(configer)
@@ -43,6 +35,8 @@ class ConvPoseMachine(object):
         self.val_loader = None
         self.optimizer = None
         self.scheduler = None
+        self.scaler = None
+        self.engine = None
         self.runner_state = dict()
 
         self._init_model()
@@ -57,6 +51,7 @@ class ConvPoseMachine(object):
         self.val_loader = self.pose_data_loader.get_valloader()
 
         self.mse_loss = self.pose_loss_manager.get_pose_loss()
+        self.engine = Engine(self.configer)
 
     def _get_parameters(self):
 
@@ -66,95 +61,29 @@ class ConvPoseMachine(object):
         """
           Train function of every epoch during train phase.
         """
-        self.pose_net.train()
-        start_time = time.time()
-        # Adjust the learning rate after every epoch.
-        self.runner_state['epoch'] += 1
-
-        # data_tuple: (inputs, heatmap, maskmap, tagmap, num_objects)
-        for i, data_dict in enumerate(self.train_loader):
-            Trainer.update(self)
-            inputs = data_dict['img']
-            heatmap = data_dict['heatmap']
-
-            self.data_time.update(time.time() - start_time)
-            # Change the data type.
-            inputs, heatmap = RunnerHelper.to_device(self, inputs, heatmap)
-            # self.pose_visualizer.vis_peaks(heatmap[0], inputs[0], name='cpm')
-
-            # Forward pass.
-            outputs = self.pose_net(inputs)
-
-            # Compute the loss of the train batch & backward.
-            loss = self.mse_loss(outputs, heatmap)
-
-            self.train_losses.update(loss.item(), inputs.size(0))
-            self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
-
-            # Update the vars of the train phase.
-            self.batch_time.update(time.time() - start_time)
-            start_time = time.time()
-            self.runner_state['iters'] += 1
-
-            # Print the log info & reset the states.
-            if self.runner_state['iters'] % self.configer.get('solver', 'display_iter') == 0:
-                Log.info('Train Epoch: {0}\tTrain Iteration: {1}\t'
-                         'Time {batch_time.sum:.3f}s / {2}iters, ({batch_time.avg:.3f})\t'
-                         'Data load {data_time.sum:.3f}s / {2}iters, ({data_time.avg:3f})\n'
-                         'Learning rate = {3}\tLoss = {loss.val:.8f} (ave = {loss.avg:.8f})\n'.format(
-                    self.runner_state['epoch'], self.runner_state['iters'],
-                    self.configer.get('solver', 'display_iter'),
-                    RunnerHelper.get_lr(self.optimizer), batch_time=self.batch_time,
-                    data_time=self.data_time, loss=self.train_losses))
-                self.batch_time.reset()
-                self.data_time.reset()
-                self.train_losses.reset()
-
-            if self.configer.get('lr', 'metric') == 'iters' \
-                    and self.runner_state['iters'] == self.configer.get('solver', 'max_iters'):
-                break
-
-            # Check to val the current model.
-            if self.runner_state['iters'] % self.configer.get('solver', 'test_interval') == 0:
-                self.val()
+        self.engine.train(self, self.pose_net)
 
     def val(self):
         """
           Validation function during the train phase.
         """
-        self.pose_net.eval()
-        start_time = time.time()
-
-        with torch.no_grad():
-            for j, data_dict in enumerate(self.val_loader):
-                inputs = data_dict['img']
-                heatmap = data_dict['heatmap']
-                # Change the data type.
-                inputs, heatmap = RunnerHelper.to_device(self, inputs, heatmap)
-
-                # Forward pass.
-                outputs = self.pose_net(inputs)
-
-                # Compute the loss of the val batch.
-                loss = self.mse_loss(outputs[-1], heatmap)
-
-                self.val_losses.update(loss.item(), inputs.size(0))
-
-                # Update the vars of the val phase.
-                self.batch_time.update(time.time() - start_time)
-                start_time = time.time()
-
-            RunnerHelper.save_net(self, self.pose_net, iters=self.runner_state['iters'])
-            # Print the log info & reset the states.
-            Log.info(
-                'Test Time {batch_time.sum:.3f}s, ({batch_time.avg:.3f})\t'
-                'Loss {loss.avg:.8f}\n'.format(
-                    batch_time=self.batch_time, loss=self.val_losses))
-            self.batch_time.reset()
-            self.val_losses.reset()
-            self.pose_net.train()
+        self.engine.val(self, self.pose_net)
+
+    def _forward(self, data_dict):
+        return self.pose_net(data_dict['img'])
+
+    def _loss(self, outputs, data_dict):
+        if not self.pose_net.training:
+            # only the last stage is validated.
+            outputs = outputs[-1]
+
+        return self.mse_loss(outputs, data_dict['heatmap'])
+
+    def _postprocess(self, outputs, data_dict):
+        pass
+
+    def _evaluate(self):
+        return dict(iters=self.runner_state['iters'])
 
 
 if __name__ == "__main__":
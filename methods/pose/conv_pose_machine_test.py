@@ -33,6 +33,7 @@ class ConvPoseMachineTest(object):
         self.pose_data_loader = DataLoader(configer)
         self.heatmap_generator = HeatmapGenerator(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.pose_net = None
 
         self._init_model()
@@ -42,32 +43,39 @@ class ConvPoseMachineTest(object):
         self.pose_net = RunnerHelper.load_net(self, self.pose_net)
         self.pose_net.eval()
 
-    def __test_img(self, image_path, save_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         ori_image = ImageHelper.read_image(image_path,
                                            tool=self.configer.get('data', 'image_tool'),
                                            mode=self.configer.get('data', 'input_mode'))
 
-        ori_width, ori_height = ImageHelper.get_size(ori_image)
         ori_img_bgr = ImageHelper.get_cv2_bgr(ori_image, mode=self.configer.get('data', 'input_mode'))
+        blob_list = [self.blob_helper.make_input(ori_image, input_size=self.configer.get('test', 'input_size'),
+                                                 scale=scale, device='cpu')
+                     for scale in self.configer.get('test', 'scale_search')]
+        return dict(img=blob_list, ori_img_bgr=ori_img_bgr)
+
+    def _infer(self, batch_dict):
+        batch_heatmaps = list()
+        for image in batch_dict['img']:
+            heatmap_out_list = self.pose_net(image)
+            batch_heatmaps.append(heatmap_out_list[-1].permute(0, 2, 3, 1).float().cpu().numpy())
+
+        # The heatmaps of every scale, grouped by the images.
+        return [[heatmaps[i] for heatmaps in batch_heatmaps] for i in range(len(batch_dict['ori_img_bgr']))]
+
+    def _write(self, heatmap_list, data_dict, path_dict, sink):
+        ori_img_bgr = data_dict['ori_img_bgr']
+        ori_height, ori_width, _ = ori_img_bgr.shape
         heatmap_avg = np.zeros((ori_height, ori_width, self.configer.get('network', 'heatmap_out')))
-        for i, scale in enumerate(self.configer.get('test', 'scale_search')):
-            image = self.blob_helper.make_input(ori_image,
-                                                input_size=self.configer.get('test', 'input_size'),
-                                                scale=scale)
-            with torch.no_grad():
-                heatmap_out_list = self.pose_net(image)
-                heatmap_out = heatmap_out_list[-1]
-
-                # extract outputs, resize, and remove padding
-                heatmap = heatmap_out.squeeze(0).cpu().numpy().transpose(1, 2, 0)
-                heatmap = cv2.resize(heatmap, (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-
-                heatmap_avg = heatmap_avg + heatmap / len(self.configer.get('test', 'scale_search'))
+        for heatmap in heatmap_list:
+            # extract outputs, resize, and remove padding
+            heatmap = cv2.resize(heatmap, (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
+            heatmap_avg = heatmap_avg + heatmap / len(heatmap_list)
 
         all_peaks = self.__extract_heatmap_info(heatmap_avg)
-        image_canvas = self.__draw_key_point(all_peaks, ori_img_bgr)
-        ImageHelper.save(image_canvas, save_path)
+        if sink.need_vis(path_dict):
+            sink.save_vis(self.__draw_key_point(all_peaks, ori_img_bgr), path_dict)
 
     def __extract_heatmap_info(self, heatmap_avg):
         all_peaks = []
@@ -8,7 +8,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
 import os
 import cv2
 import numpy as np
@@ -20,7 +19,6 @@ from methods.tools.blob_helper import BlobHelper
 from methods.tools.runner_helper import RunnerHelper
 from models.pose_model_manager import PoseModelManager
 from utils.helpers.image_helper import ImageHelper
-from utils.helpers.json_helper import JsonHelper
 from utils.layers.pose.heatmap_generator import HeatmapGenerator
 from utils.layers.pose.paf_generator import PafGenerator
 from utils.tools.logger import Logger as Log
@@ -39,6 +37,7 @@ class OpenPoseTest(object):
         self.heatmap_generator = HeatmapGenerator(configer)
         self.paf_generator = PafGenerator(configer)
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.pose_net = None
 
         self._init_model()
@@ -50,7 +49,7 @@ class OpenPoseTest(object):
 
     def _get_blob(self, ori_image, scale=None):
         assert scale is not None
-        image = self.blob_helper.make_input(image=ori_image, scale=scale)
+        image = self.blob_helper.make_input(image=ori_image, scale=scale, device='cpu')
 
         b, c, h, w = image.size()
         border_hw = [h, w]
@@ -66,8 +65,7 @@ class OpenPoseTest(object):
 
         return image, border_hw
 
-    def __test_img(self, image_path, json_path, raw_path, vis_path):
-
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         ori_image = ImageHelper.read_image(image_path,
                                            tool=self.configer.get('data', 'image_tool'),
@@ -75,45 +73,58 @@ class OpenPoseTest(object):
 
         ori_width, ori_height = ImageHelper.get_size(ori_image)
         ori_img_bgr = ImageHelper.get_cv2_bgr(ori_image, mode=self.configer.get('data', 'input_mode'))
-        heatmap_avg = np.zeros((ori_height, ori_width, self.configer.get('network', 'heatmap_out')))
-        paf_avg = np.zeros((ori_height, ori_width, self.configer.get('network', 'paf_out')))
         multiplier = [scale * self.configer.get('test', 'input_size')[1] / ori_height
                       for scale in self.configer.get('test', 'scale_search')]
-        stride = self.configer.get('network', 'stride')
-        for i, scale in enumerate(multiplier):
+        blob_list, border_list = list(), list()
+        for scale in multiplier:
             image, border_hw = self._get_blob(ori_image, scale=scale)
-            with torch.no_grad():
-                paf_out_list, heatmap_out_list = self.pose_net(image)
-                paf_out = paf_out_list[-1]
-                heatmap_out = heatmap_out_list[-1]
+            blob_list.append(image)
+            border_list.append(border_hw)
 
-                # extract outputs, resize, and remove padding
-                heatmap = heatmap_out.squeeze(0).cpu().numpy().transpose(1, 2, 0)
+        return dict(img=blob_list, ori_img_bgr=ori_img_bgr, border_list=border_list)
 
-                heatmap = cv2.resize(heatmap, None, fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
-                heatmap = cv2.resize(heatmap[:border_hw[0], :border_hw[1]],
-                                     (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
+    def _infer(self, batch_dict):
+        batch_outputs = list()
+        for image in batch_dict['img']:
+            paf_out_list, heatmap_out_list = self.pose_net(image)
+            batch_outputs.append((heatmap_out_list[-1].permute(0, 2, 3, 1).float().cpu().numpy(),
+                                  paf_out_list[-1].permute(0, 2, 3, 1).float().cpu().numpy()))
 
-                paf = paf_out.squeeze(0).cpu().numpy().transpose(1, 2, 0)
-                paf = cv2.resize(paf, None, fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
-                paf = cv2.resize(paf[:border_hw[0], :border_hw[1]],
+        # The (heatmap, paf) of every scale, grouped by the images.
+        return [[(heatmaps[i], pafs[i]) for heatmaps, pafs in batch_outputs]
+                for i in range(len(batch_dict['ori_img_bgr']))]
+
+    def _write(self, output_list, data_dict, path_dict, sink):
+        ori_img_bgr = data_dict['ori_img_bgr']
+        ori_height, ori_width, _ = ori_img_bgr.shape
+        heatmap_avg = np.zeros((ori_height, ori_width, self.configer.get('network', 'heatmap_out')))
+        paf_avg = np.zeros((ori_height, ori_width, self.configer.get('network', 'paf_out')))
+        stride = self.configer.get('network', 'stride')
+        for (heatmap, paf), border_hw in zip(output_list, data_dict['border_list']):
+            # extract outputs, resize, and remove padding
+            heatmap = cv2.resize(heatmap, None, fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
+            heatmap = cv2.resize(heatmap[:border_hw[0], :border_hw[1]],
                                  (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
 
-                heatmap_avg = heatmap_avg + heatmap / len(multiplier)
-                paf_avg = paf_avg + paf / len(multiplier)
+            paf = cv2.resize(paf, None, fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
+            paf = cv2.resize(paf[:border_hw[0], :border_hw[1]],
+                             (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
+
+            heatmap_avg = heatmap_avg + heatmap / len(output_list)
+            paf_avg = paf_avg + paf / len(output_list)
 
         all_peaks = self.__extract_heatmap_info(heatmap_avg)
         special_k, connection_all = self.__extract_paf_info(ori_img_bgr, paf_avg, all_peaks)
         subset, candidate = self.__get_subsets(connection_all, special_k, all_peaks)
         json_dict = self.__get_info_tree(ori_img_bgr, subset, candidate)
 
-        image_canvas = self.pose_parser.draw_points(ori_img_bgr.copy(), json_dict)
-        image_canvas = self.pose_parser.link_points(image_canvas, json_dict)
+        if sink.need_vis(path_dict):
+            image_canvas = self.pose_parser.draw_points(ori_img_bgr.copy(), json_dict)
+            image_canvas = self.pose_parser.link_points(image_canvas, json_dict)
+            sink.save_vis(image_canvas, path_dict)
 
-        ImageHelper.save(image_canvas, vis_path)
-        ImageHelper.save(ori_img_bgr, raw_path)
-        Log.info('Json Save Path: {}'.format(json_path))
-        JsonHelper.save_file(json_dict, json_path)
+        sink.save_raw(ori_img_bgr, path_dict)
+        sink.save_json(json_dict, path_dict)
 
     def __get_info_tree(self, image_raw, subset, candidate):
         json_dict = dict()
@@ -197,54 +208,93 @@ class OpenPoseTest(object):
 
         return all_peaks
 
+    @staticmethod
+    def __get_line_points(start, end, num):
+        """The points of np.linspace(start, end, num) for every element of the arrays, sized [num, *start.shape]."""
+        if num == 1:
+            return start[None].copy()
+
+        steps = np.arange(num, dtype=np.float64).reshape((-1,) + (1,) * start.ndim)
+        delta = end - start
+        step = delta / (num - 1)
+        # np.linspace scales the steps by delta when the step is 0.
+        points = np.where(step == 0, steps / (num - 1) * delta, steps * step) + start
+        points[-1] = end
+        return points
+
+    @staticmethod
+    def __greedy_match(index_a, index_b, num_a, num_b):
+        """Match the pairs sorted by priority greedily, a pair is taken if both of its ends are not taken yet.
+
+        A pair is taken once it's the first pair left of both its ends, and the pairs of the taken ends are
+        dropped, so every round takes at least the first pair left.
+        Return:
+          ranks(ndarray): the ranks of the taken pairs, in the order of priority.
+
+        """
+        ranks = np.arange(len(index_a))
+        used_a = np.zeros((num_a,), dtype=bool)
+        used_b = np.zeros((num_b,), dtype=bool)
+        taken_list = list()
+        while len(ranks) > 0:
+            first_a = np.full((num_a,), len(index_a))
+            np.minimum.at(first_a, index_a[ranks], ranks)
+            first_b = np.full((num_b,), len(index_b))
+            np.minimum.at(first_b, index_b[ranks], ranks)
+            taken = ranks[(first_a[index_a[ranks]] == ranks) & (first_b[index_b[ranks]] == ranks)]
+            taken_list.append(taken)
+            used_a[index_a[taken]] = True
+            used_b[index_b[taken]] = True
+            ranks = ranks[~used_a[index_a[ranks]] & ~used_b[index_b[ranks]]]
+
+        return np.sort(np.concatenate(taken_list)) if len(taken_list) > 0 else np.zeros((0,), dtype=int)
+
     def __extract_paf_info(self, img_raw, paf_avg, all_peaks):
         connection_all = []
         special_k = []
         mid_num = self.configer.get('res', 'mid_point_num')
+        limb_threshold = self.configer.get('res', 'limb_threshold')
+        min_positive = int(self.configer.get('res', 'limb_pos_ratio') * mid_num)
 
         for k in range(len(self.configer.get('details', 'limb_seq'))):
             score_mid = paf_avg[:, :, [k*2, k*2+1]]
-            candA = all_peaks[self.configer.get('details', 'limb_seq')[k][0] - 1]
-            candB = all_peaks[self.configer.get('details', 'limb_seq')[k][1] - 1]
+            candA = np.array(all_peaks[self.configer.get('details', 'limb_seq')[k][0] - 1],
+                             dtype=np.float64).reshape(-1, 4)
+            candB = np.array(all_peaks[self.configer.get('details', 'limb_seq')[k][1] - 1],
+                             dtype=np.float64).reshape(-1, 4)
             nA = len(candA)
             nB = len(candB)
             if nA != 0 and nB != 0:
-                connection_candidate = []
-                for i in range(nA):
-                    for j in range(nB):
-                        vec = np.subtract(candB[j][:2], candA[i][:2])
-                        norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1]) + 1e-9
-                        vec = np.divide(vec, norm)
-
-                        startend = zip(np.linspace(candA[i][0], candB[j][0], num=mid_num),
-                                       np.linspace(candA[i][1], candB[j][1], num=mid_num))
-                        startend = list(startend)
-
-                        vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0]
-                                          for I in range(len(startend))])
-                        vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1]
-                                          for I in range(len(startend))])
-
-                        score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
-                        score_with_dist_prior = sum(score_midpts) / len(score_midpts)
-                        score_with_dist_prior += min(0.5 * img_raw.shape[0] / norm - 1, 0)
-
-                        num_positive = len(np.nonzero(score_midpts > self.configer.get('res', 'limb_threshold'))[0])
-                        criterion1 = num_positive > int(self.configer.get('res', 'limb_pos_ratio') * len(score_midpts))
-                        criterion2 = score_with_dist_prior > 0
-                        if criterion1 and criterion2:
-                            connection_candidate.append(
-                                [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
-
-                connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
-                connection = np.zeros((0, 5))
-                for c in range(len(connection_candidate)):
-                    i, j, s = connection_candidate[c][0:3]
-                    if i not in connection[:, 3] and j not in connection[:, 4]:
-                        connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
-                        if len(connection) >= min(nA, nB):
-                            break
-
+                # The line integrals of all the (candA, candB) pairs, sized [nA, nB].
+                start = np.broadcast_to(candA[:, None, :2], (nA, nB, 2))
+                end = np.broadcast_to(candB[None, :, :2], (nA, nB, 2))
+                vec = end - start
+                norm = np.sqrt(vec[:, :, 0] * vec[:, :, 0] + vec[:, :, 1] * vec[:, :, 1]) + 1e-9
+                vec = vec / norm[:, :, None]
+
+                points = np.round(self.__get_line_points(start, end, mid_num)).astype(int)
+                vec_x = score_mid[points[:, :, :, 1], points[:, :, :, 0], 0]
+                vec_y = score_mid[points[:, :, :, 1], points[:, :, :, 0], 1]
+                score_midpts = vec_x * vec[:, :, 0] + vec_y * vec[:, :, 1]
+
+                # Sum the mid points in order, as the sum of the python list.
+                score_sum = 0
+                for score in score_midpts:
+                    score_sum = score_sum + score
+
+                score_with_dist_prior = score_sum / mid_num
+                score_with_dist_prior += np.minimum(0.5 * img_raw.shape[0] / norm - 1, 0)
+
+                num_positive = np.count_nonzero(score_midpts > limb_threshold, axis=0)
+                criterion = (num_positive > min_positive) & (score_with_dist_prior > 0)
+
+                index_a, index_b = np.nonzero(criterion)
+                scores = score_with_dist_prior[index_a, index_b]
+                order = np.argsort(-scores, kind='stable')
+                index_a, index_b, scores = index_a[order], index_b[order], scores[order]
+                taken = self.__greedy_match(index_a, index_b, nA, nB)
+                connection = np.stack((candA[index_a[taken], 3], candB[index_b[taken], 3], scores[taken],
+                                       index_a[taken], index_b[taken]), 1).astype(np.float64)
                 connection_all.append(connection)
             else:
                 special_k.append(k)
@@ -252,54 +302,74 @@ class OpenPoseTest(object):
 
         return special_k, connection_all
 
+    @staticmethod
+    def __find(parent, row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+
+        return row
+
     def __get_subsets(self, connection_all, special_k, all_peaks):
         # last number in each row is the total parts number of that person
         # the second last number in each row is the score of the overall configuration
-        subset = -1 * np.ones((0, self.configer.get('data', 'num_kpts') + 2))
+        num_kpts = self.configer.get('data', 'num_kpts')
         candidate = np.array([item for sublist in all_peaks for item in sublist])
-
-        for k in self.configer.get('details', 'mini_tree'):
-            if k not in special_k:
-                partAs = connection_all[k][:, 0]
-                partBs = connection_all[k][:, 1]
-                indexA, indexB = np.array(self.configer.get('details', 'limb_seq')[k]) - 1
-
-                for i in range(len(connection_all[k])):  # = 1:size(temp,1)
-                    found = 0
-                    subset_idx = [-1, -1]
-                    for j in range(len(subset)):  # 1:size(subset,1):
-                        if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
-                            subset_idx[found] = j
-                            found += 1
-
-                    if found == 1:
-                        j = subset_idx[0]
-                        if (subset[j][indexB] != partBs[i]):
-                            subset[j][indexB] = partBs[i]
-                            subset[j][-1] += 1
-                            subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-                    elif found == 2:  # if found 2 and disjoint, merge them
-                        j1, j2 = subset_idx
-                        membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
-                        if len(np.nonzero(membership == 2)[0]) == 0:  # merge
-                            subset[j1][:-2] += (subset[j2][:-2] + 1)
-                            subset[j1][-2:] += subset[j2][-2:]
-                            subset[j1][-2] += connection_all[k][i][2]
-                            subset = np.delete(subset, j2, 0)
-                        else:  # as like found == 1
-                            subset[j1][indexB] = partBs[i]
-                            subset[j1][-1] += 1
-                            subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-
-                    # if find no partA in the subset, create a new subset
-                    elif not found:
-                        row = -1 * np.ones(self.configer.get('data', 'num_kpts') + 2)
-                        row[indexA] = partAs[i]
-                        row[indexB] = partBs[i]
-                        row[-1] = 2
-                        row[-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
-                        subset = np.vstack([subset, row])
-
+        tree_list = [k for k in self.configer.get('details', 'mini_tree') if k not in special_k]
+
+        # The rows in the creation order, the merged rows point to the rows they are merged into.
+        subset = -1 * np.ones((sum(len(connection_all[k]) for k in tree_list), num_kpts + 2))
+        parent = np.arange(len(subset))
+        num_rows = 0
+        # The rows holding every peak, a peak may be held by two rows if it's linked to a row not disjoint.
+        peak_rows = [list() for _ in range(len(candidate))]
+
+        for k in tree_list:
+            partAs = connection_all[k][:, 0]
+            partBs = connection_all[k][:, 1]
+            indexA, indexB = np.array(self.configer.get('details', 'limb_seq')[k]) - 1
+
+            for i in range(len(connection_all[k])):
+                partA, partB = int(partAs[i]), int(partBs[i])
+                subset_idx = sorted(set(self.__find(parent, row) for row in peak_rows[partA] + peak_rows[partB]))
+                found = min(len(subset_idx), 2)
+
+                j, link_same = None, False
+                if found == 1:
+                    j = subset_idx[0]
+                elif found == 2:  # if found 2 and disjoint, merge them
+                    j1, j2 = subset_idx[:2]
+                    membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
+                    if len(np.nonzero(membership == 2)[0]) == 0:  # merge
+                        subset[j1][:-2] += (subset[j2][:-2] + 1)
+                        subset[j1][-2:] += subset[j2][-2:]
+                        subset[j1][-2] += connection_all[k][i][2]
+                        parent[j2] = j1
+                    else:  # as like found == 1, even if partB is linked already
+                        j, link_same = j1, True
+
+                # if find no partA in the subset, create a new subset
+                elif not found:
+                    row = subset[num_rows]
+                    row[indexA] = partAs[i]
+                    row[indexB] = partBs[i]
+                    row[-1] = 2
+                    row[-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
+                    peak_rows[partA].append(num_rows)
+                    peak_rows[partB].append(num_rows)
+                    num_rows += 1
+
+                if j is not None and (link_same or subset[j][indexB] != partBs[i]):
+                    if subset[j][indexB] >= 0 and subset[j][indexB] != partBs[i]:
+                        old_part = int(subset[j][indexB])
+                        peak_rows[old_part] = [row for row in peak_rows[old_part] if self.__find(parent, row) != j]
+
+                    subset[j][indexB] = partBs[i]
+                    subset[j][-1] += 1
+                    subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+                    peak_rows[partB].append(j)
+
+        subset = subset[:num_rows][parent[:num_rows] == np.arange(num_rows)]
         return subset, candidate
 
     def debug(self, vis_dir):
@@ -17,6 +17,8 @@ from PIL import Image
 from datasets.seg.data_loader import DataLoader
 from methods.tools.blob_helper import BlobHelper
 from methods.tools.runner_helper import RunnerHelper
+from methods.tools.sliding_window import SlidingWindow
+from methods.tools.tta_engine import TTAEngine
 from models.seg_model_manager import SegModelManager
 from utils.helpers.image_helper import ImageHelper
 from utils.tools.logger import Logger as Log
@@ -32,7 +34,20 @@ class FCNSegmentorTest(object):
         self.seg_parser = SegParser(configer)
         self.seg_model_manager = SegModelManager(configer)
         self.seg_data_loader = DataLoader(configer)
+        self.tta_engine = TTAEngine(configer)
+        self.sliding_window = None
+        if self.configer.get('test', 'mode') in ('sscrop_test', 'mscrop_test'):
+            self.sliding_window = SlidingWindow(configer)
+
+        # Predict the crops row by row, the inputs stay on the host.
+        self.crop_stream = self.configer.exists('test', 'crop_stream') and self.configer.get('test', 'crop_stream')
+        if self.crop_stream and self.configer.get('test', 'mode') != 'sscrop_test':
+            Log.error('crop_stream only supports the sscrop_test mode.')
+            exit(1)
+
+        self.host_inputs = self.crop_stream
         self.device = torch.device('cpu' if self.configer.get('gpu') is None else 'cuda')
+        self.runner_state = dict()
         self.seg_net = None
 
         self._init_model()
@@ -48,23 +63,23 @@ class FCNSegmentorTest(object):
         if self.configer.exists('test', 'input_size'):
             image = self.blob_helper.make_input(image=ori_image,
                                                 input_size=self.configer.get('test', 'input_size'),
-                                                scale=scale)
+                                                scale=scale, device='cpu')
 
         elif self.configer.exists('test', 'min_side_length') and not self.configer.exists('test', 'max_side_length'):
             image = self.blob_helper.make_input(image=ori_image,
                                                 min_side_length=self.configer.get('test', 'min_side_length'),
-                                                scale=scale)
+                                                scale=scale, device='cpu')
 
         elif not self.configer.exists('test', 'min_side_length') and self.configer.exists('test', 'max_side_length'):
             image = self.blob_helper.make_input(image=ori_image,
                                                 max_side_length=self.configer.get('test', 'max_side_length'),
-                                                scale=scale)
+                                                scale=scale, device='cpu')
 
         elif self.configer.exists('test', 'min_side_length') and self.configer.exists('test', 'max_side_length'):
             image = self.blob_helper.make_input(image=ori_image,
                                                 min_side_length=self.configer.get('test', 'min_side_length'),
                                                 max_side_length=self.configer.get('test', 'max_side_length'),
-                                                scale=scale)
+                                                scale=scale, device='cpu')
 
         else:
             Log.error('Test setting error')
@@ -84,34 +99,56 @@ class FCNSegmentorTest(object):
 
         return image, border_hw
 
-    def test_img(self, image_path, label_path, vis_path, raw_path):
+    def _read(self, image_path):
         Log.info('Image Path: {}'.format(image_path))
         ori_image = ImageHelper.read_image(image_path,
                                            tool=self.configer.get('data', 'image_tool'),
                                            mode=self.configer.get('data', 'input_mode'))
-        total_logits = None
-        if self.configer.get('test', 'mode') == 'ss_test':
-            total_logits = self.ss_test(ori_image)
-
-        elif self.configer.get('test', 'mode') == 'sscrop_test':
-            total_logits = self.sscrop_test(ori_image)
-
-        elif self.configer.get('test', 'mode') == 'ms_test':
-            total_logits = self.ms_test(ori_image)
-
-        elif self.configer.get('test', 'mode') == 'mscrop_test':
-            total_logits = self.mscrop_test(ori_image)
-
-        else:
-            Log.error('Invalid test mode:{}'.format(self.configer.get('test', 'mode')))
+        test_mode = self.configer.get('test', 'mode')
+        if test_mode not in ('ss_test', 'sscrop_test', 'ms_test', 'mscrop_test'):
+            Log.error('Invalid test mode:{}'.format(test_mode))
             exit(1)
 
-        label_map = np.argmax(total_logits, axis=-1)
-        label_img = np.array(label_map, dtype=np.uint8)
-        ori_img_bgr = ImageHelper.get_cv2_bgr(ori_image, mode=self.configer.get('data', 'input_mode'))
-        image_canvas = self.seg_parser.colorize(label_img, image_canvas=ori_img_bgr)
-        ImageHelper.save(image_canvas, save_path=vis_path)
-        ImageHelper.save(ori_image, save_path=raw_path)
+        scale_list = [1.0] if test_mode in ('ss_test', 'sscrop_test') else self.configer.get('test', 'scale_search')
+        blob_list, border_list = list(), list()
+        for scale in scale_list:
+            image, border_hw = self._get_blob(ori_image, scale=scale)
+            blob_list.append(image)
+            # The crop modes keep the padded borders.
+            border_list.append(border_hw if test_mode in ('ss_test', 'ms_test') else None)
+
+        return dict(img=blob_list, ori_image=ori_image, border_list=border_list)
+
+    def _infer(self, batch_dict):
+        ori_size_list = [ImageHelper.get_size(ori_image) for ori_image in batch_dict['ori_image']]
+        if self.crop_stream:
+            inputs = batch_dict['img'][0]
+            label_maps = [self.sliding_window.stream(self._predict, inputs[i:i+1], self.device)
+                          for i in range(inputs.size(0))]
+            return [label_map if list(label_map.shape) == [height, width] else
+                    cv2.resize(label_map, (width, height), interpolation=cv2.INTER_NEAREST)
+                    for label_map, (width, height) in zip(label_maps, ori_size_list)]
+
+        def predict(inputs):
+            if self.sliding_window is not None and inputs.size()[3] > self.sliding_window.crop_size[0] \
+                    and inputs.size()[2] > self.sliding_window.crop_size[1]:
+                return torch.cat([self.sliding_window(self._predict, inputs[i:i+1])
+                                  for i in range(inputs.size(0))], 0)
+
+            return self._predict(inputs)
+
+        # The borders of every scale, for every image.
+        borders_list = list(zip(*batch_dict['border_list']))
+        return self.tta_engine(predict, batch_dict['img'], borders_list, ori_size_list)
+
+    def _write(self, label_img, data_dict, path_dict, sink):
+        ori_image = data_dict['ori_image']
+        if sink.need_vis(path_dict):
+            ori_img_bgr = ImageHelper.get_cv2_bgr(ori_image, mode=self.configer.get('data', 'input_mode'))
+            image_canvas = self.seg_parser.colorize(label_img, image_canvas=ori_img_bgr)
+            sink.save_vis(image_canvas, path_dict)
+
+        sink.save_raw(ori_image, path_dict)
 
         if self.configer.exists('data', 'label_list'):
             label_img = self.__relabel(label_img)
@@ -120,116 +157,13 @@ class FCNSegmentorTest(object):
             label_img = label_img + 1
             label_img = label_img.astype(np.uint8)
 
-        label_img = Image.fromarray(label_img, 'P')
-        Log.info('Label Path: {}'.format(label_path))
-        ImageHelper.save(label_img, label_path)
-
-    def ss_test(self, ori_image):
-        ori_width, ori_height = ImageHelper.get_size(ori_image)
-        total_logits = np.zeros((ori_height, ori_width, self.configer.get('data', 'num_classes')), np.float32)
-        image, border_hw = self._get_blob(ori_image, scale=1.0)
-        results = self._predict(image)
-        results = cv2.resize(results[:border_hw[0], :border_hw[1]],
-                             (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-        total_logits += results
-        return total_logits
-
-    def sscrop_test(self, ori_image):
-        ori_width, ori_height = ImageHelper.get_size(ori_image)
-        total_logits = np.zeros((ori_height, ori_width, self.configer.get('data', 'num_classes')), np.float32)
-        image, _ = self._get_blob(ori_image, scale=1.0)
-        crop_size = self.configer.get('test', 'crop_size')
-        if image.size()[3] > crop_size[0] and image.size()[2] > crop_size[1]:
-            results = self._crop_predict(image, crop_size)
-        else:
-            results = self._predict(image)
-
-        results = cv2.resize(results, (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-        total_logits += results
-        return total_logits
-
-    def mscrop_test(self, ori_image):
-        ori_width, ori_height = ImageHelper.get_size(ori_image)
-        total_logits = np.zeros((ori_height, ori_width, self.configer.get('data', 'num_classes')), np.float32)
-        for scale in self.configer.get('test', 'scale_search'):
-            image, _ = self._get_blob(ori_image, scale=scale)
-            crop_size = self.configer.get('test', 'crop_size')
-            if image.size()[3] > crop_size[0] and image.size()[2] > crop_size[1]:
-                results = self._crop_predict(image, crop_size)
-            else:
-                results = self._predict(image)
-
-            results = cv2.resize(results, (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-            total_logits += results
-
-        return total_logits
-
-    def ms_test(self, ori_image):
-        ori_width, ori_height = ImageHelper.get_size(ori_image)
-        total_logits = np.zeros((ori_height, ori_width, self.configer.get('data', 'num_classes')), np.float32)
-        for scale in self.configer.get('test', 'scale_search'):
-            image, border_hw = self._get_blob(ori_image, scale=scale)
-            results = self._predict(image)
-            results = cv2.resize(results[:border_hw[0], :border_hw[1]],
-                                 (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-            total_logits += results
-
-        if self.configer.get('data', 'image_tool') == 'cv2':
-            mirror_image = cv2.flip(ori_image, 1)
-        else:
-            mirror_image = ori_image.transpose(Image.FLIP_LEFT_RIGHT)
-
-        image, border_hw = self._get_blob(mirror_image, scale=1.0)
-        results = self._predict(image)
-        results = results[:border_hw[0], :border_hw[1]]
-        results = cv2.resize(results[:, ::-1], (ori_width, ori_height), interpolation=cv2.INTER_CUBIC)
-        total_logits += results
-        return total_logits
-
-    def _crop_predict(self, image, crop_size):
-        height, width = image.size()[2:]
-        np_image = image.squeeze(0).permute(1, 2, 0).cpu().numpy()
-        height_starts = self._decide_intersection(height, crop_size[1])
-        width_starts = self._decide_intersection(width, crop_size[0])
-        split_crops = []
-        for height in height_starts:
-            for width in width_starts:
-                image_crop = np_image[height:height + crop_size[1], width:width + crop_size[0]]
-                split_crops.append(image_crop[np.newaxis, :])
-
-        split_crops = np.concatenate(split_crops, axis=0)  # (n, crop_image_size, crop_image_size, 3)
-        inputs = torch.from_numpy(split_crops).permute(0, 3, 1, 2).to(self.device)
-        with torch.no_grad():
-            results = self.seg_net.forward(inputs)
-            results = results[-1].permute(0, 2, 3, 1).cpu().numpy()
-
-        reassemble = np.zeros((np_image.shape[0], np_image.shape[1], results.shape[-1]), np.float32)
-        index = 0
-        for height in height_starts:
-            for width in width_starts:
-                reassemble[height:height+crop_size[1], width:width+crop_size[0]] += results[index]
-                index += 1
-
-        return reassemble
-
-    def _decide_intersection(self, total_length, crop_length):
-        stride = int(crop_length * self.configer.get('test', 'crop_stride_ratio'))            # set the stride as the paper do
-        times = (total_length - crop_length) // stride + 1
-        cropped_starting = []
-        for i in range(times):
-            cropped_starting.append(stride*i)
-
-        if total_length - cropped_starting[-1] > crop_length:
-            cropped_starting.append(total_length - crop_length)  # must cover the total image
-
-        return cropped_starting
+        sink.save_label(Image.fromarray(label_img, 'P'), path_dict)
 
     def _predict(self, inputs):
         with torch.no_grad():
             results = self.seg_net.forward(inputs)
-            results = results[-1].squeeze(0).permute(1, 2, 0).cpu().numpy()
 
-        return results
+        return results[-1]
 
     def __relabel(self, label_map):
         height, width = label_map.shape
@@ -29,7 +29,7 @@ class BlobHelper(object):
         return torch.cat(input_list, 0)
 
     def make_input(self, image=None, input_size=None,
-                   min_side_length=None, max_side_length=None, scale=None):
+                   min_side_length=None, max_side_length=None, scale=None, device=None):
         if input_size is not None and min_side_length is None and max_side_length is None:
             if input_size[0] == -1 and input_size[1] == -1:
                 in_width, in_height = ImageHelper.get_size(image)
@@ -78,7 +78,10 @@ class BlobHelper(object):
         img_tensor = Normalize(div_value=self.configer.get('normalize', 'div_value'),
                                mean=self.configer.get('normalize', 'mean'),
                                std=self.configer.get('normalize', 'std'))(img_tensor)
-        img_tensor = img_tensor.unsqueeze(0).to(torch.device('cpu' if self.configer.get('gpu') is None else 'cuda'))
+        if device is None:
+            device = 'cpu' if self.configer.get('gpu') is None else 'cuda'
+
+        img_tensor = img_tensor.unsqueeze(0).to(torch.device(device))
 
         return img_tensor
 
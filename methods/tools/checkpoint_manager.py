@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Write the checkpoints in a background thread.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import copy
+import os
+import re
+import shutil
+import threading
+import torch
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from utils.tools.logger import Logger as Log
+
+
+class CheckpointManager(object):
+    """Snapshots the checkpoint state to cpu once, and writes it in a background thread.
+
+    The state is serialized once into a temp file, which is renamed to the first file name, so a checkpoint file
+    is never partially written. The other file names of the same state (e.g. the max performance and the iters
+    checkpoints of the latest one) are hard links to it. The periodic iters/epoch checkpoints beyond the last
+    checkpoints:keep_last ones are removed.
+    """
+    def __init__(self, configer):
+        self.configer = configer
+        self.checkpoints_name = configer.get('checkpoints', 'checkpoints_name')
+        self.keep_last = configer.get('checkpoints', 'keep_last') if configer.exists('checkpoints', 'keep_last') else None
+        # At most one state is waiting for the writer, so the snapshots in memory are bounded.
+        self.queue = Queue(maxsize=1)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def snapshot(obj):
+        """Copy the tensors to cpu, so the training can go on updating them while the snapshot is written."""
+        if isinstance(obj, torch.Tensor):
+            tensor = obj.detach()
+            return tensor.cpu() if tensor.is_cuda else tensor.clone()
+
+        if isinstance(obj, dict):
+            new_obj = type(obj)((key, CheckpointManager.snapshot(value)) for key, value in obj.items())
+            if hasattr(obj, '_metadata'):
+                # the versions of the modules in a state_dict.
+                new_obj._metadata = copy.deepcopy(obj._metadata)
+
+            return new_obj
+
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(CheckpointManager.snapshot(value) for value in obj)
+
+        return copy.deepcopy(obj)
+
+    def save(self, state, checkpoints_dir, file_names):
+        state = CheckpointManager.snapshot(state)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.wait)
+
+        self.queue.put((state, checkpoints_dir, file_names))
+
+    def wait(self):
+        """Block until all the queued checkpoints are written."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            state, checkpoints_dir, file_names = self.queue.get()
+            try:
+                self._write(state, checkpoints_dir, file_names)
+            except Exception as e:
+                Log.error('Saving checkpoints {} failed: {}'.format(file_names, e))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, state, checkpoints_dir, file_names):
+        if not os.path.exists(checkpoints_dir):
+            os.makedirs(checkpoints_dir)
+
+        file_path = os.path.join(checkpoints_dir, file_names[0])
+        temp_path = os.path.join(checkpoints_dir, '.{}.tmp'.format(file_names[0]))
+        torch.save(state, temp_path)
+        os.rename(temp_path, file_path)
+        for file_name in file_names[1:]:
+            link_temp_path = os.path.join(checkpoints_dir, '.{}.tmp'.format(file_name))
+            if os.path.exists(link_temp_path):
+                os.remove(link_temp_path)
+
+            try:
+                os.link(file_path, link_temp_path)
+            except OSError:
+                # e.g. the file system doesn't support hard links.
+                shutil.copyfile(file_path, link_temp_path)
+
+            os.rename(link_temp_path, os.path.join(checkpoints_dir, file_name))
+
+        self._remove_old(checkpoints_dir)
+
+    def _remove_old(self, checkpoints_dir):
+        if self.keep_last is None:
+            return
+
+        pattern = re.compile(r'^{}_(iters|epoch)(\d+)\.pth$'.format(re.escape(self.checkpoints_name)))
+        periodic_dict = dict()
+        for file_name in os.listdir(checkpoints_dir):
+            matched = pattern.match(file_name)
+            if matched is not None:
+                periodic_dict.setdefault(matched.group(1), list()).append((int(matched.group(2)), file_name))
+
+        for periodic_list in periodic_dict.values():
+            periodic_list = sorted(periodic_list)
+            for _, file_name in periodic_list[:max(len(periodic_list) - self.keep_last, 0)]:
+                os.remove(os.path.join(checkpoints_dir, file_name))
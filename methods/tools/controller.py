@@ -10,6 +10,8 @@ from __future__ import print_function
 
 import os
 
+from methods.tools.result_sink import ResultSink
+from methods.tools.test_pipeline import TestPipeline
 from utils.helpers.file_helper import FileHelper
 from utils.tools.logger import Logger as Log
 
@@ -18,14 +20,16 @@ class Controller(object):
 
     @staticmethod
     def init(runner):
-        runner.runner_state['iters'] = 0
-        runner.runner_state['last_iters'] = 0
-        runner.runner_state['epoch'] = 0
-        runner.runner_state['last_epoch'] = 0
-        runner.runner_state['performance'] = 0
-        runner.runner_state['val_loss'] = 0
-        runner.runner_state['max_performance'] = 0
-        runner.runner_state['min_val_loss'] = 0
+        # The runner state of a continued checkpoint is kept.
+        runner.runner_state.setdefault('iters', 0)
+        runner.runner_state.setdefault('micro_iters', 0)
+        runner.runner_state.setdefault('last_iters', 0)
+        runner.runner_state.setdefault('epoch', 0)
+        runner.runner_state.setdefault('last_epoch', 0)
+        runner.runner_state.setdefault('performance', 0)
+        runner.runner_state.setdefault('val_loss', 0)
+        runner.runner_state.setdefault('max_performance', 0)
+        runner.runner_state.setdefault('min_val_loss', 0)
 
         if runner.configer.get('network', 'bn_type') is None:
             runner.configer.update(['network', 'bn_type'], 'torchbn')
@@ -68,6 +72,18 @@ class Controller(object):
         runner.debug(base_dir)
         Log.info('Debugging end...')
 
+    @staticmethod
+    def _get_path_dict(base_dir, index, filename):
+        image_name = '.'.join(filename.split('.')[:-1])
+        return dict(
+            index=index,
+            name=image_name,
+            label_path=os.path.join(base_dir, 'label', '{}.png'.format(image_name)),
+            raw_path=os.path.join(base_dir, 'raw', filename),
+            vis_path=os.path.join(base_dir, 'vis', '{}_vis.png'.format(image_name)),
+            json_path=os.path.join(base_dir, 'json', '{}.json'.format(image_name))
+        )
+
     @staticmethod
     def test(runner):
         Log.info('Testing start...')
@@ -88,29 +104,12 @@ class Controller(object):
 
         if test_img is not None:
             base_dir = os.path.join(base_dir, 'test_img')
-            filename = test_img.rstrip().split('/')[-1]
-            label_path = os.path.join(base_dir, 'label', '{}.png'.format('.'.join(filename.split('.')[:-1])))
-            raw_path = os.path.join(base_dir, 'raw', filename)
-            vis_path = os.path.join(base_dir, 'vis', '{}_vis.png'.format('.'.join(filename.split('.')[:-1])))
-            FileHelper.make_dirs(label_path, is_file=True)
-            FileHelper.make_dirs(raw_path, is_file=True)
-            FileHelper.make_dirs(vis_path, is_file=True)
-
-            runner.test_img(test_img, label_path, vis_path, raw_path)
+            job_list = [(test_img, Controller._get_path_dict(base_dir, 0, test_img.rstrip().split('/')[-1]))]
 
         else:
             base_dir = os.path.join(base_dir, 'test_dir', test_dir.rstrip('/').split('/')[-1])
-            FileHelper.make_dirs(base_dir)
-
-            for filename in FileHelper.list_dir(test_dir):
-                image_path = os.path.join(test_dir, filename)
-                label_path = os.path.join(base_dir, 'label', '{}.png'.format('.'.join(filename.split('.')[:-1])))
-                raw_path = os.path.join(base_dir, 'raw', filename)
-                vis_path = os.path.join(base_dir, 'vis', '{}_vis.png'.format('.'.join(filename.split('.')[:-1])))
-                FileHelper.make_dirs(label_path, is_file=True)
-                FileHelper.make_dirs(raw_path, is_file=True)
-                FileHelper.make_dirs(vis_path, is_file=True)
-
-                runner.test_img(image_path, label_path, vis_path, raw_path)
+            job_list = [(os.path.join(test_dir, filename), Controller._get_path_dict(base_dir, i, filename))
+                        for i, filename in enumerate(FileHelper.list_dir(test_dir))]
 
+        TestPipeline(runner.configer).run(runner, job_list, ResultSink(runner.configer, base_dir))
         Log.info('Testing end...')
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# The train and val loops shared by all the runners.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import torch
+
+from datasets.tools.data_prefetcher import DataPrefetcher
+from methods.tools.runner_helper import RunnerHelper
+from methods.tools.trainer import Trainer
+from utils.tools.average_meter import AverageMeter
+from utils.tools.logger import Logger as Log
+
+
+class Engine(object):
+    """The iteration loops of the train phase, the runner only implements the hooks of its task:
+
+      _forward(data_dict): the outputs of the net, the tensors of data_dict are already on the device.
+      _loss(outputs, data_dict): the loss, or a dict of the named losses with the total one as 'loss'.
+      _postprocess(outputs, data_dict): update the running score with a val batch.
+      _evaluate(): log & reset the running score, return the kwargs of RunnerHelper.save_net.
+
+    The hooks can tell the train and val batches apart by the training flag of the net.
+    """
+    def __init__(self, configer):
+        self.configer = configer
+        self.batch_time = AverageMeter()
+        self.data_time = AverageMeter()
+        self.train_losses = dict(loss=AverageMeter())
+        self.val_losses = dict(loss=AverageMeter())
+
+        # The config values looked up in every iteration.
+        self.device = 'cpu' if configer.get('gpu') is None else 'cuda'
+        self.display_iter = configer.get('solver', 'display_iter')
+        self.test_interval = configer.get('solver', 'test_interval')
+        self.lr_metric = configer.get('lr', 'metric')
+        self.max_iters = configer.get('solver', 'max_iters') if self.lr_metric == 'iters' else None
+
+    @staticmethod
+    def _update_losses(loss_meters, loss_dict, batch_size):
+        # The losses stay on the device until they are logged, so the loop doesn't sync in every iteration.
+        for key, loss in loss_dict.items():
+            if key not in loss_meters:
+                loss_meters[key] = AverageMeter()
+
+            loss_meters[key].update(loss.detach(), batch_size)
+
+    @staticmethod
+    def _log_losses(loss_meters):
+        named_losses = ['{} = {:.8f}'.format(key, meter.avg) for key, meter in loss_meters.items() if key != 'loss']
+        if len(named_losses) > 0:
+            Log.info('Named losses: {}'.format(', '.join(named_losses)))
+
+    @staticmethod
+    def _reset_losses(loss_meters):
+        for meter in loss_meters.values():
+            meter.reset()
+
+    def train(self, runner, net, backbone_list=(), max_grad=None, update_lr=True):
+        """
+          Train function of every epoch during train phase.
+        """
+        net.train()
+        start_time = data_start_time = time.time()
+        runner.runner_state['epoch'] += 1
+
+        for data_dict in DataPrefetcher(runner.train_loader, self.device):
+            if update_lr:
+                Trainer.update(runner, backbone_list=backbone_list)
+
+            self.data_time.update(time.time() - data_start_time)
+            # Forward pass & compute the loss of the train batch.
+            with RunnerHelper.autocast(runner):
+                outputs = runner._forward(data_dict)
+                loss_dict = runner._loss(outputs, data_dict)
+
+            if not isinstance(loss_dict, dict):
+                loss_dict = dict(loss=loss_dict)
+
+            self._update_losses(self.train_losses, loss_dict, data_dict['img'].size(0))
+            RunnerHelper.backward(runner, loss_dict['loss'])
+            stepped = RunnerHelper.step(runner, net=net, max_grad=max_grad)
+            data_start_time = time.time()
+            if not stepped:
+                continue
+
+            # Update the vars of the train phase.
+            self.batch_time.update(time.time() - start_time)
+            start_time = time.time()
+            runner.runner_state['iters'] += 1
+
+            # Print the log info & reset the states.
+            if runner.runner_state['iters'] % self.display_iter == 0:
+                self._log_losses(self.train_losses)
+                Log.info('Train Epoch: {0}\tTrain Iteration: {1}\t'
+                         'Time {batch_time.sum:.3f}s / {2}iters, ({batch_time.avg:.3f})\t'
+                         'Data load {data_time.sum:.3f}s / {2}iters, ({data_time.avg:3f})\n'
+                         'Learning rate = {3}\tLoss = {loss.val:.8f} (ave = {loss.avg:.8f})\n'.format(
+                    runner.runner_state['epoch'], runner.runner_state['iters'],
+                    self.display_iter, RunnerHelper.get_lr(runner.optimizer), batch_time=self.batch_time,
+                    data_time=self.data_time, loss=self.train_losses['loss']))
+                self.batch_time.reset()
+                self.data_time.reset()
+                self._reset_losses(self.train_losses)
+
+            if self.lr_metric == 'iters' and runner.runner_state['iters'] == self.max_iters:
+                break
+
+            # Check to val the current model.
+            if runner.runner_state['iters'] % self.test_interval == 0:
+                runner.val()
+
+    def val(self, runner, net, data_loader=None):
+        """
+          Validation function during the train phase.
+        """
+        net.eval()
+        start_time = time.time()
+        data_loader = runner.val_loader if data_loader is None else data_loader
+        with torch.no_grad():
+            for data_dict in DataPrefetcher(data_loader, self.device):
+                # Forward pass & compute the loss of the val batch.
+                outputs = runner._forward(data_dict)
+                loss_dict = runner._loss(outputs, data_dict)
+                if not isinstance(loss_dict, dict):
+                    loss_dict = dict(loss=loss_dict)
+
+                self._update_losses(self.val_losses, loss_dict, data_dict['img'].size(0))
+                runner._postprocess(outputs, data_dict)
+
+                # Update the vars of the val phase.
+                self.batch_time.update(time.time() - start_time)
+                start_time = time.time()
+
+        runner.runner_state['val_loss'] = float(self.val_losses['loss'].avg)
+        RunnerHelper.save_net(runner, net, **runner._evaluate())
+        # Print the log info & reset the states.
+        self._log_losses(self.val_losses)
+        Log.info(
+            'Test Time {batch_time.sum:.3f}s, ({batch_time.avg:.3f})\t'
+            'Loss {loss.avg:.8f}\n'.format(
+                batch_time=self.batch_time, loss=self.val_losses['loss']))
+        self.batch_time.reset()
+        self._reset_losses(self.val_losses)
+        net.train()
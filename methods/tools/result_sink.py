@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# Save the outputs of the test images.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+from utils.helpers.image_helper import ImageHelper
+from utils.helpers.json_helper import JsonHelper
+from utils.tools.logger import Logger as Log
+
+
+SINK_LIST = ['files', 'none', 'stream']
+
+
+class ResultSink(object):
+    """The outputs of the test images, selected by test:sink.
+
+      files: the label, raw, vis and json files of every image.
+      none: no outputs except the vis samples.
+      stream: the json dicts are appended to base_dir/results.jsonl, and the label maps are packed into the
+              tar files of base_dir/label, test:shard_size images each.
+
+    The vis images are only rendered & saved for every test:vis_interval images, 0 for none. It defaults to 1 for
+    the files sink and 0 for the others. Called by the writer threads of TestPipeline.
+    """
+    def __init__(self, configer, base_dir):
+        self.sink = configer.get('test', 'sink') if configer.exists('test', 'sink') else 'files'
+        if self.sink not in SINK_LIST:
+            Log.error('Not support sink type: {}.'.format(self.sink))
+            exit(1)
+
+        if configer.exists('test', 'vis_interval'):
+            self.vis_interval = configer.get('test', 'vis_interval')
+        else:
+            self.vis_interval = 1 if self.sink == 'files' else 0
+
+        self.shard_size = configer.get('test', 'shard_size') if configer.exists('test', 'shard_size') else 1000
+        self.base_dir = base_dir
+        if self.sink != 'none' and not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+
+        self.lock = threading.Lock()
+        self.json_stream = None
+        self.tar_file = None
+        self.num_labels = 0
+
+    def _make_dirs(self, file_path):
+        # The writer threads may create the same dir.
+        with self.lock:
+            dir_name = os.path.dirname(file_path)
+            if not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+
+    def need_vis(self, path_dict):
+        return self.vis_interval > 0 and path_dict['index'] % self.vis_interval == 0
+
+    def save_vis(self, image_canvas, path_dict):
+        if self.need_vis(path_dict):
+            self._make_dirs(path_dict['vis_path'])
+            ImageHelper.save(image_canvas, path_dict['vis_path'])
+
+    def save_raw(self, image, path_dict):
+        if self.sink == 'files':
+            self._make_dirs(path_dict['raw_path'])
+            ImageHelper.save(image, path_dict['raw_path'])
+
+    def save_json(self, json_dict, path_dict):
+        if self.sink == 'files':
+            Log.info('Json Path: {}'.format(path_dict['json_path']))
+            self._make_dirs(path_dict['json_path'])
+            JsonHelper.save_file(json_dict, path_dict['json_path'])
+
+        elif self.sink == 'stream':
+            line = json.dumps(dict(json_dict, image_name=path_dict['name']))
+            with self.lock:
+                if self.json_stream is None:
+                    self.json_stream = open(os.path.join(self.base_dir, 'results.jsonl'), 'w')
+
+                self.json_stream.write('{}\n'.format(line))
+
+    def save_label(self, label_img, path_dict):
+        """Save the label map of an image, a PIL image."""
+        if self.sink == 'files':
+            Log.info('Label Path: {}'.format(path_dict['label_path']))
+            self._make_dirs(path_dict['label_path'])
+            ImageHelper.save(label_img, path_dict['label_path'])
+
+        elif self.sink == 'stream':
+            png_stream = io.BytesIO()
+            label_img.save(png_stream, format='PNG')
+            tar_info = tarfile.TarInfo(name='{}.png'.format(path_dict['name']))
+            tar_info.size = png_stream.tell()
+            tar_info.mtime = time.time()
+            png_stream.seek(0)
+            with self.lock:
+                if self.num_labels % self.shard_size == 0:
+                    self._close_tar()
+                    tar_path = os.path.join(self.base_dir, 'label',
+                                            'labels_{:05d}.tar'.format(self.num_labels // self.shard_size))
+                    if not os.path.exists(os.path.dirname(tar_path)):
+                        os.makedirs(os.path.dirname(tar_path))
+
+                    self.tar_file = tarfile.open(tar_path, 'w')
+
+                self.tar_file.addfile(tar_info, png_stream)
+                self.num_labels += 1
+
+    def _close_tar(self):
+        if self.tar_file is not None:
+            self.tar_file.close()
+            self.tar_file = None
+
+    def close(self):
+        with self.lock:
+            if self.json_stream is not None:
+                self.json_stream.close()
+                self.json_stream = None
+
+            self._close_tar()
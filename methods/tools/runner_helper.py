@@ -10,15 +10,25 @@ from __future__ import print_function
 
 import math
 import os
-from collections import OrderedDict
 import torch
 import torch.nn as nn
 from torch.nn.parallel.scatter_gather import gather as torch_gather
 
 from extensions.parallel.data_parallel import DataParallelModel
+from methods.tools.checkpoint_manager import CheckpointManager
+from models.tools.module_helper import ModuleHelper
 from utils.tools.logger import Logger as Log
 
 
+# torch.cuda.amp.GradScaler is deprecated since torch.amp.GradScaler is added.
+GradScaler = torch.amp.GradScaler if hasattr(torch.amp, 'GradScaler') else torch.cuda.amp.GradScaler
+PRECISION_DICT = {
+    'fp32': None,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
+
+
 class RunnerHelper(object):
 
     @staticmethod
@@ -30,6 +40,74 @@ class RunnerHelper(object):
 
         return return_list[0] if len(params) == 1 else return_list
 
+    @staticmethod
+    def _device_type(runner):
+        return 'cpu' if runner.configer.get('gpu') is None else 'cuda'
+
+    @staticmethod
+    def _precision(runner):
+        if not runner.configer.exists('train', 'precision'):
+            return 'fp32'
+
+        precision = runner.configer.get('train', 'precision')
+        if precision not in PRECISION_DICT:
+            Log.error('Precision {} is not valid.'.format(precision))
+            exit(1)
+
+        return precision
+
+    @staticmethod
+    def autocast(runner):
+        """The autocast context of the forward and the loss, fp16 is replaced by bf16 on cpu."""
+        device_type = RunnerHelper._device_type(runner)
+        dtype = PRECISION_DICT[RunnerHelper._precision(runner)]
+        if dtype is not None and device_type == 'cpu':
+            dtype = torch.bfloat16
+
+        return torch.autocast(device_type, dtype=dtype, enabled=dtype is not None)
+
+    @staticmethod
+    def get_scaler(runner):
+        """The dynamic loss scaler of the runner, only enabled for fp16 on gpus."""
+        if getattr(runner, 'scaler', None) is None:
+            enabled = RunnerHelper._precision(runner) == 'fp16' and RunnerHelper._device_type(runner) == 'cuda'
+            runner.scaler = GradScaler(enabled=enabled)
+
+        return runner.scaler
+
+    @staticmethod
+    def accumulate_steps(runner):
+        if not runner.configer.exists('train', 'accumulate_steps'):
+            return 1
+
+        return max(int(runner.configer.get('train', 'accumulate_steps')), 1)
+
+    @staticmethod
+    def backward(runner, loss):
+        """Backward the loss of a micro-batch, averaged over the micro-batches of an optimizer step."""
+        loss = loss / RunnerHelper.accumulate_steps(runner)
+        RunnerHelper.get_scaler(runner).scale(loss).backward()
+
+    @staticmethod
+    def step(runner, net=None, max_grad=None):
+        """Step the optimizer with the scaled gradients, which are clipped first if max_grad is given.
+
+        The gradients are accumulated over train:accumulate_steps micro-batches, so the optimizer only steps
+        (and zeros the gradients) at the last one of them, which is reported by the return value.
+        """
+        runner.runner_state['micro_iters'] += 1
+        if runner.runner_state['micro_iters'] % RunnerHelper.accumulate_steps(runner) != 0:
+            return False
+
+        scaler = RunnerHelper.get_scaler(runner)
+        if max_grad is not None:
+            RunnerHelper.clip_grad(net, max_grad, runner=runner)
+
+        scaler.step(runner.optimizer)
+        scaler.update()
+        runner.optimizer.zero_grad()
+        return True
+
     @staticmethod
     def _make_parallel(runner, net):
         if len(runner.configer.get('gpu')) == 1 or len(range(torch.cuda.device_count())) == 1:
@@ -44,24 +122,21 @@ class RunnerHelper(object):
 
         net = net.to(torch.device('cpu' if runner.configer.get('gpu') is None else 'cuda'))
         if runner.configer.get('network', 'resume') is not None:
-            resume_dict = torch.load(runner.configer.get('network', 'resume'))
+            resume_dict = ModuleHelper.load_checkpoint(runner.configer.get('network', 'resume'))
             if 'state_dict' in resume_dict:
                 checkpoint_dict = resume_dict['state_dict']
 
             elif 'model' in resume_dict:
                 checkpoint_dict = resume_dict['model']
 
-            elif isinstance(resume_dict, OrderedDict):
+            elif isinstance(resume_dict, dict):
                 checkpoint_dict = resume_dict
 
             else:
                 raise RuntimeError(
                     'No state_dict found in checkpoint file {}'.format(runner.configer.get('network', 'resume')))
 
-            if list(checkpoint_dict.keys())[0].startswith('module.'):
-                checkpoint_dict = {k[7:]: v for k, v in checkpoint_dict.items()}
-
-            # load state_dict
+            # load state_dict, the 'module.' prefix is dropped while copying.
             if hasattr(net, 'module'):
                 RunnerHelper.load_state_dict(net.module, checkpoint_dict,
                                              runner.configer.get('network', 'resume_strict'))
@@ -70,13 +145,19 @@ class RunnerHelper(object):
 
             if runner.configer.get('network', 'resume_continue'):
                 runner.configer.resume(resume_dict['config_dict'])
+                if 'runner_state' in resume_dict and hasattr(runner, 'runner_state'):
+                    runner.runner_state.update(resume_dict['runner_state'])
+
+            if isinstance(resume_dict, dict) and resume_dict.get('scaler') is not None:
+                RunnerHelper.get_scaler(runner).load_state_dict(resume_dict['scaler'])
 
         return net
 
     @staticmethod
     def load_state_dict(module, state_dict, strict=False):
         """Load state_dict to a module.
-        This method is modified from :meth:`torch.nn.Module.load_state_dict`.
+        The tensors are copied into the module one by one by :meth:`ModuleHelper.load_state_dict`, so a
+        memory-mapped state_dict is never materialized as a whole.
         Default value for ``strict`` is set to ``False`` and the message for
         param mismatch will be shown even if strict is False.
         Args:
@@ -86,25 +167,7 @@ class RunnerHelper(object):
                 in :attr:`state_dict` match the keys returned by this module's
                 :meth:`~torch.nn.Module.state_dict` function. Default: ``False``.
         """
-        unexpected_keys = []
-        own_state = module.state_dict()
-        for name, param in state_dict.items():
-            if name not in own_state:
-                unexpected_keys.append(name)
-                continue
-            if isinstance(param, torch.nn.Parameter):
-                # backwards compatibility for serialized parameters
-                param = param.data
-
-            try:
-                own_state[name].copy_(param)
-            except Exception:
-                raise RuntimeError('While copying the parameter named {}, '
-                                   'whose dimensions in the model are {} and '
-                                   'whose dimensions in the checkpoint are {}.'
-                                   .format(name, own_state[name].size(),
-                                           param.size()))
-        missing_keys = set(own_state.keys()) - set(state_dict.keys())
+        missing_keys, unexpected_keys = ModuleHelper.load_state_dict(module, state_dict)
 
         err_msg = []
         if unexpected_keys:
@@ -120,47 +183,58 @@ class RunnerHelper(object):
 
     @staticmethod
     def save_net(runner, net, performance=None, val_loss=None, iters=None, epoch=None):
-        state = {
-            'config_dict': runner.configer.to_dict(),
-            'state_dict': net.state_dict(),
-            'runner_state': runner.runner_state
-        }
-        if runner.configer.get('checkpoints', 'checkpoints_root') is None:
-            checkpoints_dir = os.path.join(runner.configer.get('project_dir'),
-                                           runner.configer.get('checkpoints', 'checkpoints_dir'))
-        else:
-            checkpoints_dir = os.path.join(runner.configer.get('checkpoints', 'checkpoints_root'),
-                                           runner.configer.get('checkpoints', 'checkpoints_dir'))
+        """Save the latest checkpoint, and link it as the best and the periodic ones if they are due.
 
-        if not os.path.exists(checkpoints_dir):
-            os.makedirs(checkpoints_dir)
-
-        latest_name = '{}_latest.pth'.format(runner.configer.get('checkpoints', 'checkpoints_name'))
-        torch.save(state, os.path.join(checkpoints_dir, latest_name))
+        The checkpoint is written in the background by the checkpoint manager of the runner.
+        """
+        checkpoints_name = runner.configer.get('checkpoints', 'checkpoints_name')
+        file_names = ['{}_latest.pth'.format(checkpoints_name)]
         if performance is not None:
             if performance > runner.runner_state['max_performance']:
-                latest_name = '{}_max_performance.pth'.format(runner.configer.get('checkpoints', 'checkpoints_name'))
-                torch.save(state, os.path.join(checkpoints_dir, latest_name))
+                file_names.append('{}_max_performance.pth'.format(checkpoints_name))
                 runner.runner_state['max_performance'] = performance
 
         if val_loss is not None:
             if val_loss < runner.runner_state['min_val_loss']:
-                latest_name = '{}_min_loss.pth'.format(runner.configer.get('checkpoints', 'checkpoints_name'))
-                torch.save(state, os.path.join(checkpoints_dir, latest_name))
+                file_names.append('{}_min_loss.pth'.format(checkpoints_name))
                 runner.runner_state['min_val_loss'] = val_loss
 
         if iters is not None:
             if iters - runner.runner_state['last_iters'] >= runner.configer.get('checkpoints', 'save_iters'):
-                latest_name = '{}_iters{}.pth'.format(runner.configer.get('checkpoints', 'checkpoints_name'), iters)
-                torch.save(state, os.path.join(checkpoints_dir, latest_name))
+                file_names.append('{}_iters{}.pth'.format(checkpoints_name, iters))
                 runner.runner_state['last_iters'] = iters
 
         if epoch is not None:
             if epoch - runner.runner_state['last_epoch'] >= runner.configer.get('checkpoints', 'save_epoch'):
-                latest_name = '{}_epoch{}.pth'.format(runner.configer.get('checkpoints', 'checkpoints_name'), epoch)
-                torch.save(state, os.path.join(checkpoints_dir, latest_name))
+                file_names.append('{}_epoch{}.pth'.format(checkpoints_name, epoch))
                 runner.runner_state['last_epoch'] = epoch
 
+        state = {
+            'config_dict': runner.configer.to_dict(),
+            'state_dict': net.state_dict(),
+            'runner_state': runner.runner_state
+        }
+        if getattr(runner, 'optimizer', None) is not None:
+            state['optimizer'] = runner.optimizer.state_dict()
+
+        if getattr(runner, 'scheduler', None) is not None:
+            state['scheduler'] = runner.scheduler.state_dict()
+
+        if getattr(runner, 'scaler', None) is not None and runner.scaler.is_enabled():
+            state['scaler'] = runner.scaler.state_dict()
+
+        if runner.configer.get('checkpoints', 'checkpoints_root') is None:
+            checkpoints_dir = os.path.join(runner.configer.get('project_dir'),
+                                           runner.configer.get('checkpoints', 'checkpoints_dir'))
+        else:
+            checkpoints_dir = os.path.join(runner.configer.get('checkpoints', 'checkpoints_root'),
+                                           runner.configer.get('checkpoints', 'checkpoints_dir'))
+
+        if getattr(runner, 'checkpoint_manager', None) is None:
+            runner.checkpoint_manager = CheckpointManager(runner.configer)
+
+        runner.checkpoint_manager.save(state, checkpoints_dir, file_names)
+
     @staticmethod
     def freeze_bn(net, syncbn=False):
         for m in net.modules():
@@ -173,8 +247,14 @@ class RunnerHelper(object):
                     m.eval()
 
     @staticmethod
-    def clip_grad(net, max_grad=10.):
-        """Computes a gradient clipping coefficient based on gradient norm."""
+    def clip_grad(net, max_grad=10., runner=None):
+        """Computes a gradient clipping coefficient based on gradient norm.
+
+        The gradients scaled by the loss scaler of the runner are unscaled before clipping.
+        """
+        if runner is not None:
+            RunnerHelper.get_scaler(runner).unscale_(runner.optimizer)
+
         total_norm = 0
         for p in net.parameters():
             if p.requires_grad:
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# The sliding window inference of the large images.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+
+from utils.tools.logger import Logger as Log
+
+
+WEIGHT_LIST = ['uniform', 'linear', 'gaussian']
+
+
+class SlidingWindow(object):
+    """Predict an image by the overlapped crops of test:crop_size, with test:crop_stride_ratio * crop_size strides.
+
+    The crops are forwarded test:crop_batch_size (default 8) at a time, and their logits are blended by the
+    test:crop_weight (uniform, linear or gaussian, default uniform) of the pixels in a crop into a device tensor.
+    """
+    def __init__(self, configer):
+        self.configer = configer
+        self.crop_size = configer.get('test', 'crop_size')
+        self.stride_ratio = configer.get('test', 'crop_stride_ratio')
+        if configer.exists('test', 'crop_batch_size'):
+            self.crop_batch_size = configer.get('test', 'crop_batch_size')
+        else:
+            self.crop_batch_size = 8
+
+        self.weight_type = configer.get('test', 'crop_weight') if configer.exists('test', 'crop_weight') else 'uniform'
+        if self.weight_type not in WEIGHT_LIST:
+            Log.error('Not support crop weight: {}.'.format(self.weight_type))
+            exit(1)
+
+    @staticmethod
+    def get_starts(total_length, crop_length, stride):
+        """The start positions of the crops, the last crop is aligned to the end to cover the total length."""
+        if total_length <= crop_length:
+            return [0]
+
+        starts = list(range(0, total_length - crop_length + 1, max(stride, 1)))
+        if starts[-1] + crop_length < total_length:
+            starts.append(total_length - crop_length)
+
+        return starts
+
+    def _get_weight(self, crop_height, crop_width, device):
+        weight_list = list()
+        for length in (crop_height, crop_width):
+            positions = torch.arange(length, dtype=torch.float32, device=device) + 0.5
+            if self.weight_type == 'linear':
+                # 1 at the center, falls linearly to the borders.
+                weight = 1. - (2. * positions / length - 1.).abs()
+            elif self.weight_type == 'gaussian':
+                sigma = length / 8.
+                weight = torch.exp(-(positions - length / 2.) ** 2 / (2 * sigma * sigma))
+            else:
+                weight = torch.ones((length,), dtype=torch.float32, device=device)
+
+            # The pixels at the image borders are only covered by one crop.
+            weight_list.append(weight.clamp(min=1e-3))
+
+        return weight_list[0][:, None] * weight_list[1][None, :]
+
+    def _get_windows(self, height, width):
+        crop_width, crop_height = self.crop_size
+        # The strides longer than the crops would leave the pixels between the crops uncovered.
+        height_starts = self.get_starts(height, crop_height, min(int(crop_height * self.stride_ratio), crop_height))
+        width_starts = self.get_starts(width, crop_width, min(int(crop_width * self.stride_ratio), crop_width))
+        return height_starts, width_starts, min(crop_height, height), min(crop_width, width)
+
+    def _predict_row(self, predict, image, h, width_starts, weight, device):
+        """Yield the (w, weighted logits sized [1,K,crop_height,crop_width]) of a row of crops."""
+        crop_height, crop_width = weight.size()
+        for i in range(0, len(width_starts), self.crop_batch_size):
+            chunk = width_starts[i:i + self.crop_batch_size]
+            crops = torch.cat([image[:, :, h:h + crop_height, w:w + crop_width] for w in chunk], 0).to(device)
+            logits = predict(crops).float() * weight
+            for j, w in enumerate(chunk):
+                yield w, logits[j:j + 1]
+
+    def __call__(self, predict, image, device=None):
+        """
+        Args:
+          predict: maps the crops sized [N,C,h,w] to the logits sized [N,K,h,w] on the device.
+          image(tensor): the input sized [1,C,H,W].
+        Return:
+          logits(tensor): the blended logits sized [1,K,H,W] on the device.
+
+        """
+        device = image.device if device is None else device
+        height, width = image.size()[2:]
+        height_starts, width_starts, crop_height, crop_width = self._get_windows(height, width)
+        weight = self._get_weight(crop_height, crop_width, device)
+        total_logits, total_weight = None, torch.zeros((height, width), dtype=torch.float32, device=device)
+        for h in height_starts:
+            for w, logits in self._predict_row(predict, image, h, width_starts, weight, device):
+                if total_logits is None:
+                    total_logits = logits.new_zeros((1, logits.size(1), height, width))
+
+                total_logits[:, :, h:h + crop_height, w:w + crop_width] += logits
+                total_weight[h:h + crop_height, w:w + crop_width] += weight
+
+        return total_logits / total_weight
+
+    def stream(self, predict, image, device):
+        """Predict the label map row by row, only the logits of a row of crops are on the device at a time.
+
+        Args:
+          predict: maps the crops sized [N,C,h,w] to the logits sized [N,K,h,w] on the device.
+          image(tensor): the input sized [1,C,H,W], e.g. on the host, the crops are copied to the device.
+        Return:
+          label_map(ndarray): the uint8 label map sized [H,W] on the host.
+
+        """
+        height, width = image.size()[2:]
+        height_starts, width_starts, crop_height, crop_width = self._get_windows(height, width)
+        weight = self._get_weight(crop_height, crop_width, device)
+        label_map = np.zeros((height, width), dtype=np.uint8)
+        # The logits & weights of the rows [top, top + crop_height) not finished yet.
+        band_logits, band_weight, top = None, None, 0
+        for h in height_starts:
+            if band_logits is not None:
+                # The rows above h are not covered by the next crops.
+                finished_logits = band_logits[:, :, :h - top] / band_weight[:h - top]
+                label_map[top:h] = finished_logits.argmax(1)[0].byte().cpu().numpy()
+                new_logits = torch.zeros_like(band_logits)
+                new_logits[:, :, :crop_height - (h - top)] = band_logits[:, :, h - top:]
+                new_weight = torch.zeros_like(band_weight)
+                new_weight[:crop_height - (h - top)] = band_weight[h - top:]
+                band_logits, band_weight = new_logits, new_weight
+
+            top = h
+            for w, logits in self._predict_row(predict, image, h, width_starts, weight, device):
+                if band_logits is None:
+                    band_logits = logits.new_zeros((1, logits.size(1), crop_height, width))
+                    band_weight = torch.zeros((crop_height, width), dtype=torch.float32, device=device)
+
+                band_logits[:, :, :, w:w + crop_width] += logits
+                band_weight[:, w:w + crop_width] += weight
+
+        label_map[top:top + crop_height] = (band_logits / band_weight).argmax(1)[0].byte().cpu().numpy()
+        return label_map
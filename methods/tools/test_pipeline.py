@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# The streaming inference of the test images.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import threading
+import time
+import traceback
+import torch
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from methods.tools.runner_helper import RunnerHelper
+from utils.tools.logger import Logger as Log
+
+
+class TestPipeline(object):
+    """Test the images in three stages connected by bounded queues, the test runner implements the hooks:
+
+      _read(image_path): the data_dict of an image, 'img' is the input tensor sized [1,C,H,W] on cpu, or a list
+                         of them (e.g. one per scale). Run by the reader threads.
+      _infer(batch_dict): the per image results of a batch, batch_dict['img'] is the concatenated inputs on the
+                          device, and the other keys are the lists of the per image values. Run by the main thread.
+      _write(result, data_dict, path_dict, sink): draw & save the outputs of an image with the ResultSink.
+                                                  Run by the writer threads.
+
+    The images are batched with the ones of the same input sizes, up to test:batch_size images. At most queue_size
+    images wait for their batches, the largest group is inferred once it's exceeded. The inputs are copied to the
+    device, unless the host_inputs of the runner is True.
+    """
+    def __init__(self, configer):
+        self.configer = configer
+        self.device = torch.device('cpu' if configer.get('gpu') is None else 'cuda')
+        self.batch_size = configer.get('test', 'batch_size') if configer.exists('test', 'batch_size') else 1
+        self.num_workers = configer.get('test', 'workers') if configer.exists('test', 'workers') else 4
+        self.queue_size = 2 * max(self.batch_size, self.num_workers)
+        self.error = None
+
+    def _run_worker(self, in_queue, out_queue, fn):
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+
+            try:
+                result = fn(*item)
+            except Exception:
+                # Stop the pipeline, the error is reported by the main thread.
+                self.error = traceback.format_exc()
+                result = None
+
+            if out_queue is not None and result is not None:
+                out_queue.put((result, item))
+
+        if out_queue is not None:
+            out_queue.put(None)
+
+    def _start_workers(self, in_queue, out_queue, fn):
+        thread_list = list()
+        for _ in range(self.num_workers):
+            thread = threading.Thread(target=self._run_worker, args=(in_queue, out_queue, fn))
+            thread.daemon = True
+            thread.start()
+            thread_list.append(thread)
+
+        return thread_list
+
+    def _check_error(self):
+        if self.error is not None:
+            Log.error('Testing failed:\n{}'.format(self.error))
+            exit(1)
+
+    def _feed(self, job_queue, job_list):
+        for image_path, path_dict in job_list:
+            job_queue.put((image_path, path_dict))
+
+        for _ in range(self.num_workers):
+            job_queue.put(None)
+
+    def _collate(self, batch_list, device):
+        data_list = [data_dict for data_dict, _ in batch_list]
+        img_list = [data_dict.pop('img') for data_dict in data_list]
+        if isinstance(img_list[0], torch.Tensor):
+            inputs = self._to_device(torch.cat(img_list, 0), device)
+        else:
+            inputs = [self._to_device(torch.cat(blobs, 0), device) for blobs in zip(*img_list)]
+
+        batch_dict = {key: [data_dict[key] for data_dict in data_list] for key in data_list[0].keys()}
+        batch_dict['img'] = inputs
+        return batch_dict
+
+    @staticmethod
+    def _to_device(tensor, device):
+        if device.type == 'cuda':
+            return tensor.pin_memory().to(device, non_blocking=True)
+
+        return tensor.to(device)
+
+    def _infer(self, runner, batch_list, write_queue):
+        device = torch.device('cpu') if getattr(runner, 'host_inputs', False) else self.device
+        batch_dict = self._collate(batch_list, device)
+        with torch.no_grad(), RunnerHelper.autocast(runner):
+            result_list = runner._infer(batch_dict)
+
+        for result, (data_dict, path_dict) in zip(result_list, batch_list):
+            write_queue.put((result, data_dict, path_dict))
+
+    def run(self, runner, job_list, sink):
+        """Test the list of (image_path, path_dict), path_dict holds the index, name & output paths of the image."""
+        start_time = time.time()
+        job_queue = Queue(maxsize=self.queue_size)
+        read_queue = Queue(maxsize=self.queue_size)
+        write_queue = Queue(maxsize=self.queue_size)
+        feeder = threading.Thread(target=self._feed, args=(job_queue, job_list))
+        feeder.daemon = True
+        feeder.start()
+        self._start_workers(job_queue, read_queue, lambda image_path, path_dict: runner._read(image_path))
+        writer_list = self._start_workers(write_queue, None, lambda result, data_dict, path_dict: runner._write(
+            result, data_dict, path_dict, sink))
+
+        # The pending images of every input size.
+        pending_dict = collections.OrderedDict()
+        num_pending = 0
+        num_finished = 0
+        while num_finished < self.num_workers:
+            item = read_queue.get()
+            self._check_error()
+            if item is None:
+                num_finished += 1
+                continue
+
+            data_dict, (_, path_dict) = item
+            img = data_dict['img']
+            key = tuple(tuple(blob.size()) for blob in (img if isinstance(img, (list, tuple)) else [img]))
+            pending_dict.setdefault(key, list()).append((data_dict, path_dict))
+            num_pending += 1
+            if len(pending_dict[key]) == self.batch_size:
+                num_pending -= len(pending_dict[key])
+                self._infer(runner, pending_dict.pop(key), write_queue)
+
+            elif num_pending >= self.queue_size:
+                # The oldest one of the largest groups.
+                key = max(pending_dict.keys(), key=lambda size_key: len(pending_dict[size_key]))
+                num_pending -= len(pending_dict[key])
+                self._infer(runner, pending_dict.pop(key), write_queue)
+
+        for batch_list in pending_dict.values():
+            self._infer(runner, batch_list, write_queue)
+
+        for _ in writer_list:
+            write_queue.put(None)
+
+        for writer in writer_list:
+            writer.join()
+
+        sink.close()
+        self._check_error()
+        test_time = time.time() - start_time
+        Log.info('Test {} images in {:.3f}s, {:.2f} images/sec.'.format(
+            len(job_list), test_time, len(job_list) / max(test_time, 1e-6)))
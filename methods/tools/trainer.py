@@ -10,6 +10,7 @@ from __future__ import print_function
 
 from torch.optim import SGD, Adam, lr_scheduler
 
+from models.tools.module_helper import ModuleHelper
 from utils.tools.logger import Logger as Log
 
 
@@ -82,6 +83,15 @@ class Trainer(object):
             Log.error('Policy:{} is not valid.'.format(policy))
             exit(1)
 
+        if runner.configer.get('network', 'resume') is not None and runner.configer.get('network', 'resume_continue'):
+            # Continue with the optimizer & scheduler states of the checkpoint.
+            resume_dict = ModuleHelper.load_checkpoint(runner.configer.get('network', 'resume'))
+            if 'optimizer' in resume_dict:
+                optimizer.load_state_dict(resume_dict['optimizer'])
+
+            if 'scheduler' in resume_dict:
+                scheduler.load_state_dict(resume_dict['scheduler'])
+
         return optimizer, scheduler
 
     @staticmethod
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# The multi-scale & flip test time augmentation of the segmentation.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn.functional as F
+
+
+class TTAEngine(object):
+    """Merge the logits of the scaled & flipped inputs on the device, only the label maps are copied to the host.
+
+    The flipped inputs are forwarded in the same batch as the unflipped ones if test:flip is set, it defaults to
+    True for the ms_test mode. The logits are accumulated at test:logits_scale (default 1.0) of the original image
+    size, and upsampled to it once before the argmax.
+    """
+    def __init__(self, configer):
+        self.configer = configer
+        if configer.exists('test', 'flip'):
+            self.flip = configer.get('test', 'flip')
+        else:
+            self.flip = configer.get('test', 'mode') == 'ms_test'
+
+        self.logits_scale = configer.get('test', 'logits_scale') if configer.exists('test', 'logits_scale') else 1.0
+
+    def _predict(self, predict, inputs):
+        if not self.flip:
+            return predict(inputs)
+
+        logits = predict(torch.cat((inputs, inputs.flip(3)), 0))
+        return logits[:inputs.size(0)] + logits[inputs.size(0):].flip(3)
+
+    def __call__(self, predict, inputs_list, borders_list, ori_size_list):
+        """
+        Args:
+          predict: maps the inputs sized [N,C,H,W] to the logits sized [N,K,H,W] on the device.
+          inputs_list: the inputs of every scale, sized [B,C,H,W] on the device.
+          borders_list: the [h, w] of the unpadded images in the inputs of every scale, None to keep the padding.
+          ori_size_list: the [width, height] of the original images.
+        Return:
+          label_maps(list): the uint8 label map of every image, sized [height, width].
+
+        """
+        total_logits = [None] * len(ori_size_list)
+        for inputs, borders in zip(inputs_list, borders_list):
+            logits = self._predict(predict, inputs).float()
+            for i, (width, height) in enumerate(ori_size_list):
+                image_logits = logits[i:i + 1]
+                if borders[i] is not None:
+                    image_logits = image_logits[:, :, :borders[i][0], :borders[i][1]]
+
+                out_size = (max(int(round(height * self.logits_scale)), 1),
+                            max(int(round(width * self.logits_scale)), 1))
+                image_logits = F.interpolate(image_logits, size=out_size, mode='bilinear', align_corners=False)
+                total_logits[i] = image_logits if total_logits[i] is None else total_logits[i] + image_logits
+
+        label_maps = list()
+        for logits, (width, height) in zip(total_logits, ori_size_list):
+            if logits.size()[2:] != (height, width):
+                logits = F.interpolate(logits, size=(height, width), mode='bilinear', align_corners=False)
+
+            label_maps.append(logits.argmax(1)[0].byte().cpu().numpy())
+
+        return label_maps
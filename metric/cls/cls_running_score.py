@@ -8,44 +8,70 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from utils.tools.average_meter import AverageMeter
+import torch
+import torch.distributed as dist
+
+from utils.helpers.dist_helper import DistHelper
 
 
 class ClsRunningScore(object):
+    """The top-k counters stay on the device of the outputs, they are only copied to the host by get_*."""
+    topk = (1, 3, 5)
+
     def __init__(self, configer):
         self.configer = configer
-        self.top1_acc = AverageMeter()
-        self.top3_acc = AverageMeter()
-        self.top5_acc = AverageMeter()
+        self.reset()
 
     def get_top1_acc(self):
-        return self.top1_acc.avg
+        return self.__get_acc(0)
 
     def get_top3_acc(self):
-        return self.top3_acc.avg
+        return self.__get_acc(1)
 
     def get_top5_acc(self):
-        return self.top5_acc.avg
+        return self.__get_acc(2)
+
+    def __get_acc(self, index):
+        if self.host_state is None:
+            self.host_state = [0.] * (len(self.topk) + 1) if self.state is None else self.state.cpu().tolist()
+
+        return self.host_state[index] / max(self.host_state[-1], 1)
 
     def update(self, output, target):
         """Computes the precision@k for the specified values of k"""
-        topk = (1, 3, 5)
-        maxk = max(topk)
-        batch_size = target.size(0)
-
+        maxk = min(max(self.topk), output.size(1))
         _, pred = output.topk(maxk, 1, True, True)
         pred = pred.t()
-        correct = pred.eq(target.view(1, -1).expand_as(pred))
-        res = []
-        for k in topk:
-            correct_k = correct[:k].view(-1).float().sum(0, keepdim=False)
-            res.append(correct_k / batch_size)
+        correct = pred.eq(target.view(1, -1).expand_as(pred)).double()
+        # the correct counts of every k and the number of samples.
+        batch_state = torch.stack([correct[:k].sum() for k in self.topk] + [correct.new_tensor(target.size(0))])
+        self.state = batch_state if self.state is None else self.state + batch_state.to(self.state.device)
+        self.host_state = None
+
+    def merge(self, other):
+        """Sum the partial state of another running score, e.g. of another replica."""
+        if other.state is not None:
+            self.state = other.state.clone() if self.state is None else self.state + other.state.to(self.state.device)
+            self.host_state = None
+
+    def all_reduce(self):
+        """Sum the partial states of all the distributed workers.
+
+        Every worker joins the collective, the ones without any batch reduce a zero state.
+        """
+        if not DistHelper.is_distributed():
+            return
+
+        device = DistHelper.get_device()
+        if self.state is None:
+            state = torch.zeros((len(self.topk) + 1,), dtype=torch.float64, device=device)
+        else:
+            state = self.state.to(device)
 
-        self.top1_acc.update(res[0].item(), batch_size)
-        self.top3_acc.update(res[1].item(), batch_size)
-        self.top5_acc.update(res[2].item(), batch_size)
+        dist.all_reduce(state)
+        self.state = state if self.state is None else state.to(self.state.device)
+        self.host_state = None
 
     def reset(self):
-        self.top1_acc.reset()
-        self.top3_acc.reset()
-        self.top5_acc.reset()
\ No newline at end of file
+        self.state = None
+        self.host_state = None
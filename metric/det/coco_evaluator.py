@@ -14,6 +14,7 @@ import json
 
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
+from utils.helpers.json_helper import JsonHelper
 from utils.tools.configer import Configer
 from utils.tools.logger import Logger as Log
 
@@ -23,33 +24,30 @@ class CocoEvaluator(object):
         self.configer = configer
 
     def relabel(self, json_dir, method='ssd'):
-        submission_file = os.path.join(json_dir, 'person_instances_val2017_{}_results.json'.format(method))
+        # json_dir is the dir of the json files, or the results.jsonl file of the stream sink.
+        result_dir = os.path.dirname(json_dir) if os.path.isfile(json_dir) else json_dir
+        submission_file = os.path.join(result_dir, 'person_instances_val2017_{}_results.json'.format(method))
         img_id_list = list()
         object_list = list()
 
-        for json_file in os.listdir(json_dir):
-            json_path = os.path.join(json_dir, json_file)
-            shotname, extensions = os.path.splitext(json_file)
-            shotname = shotname.rstrip().split('_')[-1]
+        for shotname, info_tree in JsonHelper.load_results(json_dir):
             try:
-                img_id = int(shotname)
+                img_id = int(shotname.rstrip().split('_')[-1])
             except ValueError:
-                Log.info('Invalid Json file: {}'.format(json_file))
+                Log.info('Invalid Json result: {}'.format(shotname))
                 continue
 
             img_id_list.append(img_id)
-            with open(json_path, 'r') as json_stream:
-                info_tree = json.load(json_stream)
-                for object in info_tree['objects']:
-                    object_dict = dict()
-                    object_dict['image_id'] = img_id
-                    object_dict['category_id'] = int(self.configer.get('details', 'coco_cat_seq')[object['label']])
-                    object_dict['score'] = object['score']
-                    object_dict['bbox'] = [object['bbox'][0], object['bbox'][1],
-                                           object['bbox'][2] - object['bbox'][0],
-                                           object['bbox'][3] - object['bbox'][1]]
-
-                    object_list.append(object_dict)
+            for object in info_tree['objects']:
+                object_dict = dict()
+                object_dict['image_id'] = img_id
+                object_dict['category_id'] = int(self.configer.get('details', 'coco_cat_seq')[object['label']])
+                object_dict['score'] = object['score']
+                object_dict['bbox'] = [object['bbox'][0], object['bbox'][1],
+                                       object['bbox'][2] - object['bbox'][0],
+                                       object['bbox'][3] - object['bbox'][1]]
+
+                object_list.append(object_dict)
 
         with open(submission_file, 'w') as write_stream:
             write_stream.write(json.dumps(object_list))
@@ -79,7 +77,7 @@ if __name__ == "__main__":
     parser.add_argument('--gt_file', default=None, type=str,
                         dest='gt_file', help='The groundtruth annotations file of coco instances.')
     parser.add_argument('--json_dir', default=None, type=str,
-                        dest='json_dir', help='The json dir of predict annotations.')
+                        dest='json_dir', help='The json dir or the results.jsonl file of predict annotations.')
     args = parser.parse_args()
 
     coco_evaluator = CocoEvaluator(Configer(hypes_file=args.hypes_file))
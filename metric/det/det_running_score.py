@@ -9,23 +9,29 @@ from __future__ import division
 from __future__ import print_function
 
 
-import time
 import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils.helpers.dist_helper import DistHelper
+
+
+# The columns of the buffers: image index, label, score (difficult for the gt), x1, y1, x2, y2.
+IMAGE, LABEL, SCORE, BBOX = 0, 1, 2, slice(3, 7)
+DIFFICULT = SCORE
 
 
 class DetRunningScore(object):
+    """The predictions are accumulated in padded buffers on their device, which are only copied to the host
+    (with the gt buffer) by get_*."""
     def __init__(self, configer):
         self.configer = configer
-        self.gt_list = list()
-        self.pred_list = list()
-        self.num_positive = list()
-
-        for i in range(self.configer.get('data', 'num_classes')):
-            self.gt_list.append(dict())
-            self.pred_list.append(list())
-            self.num_positive.append(1e-9)
+        self.iou_thresholds = self.configer.get('val', 'iou_thresholds') \
+            if self.configer.exists('val', 'iou_thresholds') else [0.5]
+        self.reset()
 
-    def _voc_ap(self, rec, prec, use_07_metric=True):
+    @staticmethod
+    def _voc_ap(rec, prec, use_07_metric=True):
         """ ap = voc_ap(rec, prec, [use_07_metric])
             Compute VOC AP given precision and recall.
             If use_07_metric is true, uses the
@@ -58,107 +64,236 @@ class DetRunningScore(object):
             ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
         return ap
 
-    def _voc_eval(self, iou_threshold=0.5, use_07_metric=False):
+    @staticmethod
+    def match(pred_array, gt_array, iou_thresholds):
+        """Mark the predictions as tp / fp at every iou threshold, with the greedy matching of the VOC devkit.
+
+        Every prediction is matched to the gt of the same image and label with the max iou, in the descending
+        score order of its label. A prediction matching a difficult gt is neither tp nor fp.
+
+        Args:
+          pred_array(ndarray): sized [N, 7], see the columns of the buffers.
+          gt_array(ndarray): sized [M, 7].
+          iou_thresholds(list): T thresholds.
+        Return:
+          tp(ndarray): bool, sized [T, N].
+          fp(ndarray): bool, sized [T, N].
+
+        """
+        num_thresholds = len(iou_thresholds)
+        tp = np.zeros((num_thresholds, len(pred_array)), dtype=np.bool_)
+        fp = np.ones((num_thresholds, len(pred_array)), dtype=np.bool_)
+        if len(pred_array) == 0 or len(gt_array) == 0:
+            return tp, fp
 
-        ap_list = list()
-        rc_list = list()
-        pr_list = list()
-        for i in range(self.configer.get('data', 'num_classes')):
+        # The rank of every prediction in the descending score order of its label.
+        rank = np.zeros((len(pred_array),), dtype=np.int64)
+        for label in np.unique(pred_array[:, LABEL]):
+            label_index = np.where(pred_array[:, LABEL] == label)[0]
+            rank[label_index[np.argsort(-pred_array[label_index, SCORE])]] = np.arange(len(label_index))
 
-            class_recs = self.gt_list[i]
-            pred_recs = self.pred_list[i]
-            for key in class_recs.keys():
-                class_recs[key]['det'] = [False] * class_recs[key]['bbox'].shape[0]
+        pred_order = np.argsort(pred_array[:, IMAGE], kind='mergesort')
+        gt_order = np.argsort(gt_array[:, IMAGE], kind='mergesort')
+        pred_images = pred_array[pred_order, IMAGE]
+        gt_images = gt_array[gt_order, IMAGE]
+        images, pred_starts = np.unique(pred_images, return_index=True)
+        pred_ends = np.append(pred_starts[1:], len(pred_images))
+        gt_starts = np.searchsorted(gt_images, images, side='left')
+        gt_ends = np.searchsorted(gt_images, images, side='right')
+        for i in range(len(images)):
+            if gt_starts[i] == gt_ends[i]:
+                continue
 
-            image_ids = np.array([pred_rec[0] for pred_rec in pred_recs])
-            confidence = np.array([pred_rec[1] for pred_rec in pred_recs])
-            BB = np.array([pred_rec[2] for pred_rec in pred_recs])
+            pred_index = pred_order[pred_starts[i]:pred_ends[i]]
+            pred_index = pred_index[np.argsort(rank[pred_index], kind='mergesort')]
+            gts = gt_array[gt_order[gt_starts[i]:gt_ends[i]]]
+            preds = pred_array[pred_index]
+            lt = np.maximum(preds[:, None, 3:5], gts[None, :, 3:5])
+            rb = np.minimum(preds[:, None, 5:7], gts[None, :, 5:7])
+            inters = np.maximum(rb - lt, 0.).prod(2)
+            pred_areas = (preds[:, 5] - preds[:, 3]) * (preds[:, 6] - preds[:, 4])
+            gt_areas = (gts[:, 5] - gts[:, 3]) * (gts[:, 6] - gts[:, 4])
+            ious = inters / (pred_areas[:, None] + gt_areas[None, :] - inters)
+            ious[preds[:, None, LABEL] != gts[None, :, LABEL]] = -np.inf
+            max_gt = np.argmax(ious, 1)
+            max_iou = ious[np.arange(len(preds)), max_gt]
+            difficult = gts[max_gt, DIFFICULT] > 0
+            for t, iou_threshold in enumerate(iou_thresholds):
+                hit = np.where(max_iou > iou_threshold)[0]
+                # Only the first (highest score) prediction hitting a gt is tp, the others are fp.
+                first_hit = np.zeros((len(hit),), dtype=np.bool_)
+                first_hit[np.unique(max_gt[hit], return_index=True)[1]] = True
+                easy = ~difficult[hit]
+                fp[t, pred_index[hit]] = False
+                tp[t, pred_index[hit[easy & first_hit]]] = True
+                fp[t, pred_index[hit[easy & ~first_hit]]] = True
 
+        return tp, fp
+
+    @staticmethod
+    def voc_eval(pred_array, gt_array, num_classes, iou_thresholds=(0.5,), use_07_metric=False, num_positive=None):
+        """Per class recall, precision and AP at every iou threshold, all of them are [T][num_classes] lists."""
+        tp, fp = DetRunningScore.match(pred_array, gt_array, iou_thresholds)
+        if num_positive is None:
+            num_positive = DetRunningScore.count_positive(gt_array, num_classes)
+
+        rc_list = [list() for _ in iou_thresholds]
+        pr_list = [list() for _ in iou_thresholds]
+        ap_list = [list() for _ in iou_thresholds]
+        for i in range(num_classes):
+            label_index = np.where(pred_array[:, LABEL] == i)[0]
             # sort by confidence
-            sorted_ind = np.argsort(-confidence)
-            BB = BB[sorted_ind]
-            image_ids = [image_ids[x] for x in sorted_ind]
-
-            # go down dets and mark TPs and FPs
-            nd = len(image_ids)
-            tp = np.zeros(nd)
-            fp = np.zeros(nd)
-            for d in range(nd):
-                R = class_recs[image_ids[d]]
-                bb = BB[d].astype(float)
-                ovmax = -np.inf
-                BBGT = R['bbox'].astype(float)
-                if BBGT.size > 0:
-                    # compute overlaps
-                    # intersection
-                    ixmin = np.maximum(BBGT[:, 0], bb[0])
-                    iymin = np.maximum(BBGT[:, 1], bb[1])
-                    ixmax = np.minimum(BBGT[:, 2], bb[2])
-                    iymax = np.minimum(BBGT[:, 3], bb[3])
-                    iw = np.maximum(ixmax - ixmin, 0.)
-                    ih = np.maximum(iymax - iymin, 0.)
-                    inters = iw * ih
-                    uni = ((bb[2] - bb[0]) * (bb[3] - bb[1]) +
-                           (BBGT[:, 2] - BBGT[:, 0]) *
-                           (BBGT[:, 3] - BBGT[:, 1]) - inters)
-                    overlaps = inters / uni
-                    ovmax = np.max(overlaps)
-                    jmax = np.argmax(overlaps)
-
-                if ovmax > iou_threshold:
-                    if not R['det'][jmax]:
-                        tp[d] = 1.
-                        R['det'][jmax] = 1
-                    else:
-                        fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # compute precision recall
-            fp = np.cumsum(fp)
-            tp = np.cumsum(tp)
-            rec = tp / float(self.num_positive[i])
-            # avoid divide by zero in case the first detection matches a difficult
-            # ground truth
-            prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-            ap = self._voc_ap(rec, prec, use_07_metric=use_07_metric)
-            rc_list.append(rec)
-            ap_list.append(ap)
-            pr_list.append(prec)
+            label_index = label_index[np.argsort(-pred_array[label_index, SCORE])]
+            for t in range(len(iou_thresholds)):
+                # compute precision recall
+                cls_tp = np.cumsum(tp[t, label_index]).astype(np.float64)
+                cls_fp = np.cumsum(fp[t, label_index]).astype(np.float64)
+                rec = cls_tp / float(num_positive[i])
+                # avoid divide by zero in case the first detection matches a difficult
+                # ground truth
+                prec = cls_tp / np.maximum(cls_tp + cls_fp, np.finfo(np.float64).eps)
+                rc_list[t].append(rec)
+                pr_list[t].append(prec)
+                ap_list[t].append(DetRunningScore._voc_ap(rec, prec, use_07_metric=use_07_metric))
 
         return rc_list, pr_list, ap_list
 
+    @staticmethod
+    def count_positive(gt_array, num_classes):
+        valid = gt_array[:, DIFFICULT] == 0
+        return np.bincount(gt_array[valid, LABEL].astype(np.int64), minlength=num_classes)[:num_classes] + 1e-9
+
     def update(self, batch_pred_bboxes, batch_gt_bboxes, batch_gt_labels):
-        image_name_prefix = str(time.time())
+        """Every image of batch_pred_bboxes is a tensor (or list) of [x1, y1, x2, y2, label, score] rows, or None."""
+        num_classes = self.configer.get('data', 'num_classes')
+        gt_list = list()
+        pred_list = list()
         for i in range(len(batch_gt_bboxes)):
-            image_name = '{}_{}'.format(image_name_prefix, i)
-            for cls in range(self.configer.get('data', 'num_classes')):
-                self.gt_list[cls][image_name] = {
-                    'bbox': np.array([batch_gt_bboxes[i][j].cpu().numpy()
-                                      for j in range(batch_gt_bboxes[i].size(0))
-                                      if batch_gt_labels[i][j] == cls])
-                }
+            gt_bboxes = torch.as_tensor(batch_gt_bboxes[i]).double().view(-1, 4)
+            gt_labels = torch.as_tensor(batch_gt_labels[i]).to(gt_bboxes.device).double().view(-1)
+            gt_array = torch.cat((torch.full_like(gt_labels, self.num_images + i).unsqueeze(1),
+                                  gt_labels.unsqueeze(1), torch.zeros_like(gt_labels).unsqueeze(1), gt_bboxes), 1)
+            gt_list.append(gt_array[(gt_labels >= 0) & (gt_labels < num_classes)])
 
-                self.num_positive[cls] += (self.gt_list[cls][image_name]['bbox']).shape[0]
+            pred_bboxes = batch_pred_bboxes[i]
+            if pred_bboxes is None or not isinstance(pred_bboxes, torch.Tensor):
+                pred_bboxes = torch.from_numpy(np.array([] if pred_bboxes is None else pred_bboxes, dtype=np.float64))
 
-            for pred_box in batch_pred_bboxes[i]:
-                self.pred_list[pred_box[4]].append([image_name, pred_box[5], pred_box[:4]])
+            pred_bboxes = pred_bboxes.detach().double().view(-1, 6)
+            pred_list.append(torch.cat((torch.full_like(pred_bboxes[:, 4:5], self.num_images + i),
+                                        pred_bboxes[:, 4:6], pred_bboxes[:, :4]), 1))
 
-    def get_mAP(self):
-        # compute mAP by APs under different oks thresholds
+        self.num_images += len(batch_gt_bboxes)
+        self.gt_buffer, self.num_gts = self.__append(self.gt_buffer, self.num_gts, torch.cat(gt_list, 0))
+        self.pred_buffer, self.num_preds = self.__append(self.pred_buffer, self.num_preds,
+                                                         self.__cat_device(pred_list))
+        self.host_buffers = None
+
+    @staticmethod
+    def __cat_device(tensor_list):
+        # the empty predictions of the list format are on the cpu, the others are on the device of the outputs.
+        device = next((tensor.device for tensor in tensor_list if tensor.is_cuda), tensor_list[0].device)
+        return torch.cat([tensor.to(device) for tensor in tensor_list], 0)
+
+    @staticmethod
+    def __append(buffer, count, rows):
+        # the buffer follows the device of the first non-empty rows.
+        if buffer is None or (count == 0 and buffer.device != rows.device):
+            buffer = rows.new_zeros((0, 7))
+
+        rows = rows.to(buffer.device)
+        if count + len(rows) > len(buffer):
+            new_buffer = rows.new_zeros((max(2 * len(buffer), count + len(rows), 1024), buffer.size(1)))
+            new_buffer[:count] = buffer[:count]
+            buffer = new_buffer
+
+        buffer[count:count + len(rows)] = rows
+        return buffer, count + len(rows)
+
+    def merge(self, other):
+        """Append the predictions and gt of another running score, its images are numbered after these ones."""
+        for name in ('pred', 'gt'):
+            rows = getattr(other, name + '_buffer')
+            if rows is None:
+                continue
+
+            rows = rows[:getattr(other, 'num_{}s'.format(name))].clone()
+            rows[:, IMAGE] += self.num_images
+            buffer, count = self.__append(getattr(self, name + '_buffer'),
+                                          getattr(self, 'num_{}s'.format(name)), rows)
+            setattr(self, name + '_buffer', buffer)
+            setattr(self, 'num_{}s'.format(name), count)
+
+        self.num_images += other.num_images
+        self.host_buffers = None
+
+    def all_reduce(self):
+        """Gather the predictions and gt of all the distributed workers, every worker numbers the images
+        of the lower ranks first. The buffers are padded to the max size of the workers."""
+        if not DistHelper.is_distributed():
+            return
+
+        world_size, rank = dist.get_world_size(), dist.get_rank()
+        # The same device on every worker, even on the ones without any prediction.
+        device = DistHelper.get_device()
+        counts = torch.zeros((world_size, 3), dtype=torch.float64, device=device)
+        counts[rank] = counts.new_tensor([self.num_images, self.num_preds, self.num_gts])
+        dist.all_reduce(counts)
+        counts = counts.long().cpu()
+        image_offsets = counts[:, 0].cumsum(0) - counts[:, 0]
+        for name, column in (('pred', 1), ('gt', 2)):
+            buffer = getattr(self, name + '_buffer')
+            padded = torch.zeros((max(int(counts[:, column].max()), 1), 7), dtype=torch.float64, device=device)
+            if buffer is not None:
+                count = getattr(self, 'num_{}s'.format(name))
+                padded[:count] = buffer[:count].to(device)
+
+            gathered = [torch.zeros_like(padded) for _ in range(world_size)]
+            dist.all_gather(gathered, padded)
+            rows = list()
+            for i in range(world_size):
+                worker_rows = gathered[i][:int(counts[i, column])]
+                worker_rows[:, IMAGE] += float(image_offsets[i])
+                rows.append(worker_rows)
+
+            rows = torch.cat(rows, 0)
+            setattr(self, name + '_buffer', rows if buffer is None else rows.to(buffer.device))
+            setattr(self, 'num_{}s'.format(name), len(rows))
+
+        self.num_images = int(counts[:, 0].sum())
+        self.host_buffers = None
+
+    def __get_host_buffers(self):
+        if self.host_buffers is None:
+            self.host_buffers = tuple(np.zeros((0, 7)) if buffer is None else buffer[:count].cpu().numpy()
+                                      for buffer, count in ((self.pred_buffer, self.num_preds),
+                                                            (self.gt_buffer, self.num_gts)))
+
+        return self.host_buffers
+
+    def get_APs(self):
+        """Per class APs at every iou threshold of val:iou_thresholds, sized [T, num_classes]."""
         use_07_metric = self.configer.get('val', 'use_07_metric')
-        rc_list, pr_list, ap_list = self._voc_eval(use_07_metric=use_07_metric)
-        if self.num_positive[self.configer.get('data', 'num_classes') - 1] < 1:
-            return sum(ap_list) / (self.configer.get('data', 'num_classes') - 1)
+        pred_array, gt_array = self.__get_host_buffers()
+        _, _, ap_list = self.voc_eval(pred_array, gt_array,
+                                      self.configer.get('data', 'num_classes'),
+                                      iou_thresholds=self.iou_thresholds, use_07_metric=use_07_metric)
+        return np.array(ap_list)
+
+    def get_mAP(self):
+        # compute mAP at the first iou threshold, 0.5 by default.
+        num_classes = self.configer.get('data', 'num_classes')
+        ap_list = self.get_APs()[0]
+        num_positive = self.count_positive(self.__get_host_buffers()[1], num_classes)
+        if num_positive[num_classes - 1] < 1:
+            return sum(ap_list) / (num_classes - 1)
         else:
-            return sum(ap_list) / self.configer.get('data', 'num_classes')
+            return sum(ap_list) / num_classes
 
     def reset(self):
-        self.gt_list = list()
-        self.pred_list = list()
-        self.num_positive = list()
-
-        for i in range(self.configer.get('data', 'num_classes')):
-            self.gt_list.append(dict())
-            self.pred_list.append(list())
-            self.num_positive.append(1e-9)
+        self.pred_buffer = None
+        self.gt_buffer = None
+        self.host_buffers = None
+        self.num_preds = 0
+        self.num_gts = 0
+        self.num_images = 0
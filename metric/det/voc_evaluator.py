@@ -11,15 +11,17 @@ from __future__ import print_function
 import os
 import sys
 import argparse
-import json
+import hashlib
+import tempfile
 import numpy as np
-import pickle
 
 if sys.version_info[0] == 2:
     import xml.etree.cElementTree as ET
 else:
     import xml.etree.ElementTree as ET
 
+from metric.det.det_running_score import DetRunningScore
+from utils.helpers.json_helper import JsonHelper
 from utils.tools.configer import Configer
 from utils.tools.logger import Logger as Log
 
@@ -30,29 +32,23 @@ class VOCEvaluator(object):
         self.configer = configer
 
     def relabel(self, json_dir):
-        submission_dir = os.path.join(json_dir, self.configer.get('method'))
+        # json_dir is the dir of the json files, or the results.jsonl file of the stream sink.
+        assert os.path.exists(json_dir)
+        result_dir = os.path.dirname(json_dir) if os.path.isfile(json_dir) else json_dir
+        submission_dir = os.path.join(result_dir, self.configer.get('method'))
         if not os.path.exists(submission_dir):
-            assert os.path.exists(json_dir)
             os.makedirs(submission_dir)
 
         img_shotname_list = list()
         object_list = list()
 
-        for json_file in os.listdir(json_dir):
-            if 'json' not in json_file:
-                continue
-
-            json_path = os.path.join(json_dir, json_file)
-            shotname, extensions = os.path.splitext(json_file)
+        for shotname, info_tree in JsonHelper.load_results(json_dir):
             img_shotname_list.append(shotname)
-
-            with open(json_path, 'r') as json_stream:
-                info_tree = json.load(json_stream)
-                for object in info_tree['objects']:
-                    # 0-indexing
-                    object_list.append([shotname, object['label'], object['score'],
-                                        int(object['bbox'][0]) + 1, int(object['bbox'][1]) + 1,
-                                        int(object['bbox'][2]) + 1, int(object['bbox'][3]) + 1])
+            for object in info_tree['objects']:
+                # 0-indexing
+                object_list.append([shotname, object['label'], object['score'],
+                                    int(object['bbox'][0]) + 1, int(object['bbox'][1]) + 1,
+                                    int(object['bbox'][2]) + 1, int(object['bbox'][3]) + 1])
 
         file_header_list = list()
         for i in range(len(self.configer.get('details', 'name_seq'))):
@@ -99,202 +95,112 @@ class VOCEvaluator(object):
 
         return objects
 
-    def evaluate(self, pred_dir=None, gt_dir=None, use_07=True):
-        aps = []
+    @staticmethod
+    def load_gt(gt_dir, name_seq, image_set='test'):
+        """Load the gt of an image set as a [M, 7] array, see DetRunningScore, parsed xmls are cached to disk."""
+        cachedir = '/tmp/voc_cache'
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+        image_set_file = os.path.join(gt_dir, 'ImageSets/Main', '{}.txt'.format(image_set))
+        anno_dir = os.path.join(gt_dir, 'Annotations')
+        cache_key = hashlib.md5(os.path.abspath(gt_dir).encode('utf-8')).hexdigest()[:8]
+        cachefile = os.path.join(cachedir, '{}_{}_annots.npz'.format(cache_key, image_set))
+
+        # read list of images
+        with open(image_set_file, 'r') as f:
+            imagenames = [x.strip() for x in f.readlines()]
+
+        # The cache is rebuilt once the image set, the classes or the sizes & mtimes of the xmls change.
+        xml_files = [os.path.join(anno_dir, '{}.xml'.format(imagename)) for imagename in imagenames]
+        stat_list = [os.stat(xml_file) for xml_file in xml_files]
+        manifest = dict(
+            imagenames=np.array(imagenames),
+            name_seq=np.array(name_seq),
+            file_sizes=np.array([stat.st_size for stat in stat_list], dtype=np.int64),
+            file_mtimes=np.array([stat.st_mtime for stat in stat_list], dtype=np.float64),
+        )
+        if os.path.isfile(cachefile):
+            with np.load(cachefile) as npz_file:
+                if all(key in npz_file.files and np.array_equal(npz_file[key], manifest[key]) for key in manifest):
+                    return imagenames, npz_file['gt_array']
+
+        label_dict = {name: i for i, name in enumerate(name_seq)}
+        gt_list = list()
+        for i, xml_file in enumerate(xml_files):
+            for obj in VOCEvaluator.parse_rec(xml_file):
+                if obj['name'] in label_dict:
+                    gt_list.append([i, label_dict[obj['name']], obj['difficult']] + obj['bbox'])
+
+            if i % 1000 == 0:
+                Log.info('Reading annotation for {:d}/{:d}'.format(i + 1, len(imagenames)))
+
+        gt_array = np.array(gt_list, dtype=np.float64).reshape(-1, 7)
+        Log.info('Saving cached annotations to {:s}'.format(cachefile))
+        # Written to a temp file and renamed, so the evaluators sharing the cache never read a partial file.
+        fd, temp_file = tempfile.mkstemp(suffix='.npz', dir=cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as temp_stream:
+                np.savez(temp_stream, gt_array=gt_array, **manifest)
+
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, cachefile)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+        return imagenames, gt_array
+
+    @staticmethod
+    def load_pred(pred_dir, name_seq, imagenames):
+        """Load the VOC results files of all the classes as a [N, 7] array."""
+        image_dict = {name: i for i, name in enumerate(imagenames)}
+        pred_list = list()
+        for i, cls in enumerate(name_seq):
+            with open(VOCEvaluator.get_voc_results_file_template(pred_dir, cls), 'r') as f:
+                for line in f.readlines():
+                    splitline = line.strip().split(' ')
+                    if len(splitline) < 6:
+                        continue
+
+                    pred_list.append([image_dict[splitline[0]], i] + [float(z) for z in splitline[1:6]])
+
+        return np.array(pred_list, dtype=np.float64).reshape(-1, 7)
+
+    def evaluate(self, pred_dir=None, gt_dir=None, use_07=True, iou_thresholds=(0.5,)):
+        name_seq = self.configer.get('details', 'name_seq')
         # The PASCAL VOC metric changed in 2010
         use_07_metric = use_07
         print('VOC07 metric? ' + ('Yes' if use_07_metric else 'No'))
-        for i, cls in enumerate(self.configer.get('details', 'name_seq')):
-            filename = self.get_voc_results_file_template(pred_dir, cls)
-            rec, prec, ap = self.voc_eval(
-                filename, gt_dir, cls,
-                ovthresh=0.5, use_07_metric=use_07_metric)
-            aps += [ap]
-            print('AP for {} = {:.4f}'.format(cls, ap))
-
-        print('Mean AP = {:.4f}'.format(np.mean(aps)))
-        print('~~~~~~~~')
-        print('Results:')
-        for ap in aps:
-            print('{:.3f}'.format(ap))
-        print('{:.3f}'.format(np.mean(aps)))
-        print('~~~~~~~~')
-        print('')
+        imagenames, gt_array = self.load_gt(gt_dir, name_seq)
+        pred_array = self.load_pred(pred_dir, name_seq, imagenames)
+        easy = gt_array[:, 2] == 0
+        num_positive = np.bincount(gt_array[easy, 1].astype(np.int64), minlength=len(name_seq))
+        _, _, ap_list = DetRunningScore.voc_eval(pred_array, gt_array, len(name_seq),
+                                                 iou_thresholds=iou_thresholds, use_07_metric=use_07_metric,
+                                                 num_positive=num_positive)
+        num_preds = np.bincount(pred_array[:, 1].astype(np.int64), minlength=len(name_seq))
+        for t, iou_threshold in enumerate(iou_thresholds):
+            # Classes without any prediction are reported as -1, as the devkit does.
+            aps = [ap if num_preds[i] > 0 else -1. for i, ap in enumerate(ap_list[t])]
+            print('IoU threshold: {}'.format(iou_threshold))
+            for cls, ap in zip(name_seq, aps):
+                print('AP for {} = {:.4f}'.format(cls, ap))
+
+            print('Mean AP = {:.4f}'.format(np.mean(aps)))
+            print('~~~~~~~~')
+            print('Results:')
+            for ap in aps:
+                print('{:.3f}'.format(ap))
+            print('{:.3f}'.format(np.mean(aps)))
+            print('~~~~~~~~')
+            print('')
+
         print('--------------------------------------------------------------')
         print('Results computed with the **unofficial** Python eval code.')
         print('Results should be very close to the official MATLAB eval code.')
         print('--------------------------------------------------------------')
 
-    @staticmethod
-    def voc_ap(rec, prec, use_07_metric=True):
-        """ ap = voc_ap(rec, prec, [use_07_metric])
-        Compute VOC AP given precision and recall.
-        If use_07_metric is true, uses the
-        VOC 07 11 point method (default:True).
-        """
-        if use_07_metric:
-            # 11 point metric
-            ap = 0.
-            for t in np.arange(0., 1.1, 0.1):
-                if np.sum(rec >= t) == 0:
-                    p = 0
-                else:
-                    p = np.max(prec[rec >= t])
-                ap = ap + p / 11.
-        else:
-            # correct AP calculation
-            # first append sentinel values at the end
-            mrec = np.concatenate(([0.], rec, [1.]))
-            mpre = np.concatenate(([0.], prec, [0.]))
-
-            # compute the precision envelope
-            for i in range(mpre.size - 1, 0, -1):
-                mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
-
-            # to calculate area under PR curve, look for points
-            # where X axis (recall) changes value
-            i = np.where(mrec[1:] != mrec[:-1])[0]
-
-            # and sum (\Delta recall) * prec
-            ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
-        return ap
-
-    @staticmethod
-    def voc_eval(det_file,
-                 gt_dir,
-                 classname,
-                 ovthresh=0.5,
-                 use_07_metric=True):
-        """rec, prec, ap = voc_eval(detpath,
-                               annopath,
-                               imagesetfile,
-                               classname,
-                               [ovthresh],
-                               [use_07_metric])
-    Top level function that does the PASCAL VOC evaluation.
-    detpath: Path to detections
-       detpath.format(classname) should produce the detection results file.
-    annopath: Path to annotations
-       annopath.format(imagename) should be the xml annotations file.
-    imagesetfile: Text file containing the list of images, one image per line.
-    classname: Category name (duh)
-    cachedir: Directory for caching the annotations
-    [ovthresh]: Overlap threshold (default = 0.5)
-    [use_07_metric]: Whether to use VOC07's 11 point AP computation
-       (default True)
-    """
-        # assumes detections are in detpath.format(classname)
-        # assumes annotations are in annopath.format(imagename)
-        # assumes imagesetfile is a text file with each line an image name
-        # cachedir caches the annotations in a pickle file
-        # first load gt
-        cachedir = '/tmp/voc_cache'
-        if not os.path.isdir(cachedir):
-            os.mkdir(cachedir)
-
-        cachefile = os.path.join(cachedir, 'annots.pkl')
-        # read list of images
-        with open(os.path.join(gt_dir, 'ImageSets/Main', 'test.txt'), 'r') as f:
-            lines = f.readlines()
-
-        imagenames = [x.strip() for x in lines]
-        if not os.path.isfile(cachefile):
-            # load annots
-            recs = {}
-            for i, imagename in enumerate(imagenames):
-                annopath = os.path.join(gt_dir, 'Annotations', '%s.xml')
-                recs[imagename] = VOCEvaluator.parse_rec(annopath % (imagename))
-                if i % 100 == 0:
-                    print('Reading annotation for {:d}/{:d}'.format(i + 1, len(imagenames)))
-
-            # save
-            print('Saving cached annotations to {:s}'.format(cachefile))
-            with open(cachefile, 'wb') as f:
-                pickle.dump(recs, f)
-        else:
-            # load
-            with open(cachefile, 'rb') as f:
-                recs = pickle.load(f)
-
-        # extract gt objects for this class
-        class_recs = {}
-        npos = 0
-        for imagename in imagenames:
-            R = [obj for obj in recs[imagename] if obj['name'] == classname]
-            bbox = np.array([x['bbox'] for x in R])
-            difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-            det = [False] * len(R)
-            npos = npos + sum(~difficult)
-            class_recs[imagename] = {'bbox': bbox,
-                                     'difficult': difficult,
-                                     'det': det}
-
-        with open(det_file, 'r') as f:
-            lines = f.readlines()
-
-        if any(lines) == 1:
-            splitlines = [x.strip().split(' ') for x in lines]
-            image_ids = [x[0] for x in splitlines]
-            confidence = np.array([float(x[1]) for x in splitlines])
-            BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
-
-            # sort by confidence
-            sorted_ind = np.argsort(-confidence)
-            sorted_scores = np.sort(-confidence)
-            BB = BB[sorted_ind, :]
-            image_ids = [image_ids[x] for x in sorted_ind]
-
-            # go down dets and mark TPs and FPs
-            nd = len(image_ids)
-            tp = np.zeros(nd)
-            fp = np.zeros(nd)
-            for d in range(nd):
-                R = class_recs[image_ids[d]]
-                bb = BB[d, :].astype(float)
-                ovmax = -np.inf
-                BBGT = R['bbox'].astype(float)
-                if BBGT.size > 0:
-                    # compute overlaps
-                    # intersection
-                    ixmin = np.maximum(BBGT[:, 0], bb[0])
-                    iymin = np.maximum(BBGT[:, 1], bb[1])
-                    ixmax = np.minimum(BBGT[:, 2], bb[2])
-                    iymax = np.minimum(BBGT[:, 3], bb[3])
-                    iw = np.maximum(ixmax - ixmin, 0.)
-                    ih = np.maximum(iymax - iymin, 0.)
-                    inters = iw * ih
-                    uni = ((bb[2] - bb[0]) * (bb[3] - bb[1]) +
-                           (BBGT[:, 2] - BBGT[:, 0]) *
-                           (BBGT[:, 3] - BBGT[:, 1]) - inters)
-                    overlaps = inters / uni
-                    ovmax = np.max(overlaps)
-                    jmax = np.argmax(overlaps)
-
-                if ovmax > ovthresh:
-                    if not R['difficult'][jmax]:
-                        if not R['det'][jmax]:
-                            tp[d] = 1.
-                            R['det'][jmax] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # compute precision recall
-            fp = np.cumsum(fp)
-            tp = np.cumsum(tp)
-            rec = tp / float(npos)
-            # avoid divide by zero in case the first detection matches a difficult
-            # ground truth
-            prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-            ap = VOCEvaluator.voc_ap(rec, prec, use_07_metric)
-        else:
-            rec = -1.
-            prec = -1.
-            ap = -1.
-
-        return rec, prec, ap
-
 
 if __name__ == "__main__":
     # Example:
@@ -307,7 +213,7 @@ if __name__ == "__main__":
     parser.add_argument('--gt_dir', default='/home/donny/DataSet/VOC/VOCdevkit/VOC2007', type=str,
                         dest='gt_dir', help='The groundtruth annotations file of voc dets.')
     parser.add_argument('--json_dir', default='../../../val/results/det/voc/test_dir/image/json', type=str,
-                        dest='json_dir', help='The json dir of predict annotations.')
+                        dest='json_dir', help='The json dir or the results.jsonl file of predict annotations.')
     parser.add_argument('--dataset', default='VOC2007', type=str,
                         dest='dataset', help='The target dataset.')
     args = parser.parse_args()
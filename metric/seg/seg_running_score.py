@@ -9,26 +9,68 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils.helpers.dist_helper import DistHelper
 
 
 class SegRunningScore(object):
+    """The confusion matrix is accumulated with torch.bincount on the device of the labels,
+    it is only copied to the host by get_*."""
 
     def __init__(self, configer):
         self.configer = configer
         self.n_classes = self.configer.get('data', 'num_classes')
-        self.confusion_matrix = np.zeros((self.n_classes, self.n_classes))
+        self.reset()
 
     def _fast_hist(self, label_true, label_pred, n_class):
         mask = (label_true >= 0) & (label_true < n_class)
-        hist = np.bincount(
-            n_class * label_true[mask].astype(int) +
-            label_pred[mask], minlength=n_class**2).reshape(n_class, n_class)
+        hist = torch.bincount(
+            n_class * label_true[mask].long() +
+            label_pred[mask].long(), minlength=n_class**2).view(n_class, n_class)
 
         return hist
 
     def update(self, label_preds, label_trues):
-        for lt, lp in zip(label_trues, label_preds):
-            self.confusion_matrix += self._fast_hist(lt.flatten(), lp.flatten(), self.n_classes)
+        """label_preds and label_trues are tensors (or ndarrays) sized [N, H, W]."""
+        if isinstance(label_preds, np.ndarray):
+            label_preds = torch.from_numpy(label_preds)
+
+        if isinstance(label_trues, np.ndarray):
+            label_trues = torch.from_numpy(label_trues)
+
+        label_trues = label_trues.to(label_preds.device)
+        hist = self._fast_hist(label_trues.contiguous().view(-1), label_preds.contiguous().view(-1), self.n_classes)
+        self.confusion_matrix = hist if self.confusion_matrix is None \
+            else self.confusion_matrix + hist.to(self.confusion_matrix.device)
+        self.host_matrix = None
+
+    def merge(self, other):
+        """Sum the confusion matrix of another running score, e.g. of another replica."""
+        if other.confusion_matrix is not None:
+            self.confusion_matrix = other.confusion_matrix.clone() if self.confusion_matrix is None \
+                else self.confusion_matrix + other.confusion_matrix.to(self.confusion_matrix.device)
+            self.host_matrix = None
+
+    def all_reduce(self):
+        """Sum the confusion matrices of all the distributed workers.
+
+        Every worker joins the collective, the ones without any batch reduce a zero matrix.
+        """
+        if not DistHelper.is_distributed():
+            return
+
+        device = DistHelper.get_device()
+        if self.confusion_matrix is None:
+            confusion_matrix = torch.zeros((self.n_classes, self.n_classes), dtype=torch.int64, device=device)
+        else:
+            confusion_matrix = self.confusion_matrix.to(device)
+
+        dist.all_reduce(confusion_matrix)
+        self.confusion_matrix = confusion_matrix if self.confusion_matrix is None \
+            else confusion_matrix.to(self.confusion_matrix.device)
+        self.host_matrix = None
 
     def _get_scores(self):
         """Returns accuracy score evaluation result.
@@ -37,7 +79,11 @@ class SegRunningScore(object):
             - mean IU
             - fwavacc
         """
-        hist = self.confusion_matrix
+        if self.host_matrix is None:
+            self.host_matrix = np.zeros((self.n_classes, self.n_classes)) if self.confusion_matrix is None \
+                else self.confusion_matrix.cpu().numpy().astype(np.float64)
+
+        hist = self.host_matrix
         acc = np.diag(hist).sum() / hist.sum()
         acc_cls = np.diag(hist) / hist.sum(axis=1)
         acc_cls = np.nanmean(acc_cls)
@@ -56,5 +102,6 @@ class SegRunningScore(object):
         return self._get_scores()[0]
 
     def reset(self):
-        self.confusion_matrix = np.zeros((self.n_classes, self.n_classes))
+        self.confusion_matrix = None
+        self.host_matrix = None
 
@@ -14,6 +14,7 @@ from torch.nn import functional as F
 from torchvision.models import vgg16
 
 from loss.modules.det_modules import FRLoss
+from models.tools.module_helper import ModuleHelper
 from utils.layers.det.fr_roi_generator import FRROIGenerator
 from utils.layers.det.fr_roi_sampler import FRROISampler
 from utils.layers.det.rpn_detection_layer import RPNDetectionLayer
@@ -35,7 +36,7 @@ class VGGModel(object):
         model = vgg16(pretrained=False)
         if self.configer.get('network', 'pretrained') is not None :
             Log.info('Loading pretrained model: {}'.format(self.configer.get('network', 'pretrained')))
-            model.load_state_dict(torch.load(self.configer.get('network', 'pretrained')))
+            model.load_state_dict(ModuleHelper.load_checkpoint(self.configer.get('network', 'pretrained')))
 
         features = list(model.features)[:30]
         classifier = model.classifier
@@ -8,6 +8,7 @@ import torch
 from torch import nn
 import torch.nn.init as init
 
+from models.tools.module_helper import ModuleHelper
 from utils.layers.det.ssd_detection_layer import SSDDetectionLayer
 from utils.tools.logger import Logger as Log
 
@@ -58,7 +59,7 @@ def vgg_backbone(configer):
     model = VGGModel(DETECTOR_CONFIG['vgg_cfg'])
     if configer.get('network', 'pretrained') is not None:
         Log.info('Loading pretrained model:{}'.format(configer.get('network', 'pretrained')))
-        pretrained_dict = torch.load(configer.get('network', 'pretrained'))
+        pretrained_dict = ModuleHelper.load_checkpoint(configer.get('network', 'pretrained'))
 
         Log.info('Pretrained Keys: {}'.format(pretrained_dict.keys()))
         model_dict = model.state_dict()
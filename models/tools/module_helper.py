@@ -8,7 +8,9 @@ from __future__ import division
 from __future__ import print_function
 
 import functools
+import inspect
 import os
+import zipfile
 
 import torch
 import torch.nn as nn
@@ -65,33 +67,89 @@ class ModuleHelper(object):
             Log.error('Not support BN type: {}.'.format(bn_type))
             exit(1)
 
+    @staticmethod
+    def load_checkpoint(file_path, map_location='cpu'):
+        """Load a checkpoint with its tensors memory-mapped from the file, so they are only read when used.
+
+        The .safetensors files are mapped by safetensors, the files of torch.save by torch.load(mmap=True). The
+        torch versions without mmap and the legacy (non zip) files are loaded without it.
+        """
+        if file_path.endswith('.safetensors'):
+            try:
+                from safetensors.torch import load_file
+            except ImportError:
+                Log.error('safetensors is required to load {}.'.format(file_path))
+                exit(1)
+
+            return load_file(file_path, device='cpu' if map_location is None else str(map_location))
+
+        load_params = inspect.signature(torch.load).parameters
+        load_kwargs = dict()
+        if 'weights_only' in load_params:
+            # The checkpoints hold the non tensor objects, e.g. the config dicts.
+            load_kwargs['weights_only'] = False
+
+        if 'mmap' in load_params and zipfile.is_zipfile(file_path):
+            load_kwargs['mmap'] = True
+
+        return torch.load(file_path, map_location=map_location, **load_kwargs)
+
+    @staticmethod
+    def load_state_dict(module, state_dict, strict=False):
+        """Copy the tensors of state_dict into the parameters & buffers of module in place.
+
+        The keys are remapped one by one: the 'module.' prefix of the parallel models is dropped, and the
+        'prefix.' one is added if only the prefixed key is in the module.
+
+        Return:
+          missing_keys(list): the keys of the module not in state_dict.
+          unexpected_keys(list): the keys of state_dict not in the module.
+
+        """
+        own_state = module.state_dict()
+        loaded_keys = set()
+        unexpected_keys = list()
+        for name, param in state_dict.items():
+            if name.startswith('module.'):
+                name = name[7:]
+
+            if name not in own_state and 'prefix.{}'.format(name) in own_state:
+                name = 'prefix.{}'.format(name)
+
+            if name not in own_state:
+                unexpected_keys.append(name)
+                continue
+
+            if own_state[name].size() != param.size():
+                raise RuntimeError('While copying the parameter named {}, '
+                                   'whose dimensions in the model are {} and '
+                                   'whose dimensions in the checkpoint are {}.'
+                                   .format(name, own_state[name].size(), param.size()))
+
+            with torch.no_grad():
+                own_state[name].copy_(param)
+
+            loaded_keys.add(name)
+
+        missing_keys = [name for name in own_state.keys() if name not in loaded_keys]
+        if strict and (len(missing_keys) > 0 or len(unexpected_keys) > 0):
+            raise RuntimeError('Missing keys: {}, unexpected keys: {}.'.format(missing_keys, unexpected_keys))
+
+        return missing_keys, unexpected_keys
+
     @staticmethod
     def load_model(model, pretrained=None, all_match=True):
         if pretrained is None:
             return model
 
+        Log.info('Loading pretrained model:{}'.format(pretrained))
+        pretrained_dict = ModuleHelper.load_checkpoint(pretrained)
         if all_match:
-            Log.info('Loading pretrained model:{}'.format(pretrained))
-            pretrained_dict = torch.load(pretrained)
-            model_dict = model.state_dict()
-            load_dict = dict()
-            for k, v in pretrained_dict.items():
-                if 'prefix.{}'.format(k) in model_dict:
-                    load_dict['prefix.{}'.format(k)] = v
-                else:
-                    load_dict[k] = v
-
-            # load_dict = {k: v for k, v in pretrained_dict.items() if 'resinit.{}'.format(k) not in model_dict}
-            model.load_state_dict(load_dict)
+            ModuleHelper.load_state_dict(model, pretrained_dict, strict=True)
 
         else:
-            Log.info('Loading pretrained model:{}'.format(pretrained))
-            pretrained_dict = torch.load(pretrained)
-            model_dict = model.state_dict()
-            load_dict = {k: v for k, v in pretrained_dict.items() if k in model_dict}
-            Log.info('Matched Keys: {}'.format(load_dict.keys()))
-            model_dict.update(load_dict)
-            model.load_state_dict(model_dict)
+            missing_keys, _ = ModuleHelper.load_state_dict(model, pretrained_dict)
+            Log.info('Matched Keys: {}'.format(set(model.state_dict().keys()) - set(missing_keys)))
 
         return model
 
@@ -108,7 +166,7 @@ class ModuleHelper(object):
             urlretrieve(url, cached_file)
 
         Log.info('Loading pretrained model:{}'.format(cached_file))
-        return torch.load(cached_file, map_location=map_location)
+        return ModuleHelper.load_checkpoint(cached_file, map_location=map_location)
 
     @staticmethod
     def constant_init(module, val, bias=0):
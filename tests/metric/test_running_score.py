@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# The all_reduce of the running scores, with a worker without any batch.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import socket
+import tempfile
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from metric.cls.cls_running_score import ClsRunningScore
+from metric.det.det_running_score import DetRunningScore
+from metric.seg.seg_running_score import SegRunningScore
+
+
+WORLD_SIZE = 2
+
+
+class FakeConfiger(object):
+    def __init__(self, config_dict):
+        self.config_dict = config_dict
+
+    def exists(self, *key):
+        return key in self.config_dict
+
+    def get(self, *key):
+        return self.config_dict[key]
+
+
+def _get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _run_worker(rank, port, result_dir):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+    configer = FakeConfiger({('data', 'num_classes'): 3})
+    cls_score = ClsRunningScore(configer)
+    seg_score = SegRunningScore(configer)
+    det_score = DetRunningScore(configer)
+    # Only the rank 0 gets the batches.
+    if rank == 0:
+        cls_score.update(torch.tensor([[0.1, 0.9, 0., 0., 0., 0.], [0.8, 0.2, 0., 0., 0., 0.]]),
+                         torch.tensor([1, 1]))
+        seg_score.update(torch.tensor([[[0, 1], [2, 2]]]), torch.tensor([[[0, 1], [2, 1]]]))
+        det_score.update([torch.tensor([[0., 0., 10., 10., 1., 0.9]])],
+                         [torch.tensor([[0., 0., 10., 10.]])], [torch.tensor([1])])
+
+    for score in (cls_score, seg_score, det_score):
+        score.all_reduce()
+
+    torch.save(dict(cls_state=cls_score.state.cpu(), confusion_matrix=seg_score.confusion_matrix.cpu(),
+                    num_images=det_score.num_images, num_preds=det_score.num_preds, num_gts=det_score.num_gts),
+               os.path.join(result_dir, '{}.pth'.format(rank)))
+    dist.destroy_process_group()
+
+
+def test_all_reduce_with_empty_worker():
+    result_dir = tempfile.mkdtemp()
+    mp.spawn(_run_worker, args=(_get_free_port(), result_dir), nprocs=WORLD_SIZE, join=True)
+    for rank in range(WORLD_SIZE):
+        result = torch.load(os.path.join(result_dir, '{}.pth'.format(rank)))
+        # top1, top3, top5 corrects & the number of samples.
+        assert result['cls_state'].tolist() == [1., 2., 2., 2.]
+        assert result['confusion_matrix'].tolist() == [[1, 0, 0], [0, 1, 1], [0, 0, 1]]
+        assert (result['num_images'], result['num_preds'], result['num_gts']) == (1, 1, 1)
@@ -7,11 +7,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import math
 import numpy as np
 import torch
 
 from extensions.nms.nms_wrapper import nms
 from extensions.nms.nms_wrapper import soft_nms
+from extensions.nms.nms_wrapper import tensor_nms
 
 
 class DetHelper(object):
@@ -63,6 +65,62 @@ class DetHelper(object):
 
         return np.concatenate(cls_dets_list, 0)
 
+    @staticmethod
+    def group_sort(group_ids, scores):
+        """Sort by group, then by descending score inside each group.
+
+        Return:
+          order(tensor): indices of the sorted elements.
+          rank(tensor): the rank of every sorted element inside its group, 0 is the highest score.
+
+        """
+        num = scores.numel()
+        positions = torch.arange(num, dtype=torch.long, device=scores.device)
+        score_order = scores.sort(0, descending=True)[1]
+        _, order = (group_ids[score_order].long() * num + positions).sort(0)
+        order = score_order[order]
+        sorted_ids = group_ids[order].long()
+        counts = torch.bincount(sorted_ids)
+        return order, positions - (counts.cumsum(0) - counts)[sorted_ids]
+
+    @staticmethod
+    def batch_nms(dets, group_ids, max_threshold=0.0, group_keep_num=None):
+        """NMS of all the groups (e.g. image and class pairs) in one call of the nms extension.
+
+        The boxes of every group are shifted to a separate tile of a square grid, so boxes of different groups
+        never overlap, and the coordinates stay small enough for the float32 nms kernels.
+
+        Args:
+          dets(tensor): [x1,y1,x2,y2,score] of all the boxes, sized [N,5].
+          group_ids(tensor): the group of every box, sized [N].
+          group_keep_num(int): the max number of boxes kept in every group.
+        Return:
+          keep(tensor): indices of the kept boxes, sorted by group and descending score.
+
+        """
+        if dets.size(0) == 0:
+            return torch.zeros((0,), dtype=torch.long, device=dets.device)
+
+        _, dense_ids = torch.unique(group_ids, return_inverse=True)
+        grid_size = int(math.ceil(math.sqrt(dense_ids.max().item() + 1)))
+        tile_size = dets[:, :4].max() - dets[:, :4].min().clamp(max=0) + 2
+        offsets = torch.stack([dense_ids % grid_size, dense_ids // grid_size], 1).to(dets.dtype) * tile_size
+        offset_dets = torch.cat((dets[:, :4] + offsets.repeat(1, 2), dets[:, 4:5]), 1)
+        keep = tensor_nms(offset_dets, thresh=max_threshold)
+
+        order, rank = DetHelper.group_sort(group_ids[keep], dets[keep, 4])
+        if group_keep_num is not None:
+            order = order[rank < group_keep_num]
+
+        return keep[order]
+
+    @staticmethod
+    def split_batch(dets, batch_index, batch_size):
+        """Split the detections of a batch into a list of per image tensors, None for the images without any."""
+        counts = torch.bincount(batch_index, minlength=batch_size).tolist()
+        dets_list = torch.split(dets, counts, 0)
+        return [dets_list[i] if counts[i] > 0 else None for i in range(batch_size)]
+
     @staticmethod
     def bbox_iou(box1, box2):
         """Compute the intersection over union of two set of boxes, each box is [x1,y1,x2,y2].
@@ -107,6 +165,70 @@ class DetHelper(object):
         iou = inter / (area1 + area2 - inter)
         return iou
 
+    @staticmethod
+    def batch_bbox_iou(box1, box2):
+        """Compute the intersection over union of boxes in a batch, each box is [x1,y1,x2,y2].
+
+        Args:
+          box1(tensor): bounding boxes, sized [B,N,4].
+          box2(tensor): bounding boxes, sized [B,M,4], or [M,4] shared by the batch.
+        Return:
+          iou(tensor): sized [B,N,M].
+
+        """
+        if len(box2.size()) == 2:
+            box2 = box2.unsqueeze(0)
+
+        lt = torch.max(box1[:, :, None, :2], box2[:, None, :, :2])  # [B,N,M,2]
+        rb = torch.min(box1[:, :, None, 2:4], box2[:, None, :, 2:4])  # [B,N,M,2]
+        inter = (rb - lt).clamp(min=0).prod(3)  # [B,N,M]
+
+        area1 = (box1[:, :, 2] - box1[:, :, 0]) * (box1[:, :, 3] - box1[:, :, 1])  # [B,N]
+        area2 = (box2[:, :, 2] - box2[:, :, 0]) * (box2[:, :, 3] - box2[:, :, 1])  # [B,M]
+        return inter / (area1[:, :, None] + area2[:, None, :] - inter)
+
+    @staticmethod
+    def pad_gt(gt_bboxes, gt_labels=None, device=None):
+        """Pad the gt of every image to the max object number of the batch, with a single copy to the device.
+
+        Return:
+          bboxes(tensor): sized [B,M,4].
+          labels(tensor): sized [B,M].
+          valid(tensor): bool mask of the real objects, sized [B,M].
+
+        """
+        batch_size = len(gt_bboxes)
+        num_objects = [0 if bboxes is None else len(bboxes) for bboxes in gt_bboxes]
+        max_objects = max(num_objects + [1])
+        bboxes = torch.zeros(batch_size, max_objects, 4, device=device)
+        labels = torch.zeros(batch_size, max_objects, dtype=torch.long, device=device)
+        valid = torch.zeros(batch_size, max_objects, dtype=torch.bool, device=device)
+        if sum(num_objects) == 0:
+            return bboxes, labels, valid
+
+        batch_index = torch.cat([torch.full((num,), i, dtype=torch.long) for i, num in enumerate(num_objects)])
+        object_index = torch.cat([torch.arange(num, dtype=torch.long) for num in num_objects])
+        batch_index, object_index = batch_index.to(device), object_index.to(device)
+        bboxes[batch_index, object_index] = torch.cat([gt_bboxes[i].float().view(-1, 4)
+                                                       for i in range(batch_size) if num_objects[i] > 0]).to(device)
+        if gt_labels is not None:
+            labels[batch_index, object_index] = torch.cat([gt_labels[i].long().view(-1) for i in range(batch_size)
+                                                           if num_objects[i] > 0]).to(device)
+
+        valid[batch_index, object_index] = True
+        return bboxes, labels, valid
+
+    @staticmethod
+    def random_rank(mask):
+        """Rank the True elements of every row of mask in a random order, the False elements are ranked after them.
+
+        Keeping the elements with rank < k samples k of them without replacement, on the device of mask.
+        """
+        keys = torch.rand(mask.size(), device=mask.device).masked_fill_(~mask, 2.)
+        order = keys.argsort(-1)
+        positions = torch.arange(mask.size(-1), dtype=torch.long, device=mask.device).expand_as(order)
+        return torch.empty_like(order).scatter_(-1, order, positions)
+
     @staticmethod
     def bbox_kmeans(bboxes, cluster_number, dist=np.mean):
         box_number = bboxes.shape[0]
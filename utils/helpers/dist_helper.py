@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.distributed as dist
+
+
+class DistHelper(object):
+
+    @staticmethod
+    def is_distributed():
+        return dist.is_available() and dist.is_initialized()
+
+    @staticmethod
+    def get_device():
+        """The device of the tensors passed to the collectives, the same on every rank of the process group."""
+        if dist.get_backend() == 'nccl':
+            return torch.device('cuda', torch.cuda.current_device())
+
+        return torch.device('cpu')
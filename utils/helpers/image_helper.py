@@ -8,6 +8,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import cv2
 import numpy as np
 from PIL import Image
@@ -76,6 +77,51 @@ class ImageHelper(object):
                 Log.error('Not support mode {}'.format(mode))
                 exit(1)
 
+    @staticmethod
+    def decode_image(img_buf, tool='pil', mode='RGB'):
+        """Decode an encoded image (bytes or memoryview) in the same way as read_image."""
+        if tool == 'pil':
+            img = Image.open(io.BytesIO(img_buf))
+            if mode == 'RGB':
+                return img.convert('RGB')
+
+            elif mode == 'BGR':
+                img = img.convert('RGB')
+                cv_img = ImageHelper.rgb2bgr(np.array(img))
+                return Image.fromarray(cv_img)
+
+            elif mode == 'P':
+                return img.convert('P')
+
+            else:
+                Log.error('Not support mode {}'.format(mode))
+                exit(1)
+
+        elif tool == 'cv2':
+            if mode == 'P':
+                return ImageHelper.img2np(Image.open(io.BytesIO(img_buf)).convert('P'))
+
+            img_bgr = cv2.imdecode(np.frombuffer(img_buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if mode == 'RGB':
+                return ImageHelper.bgr2rgb(img_bgr)
+
+            elif mode == 'BGR':
+                return img_bgr
+
+            else:
+                Log.error('Not support mode {}'.format(mode))
+                exit(1)
+
+        else:
+            Log.error('Not support tool {}'.format(tool))
+            exit(1)
+
+    @staticmethod
+    def read_image_size(image_path):
+        """Read the [width, height] from the image header, without decoding the pixels."""
+        with Image.open(image_path) as img:
+            return list(img.size)
+
     @staticmethod
     def rgb2bgr(img_rgb):
         if isinstance(img_rgb, Image.Image):
@@ -37,6 +37,28 @@ class JsonHelper(object):
         with open(json_file, 'w') as write_stream:
             write_stream.write(json.dumps(json_dict))
 
+    @staticmethod
+    def load_results(json_path):
+        """Yield the (image name, json_dict) of the test results, in a dir of json files or a results.jsonl file."""
+        if os.path.isfile(json_path):
+            with open(json_path, 'r') as read_stream:
+                for line in read_stream:
+                    if len(line.strip()) == 0:
+                        continue
+
+                    json_dict = json.loads(line)
+                    yield os.path.basename(json_dict.pop('image_name')), json_dict
+
+            return
+
+        for json_file in os.listdir(json_path):
+            shotname, extensions = os.path.splitext(json_file)
+            if extensions != '.json':
+                continue
+
+            with open(os.path.join(json_path, json_file), 'r') as read_stream:
+                yield shotname, json.load(read_stream)
+
     @staticmethod
     def json2xml(json_file, xml_file):
         if not os.path.exists(json_file):
@@ -10,6 +10,7 @@ from __future__ import print_function
 
 import numpy as np
 import pycocotools.mask as mask_util
+import torch
 
 
 class MaskHelper(object):
@@ -59,6 +60,62 @@ class MaskHelper(object):
         mask = np.array(mask > 0, dtype=np.float32)
         return mask
 
+    @staticmethod
+    def polys2masks(polygons_list, width=None, height=None):
+        """Rasterize the polygons of every object to a full resolution mask, sized [M, height, width].
+        By default the masks just cover the extent of all the polygons.
+        """
+        if width is None or height is None:
+            points = np.concatenate([np.array(poly, dtype=np.float32).reshape(-1, 2)
+                                     for polygons in polygons_list for poly in polygons], 0)
+            max_x, max_y = np.ceil(points.max(0)).astype(np.int64) + 1
+            width = max_x if width is None else width
+            height = max_y if height is None else height
+
+        masks = np.zeros((len(polygons_list), height, width), dtype=np.float32)
+        for i, polygons in enumerate(polygons_list):
+            masks[i] = MaskHelper.polys2mask(polygons, width, height)
+
+        return masks
+
+    @staticmethod
+    def roi_crop(masks, boxes, mask_index, target_size):
+        """Crop and resize the full resolution masks to the boxes with the bilinear sampling of RoIAlign
+        (one sample per bin), the samples out of the masks are 0.
+
+        Args:
+          masks(tensor): sized [M, H, W].
+          boxes(tensor): [x1, y1, x2, y2] in pixels, sized [N, 4].
+          mask_index(tensor): the mask of every box, sized [N].
+          target_size(list): [width, height] of the crops.
+        Return:
+          crops(tensor): soft masks, sized [N, target_size[1], target_size[0]].
+
+        """
+        height, width = masks.size(1), masks.size(2)
+        box_w = (boxes[:, 2] - boxes[:, 0]).clamp(min=1)
+        box_h = (boxes[:, 3] - boxes[:, 1]).clamp(min=1)
+        steps_x = (torch.arange(target_size[0], dtype=masks.dtype, device=masks.device) + 0.5) / target_size[0]
+        steps_y = (torch.arange(target_size[1], dtype=masks.dtype, device=masks.device) + 0.5) / target_size[1]
+        xs = boxes[:, 0:1] + box_w[:, None] * steps_x[None, :] - 0.5  # [N, target_w]
+        ys = boxes[:, 1:2] + box_h[:, None] * steps_y[None, :] - 0.5  # [N, target_h]
+        valid_x = ((xs > -1) & (xs < width)).to(masks.dtype)
+        valid_y = ((ys > -1) & (ys < height)).to(masks.dtype)
+        xs = xs.clamp(0, width - 1)
+        ys = ys.clamp(0, height - 1)
+        x0, y0 = xs.floor().long(), ys.floor().long()
+        x1, y1 = (x0 + 1).clamp(max=width - 1), (y0 + 1).clamp(max=height - 1)
+        lx, ly = xs - x0.to(masks.dtype), ys - y0.to(masks.dtype)
+
+        # interpolate the rows, then the columns.
+        rows = masks[mask_index[:, None], y0] * (1 - ly)[:, :, None] \
+            + masks[mask_index[:, None], y1] * ly[:, :, None]  # [N, target_h, W]
+        rows = rows * valid_y[:, :, None]
+        x0 = x0[:, None, :].expand(-1, target_size[1], -1)
+        x1 = x1[:, None, :].expand(-1, target_size[1], -1)
+        crops = rows.gather(2, x0) * (1 - lx)[:, None, :] + rows.gather(2, x1) * lx[:, None, :]
+        return crops * valid_x[:, None, :]
+
     @staticmethod
     def rle_mask_voting(top_masks, all_masks, all_dets, iou_thresh, binarize_thresh, method='AVG'):
         """Returns new masks (in correspondence with `top_masks`) by combining
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Donny You(youansheng@gmail.com)
+# LRU cache of the anchors shared by the prior box layers.
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+from collections import OrderedDict
+
+
+class AnchorCache(object):
+    """Device-resident anchors keyed by (layer, input size, feature map sizes, anchor config, device).
+
+    With multi_size training the input size changes per batch, so only the max_size most recently
+    used entries are kept. The cached tensors are shared, callers must not modify them in place.
+    It's thread safe, the replicas of DataParallelModel call it from their own threads.
+    """
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.anchor_dict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(name, input_size, feat_list, anchor_config):
+        feat_sizes = tuple((feat.size(2), feat.size(3)) for feat in feat_list)
+        device = feat_list[0].device if len(feat_list) > 0 else None
+        return (name, tuple(float(size) for size in input_size), feat_sizes,
+                json.dumps(anchor_config, sort_keys=True), str(device))
+
+    def get(self, key, build_fn):
+        with self.lock:
+            if key in self.anchor_dict:
+                anchors = self.anchor_dict.pop(key)
+                self.anchor_dict[key] = anchors
+                return anchors
+
+        # Built outside the lock, the other threads may build the same anchors, the last one is kept.
+        anchors = build_fn()
+        with self.lock:
+            self.anchor_dict.pop(key, None)
+            while len(self.anchor_dict) >= self.max_size:
+                self.anchor_dict.popitem(last=False)
+
+            self.anchor_dict[key] = anchors
+
+        return anchors
+
+    def clear(self):
+        with self.lock:
+            self.anchor_dict.clear()
+
+
+ANCHOR_CACHE = AnchorCache()
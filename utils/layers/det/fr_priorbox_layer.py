@@ -12,6 +12,7 @@ import math
 import numpy as np
 import torch
 
+from utils.layers.det.anchor_cache import ANCHOR_CACHE
 from utils.tools.logger import Logger as Log
 
 
@@ -23,6 +24,17 @@ class FRPriorBoxLayer(object):
         self.clip = clip
 
     def __call__(self, feat_list, input_size):
+        anchor_config = dict(
+            anchor_sizes_list=self.configer.get('rpn', 'anchor_sizes_list'),
+            aspect_ratio_list=self.configer.get('rpn', 'aspect_ratio_list'),
+            num_anchor_list=self.configer.get('rpn', 'num_anchor_list'),
+            clip=self.clip
+        )
+        key = ANCHOR_CACHE.make_key('fr', input_size, feat_list, anchor_config)
+        return ANCHOR_CACHE.get(key, lambda: self.__build_anchors(feat_list, input_size,
+                                                                  anchor_config).to(feat_list[0].device))
+
+    def __build_anchors(self, feat_list, input_size, anchor_config):
         img_w, img_h = input_size
 
         feature_map_w = [feat.size(3) for feat in feat_list]
@@ -36,18 +48,18 @@ class FRPriorBoxLayer(object):
             fm_h = feature_map_h[i]
             stride_offset_w, stride_offset_h = 0.5 * stride_w_list[i], 0.5 * stride_h_list[i]
             boxes = []
-            anchor_sizes = self.configer.get('rpn', 'anchor_sizes_list')[i]
+            anchor_sizes = anchor_config['anchor_sizes_list'][i]
             for j in range(len(anchor_sizes)):
                 s_w = anchor_sizes[j][0]
                 s_h = anchor_sizes[j][1]
                 boxes.append((stride_offset_w, stride_offset_h, s_w, s_h))
 
-                for ar in self.configer.get('rpn', 'aspect_ratio_list')[i]:
+                for ar in anchor_config['aspect_ratio_list'][i]:
                     boxes.append((stride_offset_w, stride_offset_h, s_w * math.sqrt(ar), s_h / math.sqrt(ar)))
                     boxes.append((stride_offset_w, stride_offset_h, s_w / math.sqrt(ar), s_h * math.sqrt(ar)))
 
             anchor_bases = torch.FloatTensor(np.array(boxes))
-            assert anchor_bases.size(0) == self.configer.get('rpn', 'num_anchor_list')[i]
+            assert anchor_bases.size(0) == anchor_config['num_anchor_list'][i]
             anchors = anchor_bases.contiguous().view(1, -1, 4).repeat(fm_h * fm_w, 1, 1).contiguous().view(-1, 4)
             grid_len_h = np.arange(0, img_h - stride_offset_h, stride_h_list[i])
             grid_len_w = np.arange(0, img_w - stride_offset_w, stride_w_list[i])
@@ -57,12 +69,12 @@ class FRPriorBoxLayer(object):
             y_offset = torch.FloatTensor(b).view(-1, 1)
 
             x_y_offset = torch.cat((x_offset, y_offset), 1).contiguous()
-            x_y_offset = x_y_offset.repeat(1, self.configer.get('rpn', 'num_anchor_list')[i]).contiguous().view(-1, 2)
+            x_y_offset = x_y_offset.repeat(1, anchor_config['num_anchor_list'][i]).contiguous().view(-1, 2)
             anchors[:, :2] = anchors[:, :2] + x_y_offset
             anchor_boxes_list.append(anchors)
 
         anchor_boxes = torch.cat(anchor_boxes_list, 0)
-        if self.clip:
+        if anchor_config['clip']:
             anchor_boxes[:, 0::2].clamp_(min=0., max=img_w - 1)
             anchor_boxes[:, 1::2].clamp_(min=0., max=img_h - 1)
 
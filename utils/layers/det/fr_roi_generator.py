@@ -10,7 +10,7 @@ from __future__ import print_function
 
 import torch
 
-from extensions.nms.nms_wrapper import nms
+from utils.helpers.det_helper import DetHelper
 from utils.layers.det.fr_priorbox_layer import FRPriorBoxLayer
 
 
@@ -85,77 +85,55 @@ class FRROIGenerator(object):
         # faster_rcnn.eval()
         # to set self.traing = False
         device = loc.device
+        batch_size = loc.size(0)
 
         anchors = self.fr_priorbox_layer(feat_list, meta[0]['input_size'])
-        default_boxes = anchors.unsqueeze(0).repeat(loc.size(0), 1, 1).to(device)
+        default_boxes = anchors.unsqueeze(0).to(device)
 
         # loc = loc[:, :, [1, 0, 3, 2]]
         # Convert anchors into proposal via bbox transformations.
+        loc = loc.detach()
         wh = torch.exp(loc[:, :, 2:]) * default_boxes[:, :, 2:]
         cxcy = loc[:, :, :2] * default_boxes[:, :, 2:] + default_boxes[:, :, :2]
         dst_bbox = torch.cat([cxcy - wh / 2, cxcy + wh / 2], 2)  # [b, 8732,4]
-        dst_bbox = dst_bbox.detach()
-        score = score.detach()
         # cls_prob = F.softmax(score, dim=-1)
-        rpn_fg_scores = score[:, :, 1]
-
-        rois_list = list()
-        roi_indices_list = list()
-        batch_rois_num = torch.zeros((loc.size(0),))
-
-        for i in range(loc.size(0)):
-            tmp_dst_bbox = dst_bbox[i]
-            tmp_dst_bbox[:, 0::2] = tmp_dst_bbox[:, 0::2].clamp_(min=0, max=meta[i]['border_size'][0] - 1)
-            tmp_dst_bbox[:, 1::2] = tmp_dst_bbox[:, 1::2].clamp_(min=0, max=meta[i]['border_size'][1] - 1)
-            tmp_scores = rpn_fg_scores[i]
-            # Remove predicted boxes with either height or width < threshold.
-            ws = tmp_dst_bbox[:, 2] - tmp_dst_bbox[:, 0] + 1
-            hs = tmp_dst_bbox[:, 3] - tmp_dst_bbox[:, 1] + 1
-            min_size = self.configer.get('rpn', 'min_size')
-            keep = (hs >= meta[i]['img_scale'] * min_size) & (ws >= meta[i]['img_scale'] * min_size)
-            rois = tmp_dst_bbox[keep]
-            tmp_scores = tmp_scores[keep]
-            # Sort all (proposal, score) pairs by score from highest to lowest.
-            # Take top pre_nms_topN (e.g. 6000).
-            if rois.numel() == 0:
-                rois_list.append(rois)
-                roi_indices_list.append(rois)
-                batch_rois_num[i] = rois.numel()
-                continue
-
-            _, order = tmp_scores.sort(0, descending=True)
-            if n_pre_nms > 0:
-                order = order[:n_pre_nms]
-
-            rois = rois[order]
-            tmp_scores = tmp_scores[order]
-
-            # Apply nms (e.g. threshold = 0.7).
-            # Take after_nms_topN (e.g. 300).
-
-            # unNOTE: somthing is wrong here!
-            # TODO: remove cuda.to_gpu
-            keep = nms(torch.cat((rois, tmp_scores.unsqueeze(1)), 1),
-                       thresh=self.configer.get('rpn', 'nms_threshold'))
-            # keep = DetHelper.nms(rois,
-            #                      scores=tmp_scores,
-            #                      nms_threshold=self.configer.get('rpn', 'nms_threshold'))
-            if n_post_nms > 0:
-                keep = keep[:n_post_nms]
-
-            rois = rois[keep]
-
-            batch_index = i * torch.ones((len(rois),))
-            rois_list.append(rois)
-            roi_indices_list.append(batch_index)
-            batch_rois_num[i] = len(rois)
-
-        rois = torch.cat(rois_list, 0)
-        roi_indices = torch.cat(roi_indices_list, 0)
-
+        rpn_fg_scores = score[:, :, 1].detach()
+
+        # Clip the boxes of every image to its border.
+        border_size = torch.Tensor([meta[i]['border_size'] for i in range(batch_size)]).to(device)
+        max_xy = (border_size - 1).repeat(1, 2).unsqueeze(1)  # [b, 1, 4]
+        dst_bbox = torch.min(dst_bbox.clamp(min=0), max_xy)
+
+        # Remove predicted boxes with either height or width < threshold.
+        ws = dst_bbox[:, :, 2] - dst_bbox[:, :, 0] + 1
+        hs = dst_bbox[:, :, 3] - dst_bbox[:, :, 1] + 1
+        min_size = self.configer.get('rpn', 'min_size')
+        img_scale = torch.Tensor([meta[i]['img_scale'] for i in range(batch_size)]).to(device).unsqueeze(1)
+        keep = (hs >= img_scale * min_size) & (ws >= img_scale * min_size)
+
+        # Sort all (proposal, score) pairs by score from highest to lowest.
+        # Take top pre_nms_topN (e.g. 6000) of every image.
+        rpn_fg_scores = rpn_fg_scores.masked_fill(~keep, float('-inf'))
+        num_pre_nms = rpn_fg_scores.size(1) if n_pre_nms <= 0 else min(n_pre_nms, rpn_fg_scores.size(1))
+        top_scores, order = rpn_fg_scores.topk(num_pre_nms, dim=1, sorted=True)
+        batch_index = torch.arange(batch_size, device=device).unsqueeze(1).expand_as(order)
+        valid = top_scores > float('-inf')
+        batch_index = batch_index[valid]
+        rois = dst_bbox[batch_index, order[valid]]
+        top_scores = top_scores[valid]
+
+        # Apply nms (e.g. threshold = 0.7) of all the images at once.
+        # Take after_nms_topN (e.g. 300) of every image.
+        keep = DetHelper.batch_nms(torch.cat((rois, top_scores.unsqueeze(1)), 1), batch_index,
+                                   max_threshold=self.configer.get('rpn', 'nms_threshold'),
+                                   group_keep_num=n_post_nms if n_post_nms > 0 else None)
+
+        rois = rois[keep]
+        batch_index = batch_index[keep]
+        batch_rois_num = torch.bincount(batch_index, minlength=batch_size)
         if rois.numel() == 0:
             indices_and_rois = rois
         else:
-            indices_and_rois = torch.cat([roi_indices.unsqueeze(1).to(device), rois.to(device)], dim=1).contiguous()
+            indices_and_rois = torch.cat([batch_index.float().unsqueeze(1), rois], dim=1).contiguous()
 
-        return indices_and_rois.to(device), batch_rois_num.long().to(device)
+        return indices_and_rois, batch_rois_num.long()
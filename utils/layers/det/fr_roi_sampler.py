@@ -30,97 +30,105 @@ class FRROISampler(object):
         loc_normalize_mean = self.configer.get('roi', 'loc_normalize_mean')
         loc_normalize_std = self.configer.get('roi', 'loc_normalize_std')
 
-        sample_roi_list = list()
-        gt_roi_loc_list = list()
-        gt_roi_label_list= list()
-        gt_roi_mask_list = list()
-
-        for i in range(len(gt_bboxes)):
-            temp_gt_bboxes = gt_bboxes[i].to(indices_and_rois.device)
-            temp_gt_labels = gt_labels[i].to(indices_and_rois.device)
-
-            if temp_gt_bboxes.numel() == 0:
-                min_size = self.configer.get('rpn', 'min_size')
-                roi_size = random.randint(min_size, min(meta[i]['border_size']))
-                sample_roi = torch.zeros((1, 4), requires_grad=True).float().to(indices_and_rois.device)
-                sample_roi[0, 2:] = roi_size
-                gt_roi_loc = torch.zeros((1, 4), requires_grad=True).float().to(sample_roi.device)
-                gt_roi_label = torch.ones((1,), requires_grad=True).long().to(sample_roi.device).mul_(-1)
-
-            else:
-                pos_roi_per_image = np.round(n_sample * pos_ratio)
-                if self.configer.get('phase') == 'debug':
-                    rois = indices_and_rois[indices_and_rois[:, 0] == i][:, 1:]
-                else:
-                    if indices_and_rois.numel() == 0:
-                        rois = temp_gt_bboxes
-                    else:
-                        rois = torch.cat((indices_and_rois[indices_and_rois[:, 0] == i][:, 1:], temp_gt_bboxes), 0)
-
-                iou = DetHelper.bbox_iou(rois, temp_gt_bboxes)
-                max_iou, gt_assignment = iou.max(1, keepdim=False)
-                # Offset range of classes from [0, n_fg_class - 1] to [1, n_fg_class].
-                # The label with value 0 is the background.
-                gt_roi_label = temp_gt_labels[gt_assignment] + 1
-
-                max_iou = max_iou.cpu().detach().numpy()
-                # Select foreground RoIs as those with >= pos_iou_thresh IoU.
-                pos_index = np.where(max_iou >= pos_iou_thresh)[0]
-                pos_roi_per_this_image = int(min(pos_roi_per_image, pos_index.size))
-                if pos_index.size > 0:
-                    pos_index = np.random.choice(pos_index, size=pos_roi_per_this_image, replace=False)
-
-                # Select background RoIs as those within
-                # [neg_iou_thresh_lo, neg_iou_thresh_hi).
-                neg_index = np.where((max_iou < neg_iou_thresh_hi) & (max_iou >= neg_iou_thresh_lo))[0]
-                neg_roi_per_this_image = n_sample - pos_roi_per_this_image
-                neg_roi_per_this_image = int(min(neg_roi_per_this_image, neg_index.size))
-                if neg_index.size > 0:
-                    neg_index = np.random.choice(neg_index, size=neg_roi_per_this_image, replace=False)
-
-                # The indices that we're selecting (both positive and negative).
-                keep_index = np.append(pos_index, neg_index)
-                gt_roi_label = gt_roi_label[keep_index].detach()
-                gt_roi_label[pos_roi_per_this_image:] = 0  # negative labels --> 0
-                sample_roi = rois[keep_index].detach()
-
-                if gt_polygons is not None:
-                    temp_gt_polygons = gt_polygons[i]
-                    target_size = [self.configer.get('roi', 'pooled_width'), self.configer.get('roi', 'pooled_height')]
-                    for roi_index in range(pos_roi_per_this_image):
-                        gt_index = gt_assignment[keep_index[roi_index]]
-                        roi_polygons = temp_gt_polygons[gt_index]
-                        roi = sample_roi[roi_index].cpu().numpy()
-                        mask = MaskHelper.polys2mask_wrt_box(roi_polygons, roi, target_size)
-                        mask = torch.from_numpy(mask).to(indices_and_rois.device)
-                        gt_roi_mask_list.append(mask)
-
-                # Compute offsets and scales to match sampled RoIs to the GTs.
-                boxes = temp_gt_bboxes[gt_assignment][keep_index]
-                cxcy = (boxes[:, :2] + boxes[:, 2:]) / 2 - (sample_roi[:, :2] + sample_roi[:, 2:]) / 2  # [8732,2]
-                cxcy /= (sample_roi[:, 2:] - sample_roi[:, :2])
-                wh = (boxes[:, 2:] - boxes[:, :2]) / (sample_roi[:, 2:] - sample_roi[:, :2])  # [8732,2]
-                wh = torch.log(wh)
-                loc = torch.cat([cxcy, wh], 1).detach()  # [8732,4]
-                # loc = loc[:, [1, 0, 3, 2]]
-
-                normalize_mean = torch.Tensor(loc_normalize_mean).to(loc.device)
-                normalize_std = torch.Tensor(loc_normalize_std).to(loc.device)
-                gt_roi_loc = (loc - normalize_mean) / normalize_std
-
-            batch_index = i * torch.ones((len(sample_roi),)).to(sample_roi.device)
-            sample_roi = torch.cat([batch_index[:, None], sample_roi], dim=1).contiguous()
-            sample_roi_list.append(sample_roi)
-            gt_roi_loc_list.append(gt_roi_loc)
-            gt_roi_label_list.append(gt_roi_label)
-            # sample_roi.register_hook(lambda g: print(g))
-
-        sample_roi = torch.cat(sample_roi_list, 0)
-        gt_roi_loc = torch.cat(gt_roi_loc_list, 0)
-        gt_roi_label = torch.cat(gt_roi_label_list, 0)
-
-        if gt_polygons is not None:
-            gt_pos_roi_mask = torch.cat(gt_roi_mask_list, 0)
-            return sample_roi, gt_roi_loc, gt_roi_label, gt_pos_roi_mask
-        else:
-            return sample_roi, gt_roi_loc, gt_roi_label
+        device = indices_and_rois.device
+        batch_size = len(gt_bboxes)
+        gt_boxes, gt_classes, valid = DetHelper.pad_gt(gt_bboxes, gt_labels, device=device)
+        has_gt = valid.any(1)  # [B]
+
+        # The candidate rois of the whole batch: the proposals, then the gt boxes (not in debug phase).
+        rois = indices_and_rois[:, 1:].detach()
+        batch_index = indices_and_rois[:, 0].long()
+        if self.configer.get('phase') != 'debug':
+            gt_batch_index, gt_object_index = valid.nonzero(as_tuple=True)
+            rois = torch.cat((rois, gt_boxes[gt_batch_index, gt_object_index]), 0)
+            batch_index = torch.cat((batch_index, gt_batch_index), 0)
+
+        # ious with the gt of the same image, the padded gt are -1.
+        iou = DetHelper.batch_bbox_iou(rois.unsqueeze(1), gt_boxes[batch_index]).squeeze(1)  # [K,M]
+        iou = iou.masked_fill(~valid[batch_index], -1.)
+        max_iou, gt_assignment = iou.max(1)
+        roi_has_gt = has_gt[batch_index]
+
+        # Select foreground RoIs as those with >= pos_iou_thresh IoU.
+        pos_roi_per_image = int(np.round(n_sample * pos_ratio))
+        positive = roi_has_gt & (max_iou >= pos_iou_thresh)
+        positive &= self.__group_random_rank(positive, batch_index) < pos_roi_per_image
+        n_pos = torch.bincount(batch_index[positive], minlength=batch_size)
+
+        # Select background RoIs as those within [neg_iou_thresh_lo, neg_iou_thresh_hi).
+        negative = roi_has_gt & (max_iou < neg_iou_thresh_hi) & (max_iou >= neg_iou_thresh_lo)
+        negative &= self.__group_random_rank(negative, batch_index) < (n_sample - n_pos)[batch_index]
+
+        # The kept rois of every image: positives first, then negatives.
+        keep_index = (positive | negative).nonzero(as_tuple=True)[0]
+        sort_key = (batch_index[keep_index] * 2 + negative[keep_index].long()) * rois.size(0) + keep_index
+        keep_index = keep_index[sort_key.argsort()]
+
+        sample_roi = rois[keep_index]
+        sample_batch_index = batch_index[keep_index]
+        sample_gt_index = gt_assignment[keep_index]
+        # Offset range of classes from [0, n_fg_class - 1] to [1, n_fg_class].
+        # The label with value 0 is the background.
+        gt_roi_label = gt_classes[sample_batch_index, sample_gt_index] + 1
+        gt_roi_label[negative[keep_index]] = 0
+
+        # Compute offsets and scales to match sampled RoIs to the GTs.
+        boxes = gt_boxes[sample_batch_index, sample_gt_index]
+        cxcy = (boxes[:, :2] + boxes[:, 2:]) / 2 - (sample_roi[:, :2] + sample_roi[:, 2:]) / 2  # [N,2]
+        cxcy /= (sample_roi[:, 2:] - sample_roi[:, :2])
+        wh = (boxes[:, 2:] - boxes[:, :2]) / (sample_roi[:, 2:] - sample_roi[:, :2])  # [N,2]
+        wh = torch.log(wh)
+        loc = torch.cat([cxcy, wh], 1)  # [N,4]
+        # loc = loc[:, [1, 0, 3, 2]]
+
+        normalize_mean = torch.Tensor(loc_normalize_mean).to(device)
+        normalize_std = torch.Tensor(loc_normalize_std).to(device)
+        gt_roi_loc = (loc - normalize_mean) / normalize_std
+
+        # The images without gt get a single random roi, labeled as dont care.
+        empty_images = (~has_gt).nonzero(as_tuple=True)[0].tolist()
+        if len(empty_images) > 0:
+            min_size = self.configer.get('rpn', 'min_size')
+            empty_roi = torch.zeros((len(empty_images), 4), device=device)
+            empty_roi[:, 2:] = torch.Tensor([random.randint(min_size, min(meta[i]['border_size']))
+                                             for i in empty_images]).to(device).unsqueeze(1)
+            sample_roi = torch.cat((sample_roi, empty_roi), 0)
+            sample_batch_index = torch.cat((sample_batch_index, torch.LongTensor(empty_images).to(device)), 0)
+            gt_roi_loc = torch.cat((gt_roi_loc, torch.zeros((len(empty_images), 4), device=device)), 0)
+            gt_roi_label = torch.cat((gt_roi_label, torch.full((len(empty_images),), -1, dtype=torch.long,
+                                                               device=device)), 0)
+            # keep the sampled rois of every image in place, the empty images have none of them.
+            order = (sample_batch_index * sample_roi.size(0)
+                     + torch.arange(sample_roi.size(0), device=device)).argsort()
+            sample_roi, sample_batch_index = sample_roi[order], sample_batch_index[order]
+            gt_roi_loc, gt_roi_label = gt_roi_loc[order], gt_roi_label[order]
+
+        sample_roi = torch.cat([sample_batch_index.float().unsqueeze(1), sample_roi], dim=1).contiguous()
+        if gt_polygons is None:
+            return sample_roi, gt_roi_loc.detach(), gt_roi_label.detach()
+
+        pos_keep = keep_index[positive[keep_index]]
+        gt_pos_roi_mask = self.__mask_targets(rois[pos_keep], batch_index[pos_keep],
+                                              gt_assignment[pos_keep], gt_polygons)
+        return sample_roi, gt_roi_loc.detach(), gt_roi_label.detach(), gt_pos_roi_mask
+
+    @staticmethod
+    def __group_random_rank(mask, group_ids):
+        """Rank the True elements of every group in a random order, the False elements are ranked after them."""
+        scores = torch.rand(mask.size(), device=mask.device).masked_fill_(~mask, -1.)
+        order, rank = DetHelper.group_sort(group_ids, scores)
+        return torch.empty_like(rank).scatter_(0, order, rank)
+
+    def __mask_targets(self, pos_rois, pos_batch_index, pos_gt_index, gt_polygons):
+        """Mask targets of all the positive rois, one RoIAlign-style crop of the full resolution
+        masks of every image, which are only rasterized for the objects assigned to a positive roi."""
+        target_size = [self.configer.get('roi', 'pooled_width'), self.configer.get('roi', 'pooled_height')]
+        gt_masks = torch.zeros((pos_rois.size(0), target_size[1], target_size[0]), device=pos_rois.device)
+        for i in torch.unique(pos_batch_index).tolist():
+            roi_index = (pos_batch_index == i).nonzero(as_tuple=True)[0]
+            object_ids, mask_index = torch.unique(pos_gt_index[roi_index], return_inverse=True)
+            polygons = [gt_polygons[i][object_id] for object_id in object_ids.tolist()]
+            masks = torch.from_numpy(MaskHelper.polys2masks(polygons)).to(pos_rois.device)
+            gt_masks[roi_index] = MaskHelper.roi_crop(masks, pos_rois[roi_index], mask_index, target_size)
+
+        return (gt_masks >= 0.5).float()
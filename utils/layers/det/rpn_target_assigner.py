@@ -8,8 +8,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
-import numpy as np
 import torch
 
 from utils.helpers.det_helper import DetHelper
@@ -26,77 +24,58 @@ class RPNTargetAssigner(object):
 
     def __call__(self, feat_list, gt_bboxes, meta):
         anchor_boxes = self.fr_proirbox_layer(feat_list, meta[0]['input_size'])
+        device = anchor_boxes.device
         n_sample = self.configer.get('rpn', 'loss')['n_sample']
         pos_iou_thresh = self.configer.get('rpn', 'loss')['pos_iou_thresh']
         neg_iou_thresh = self.configer.get('rpn', 'loss')['neg_iou_thresh']
         pos_ratio = self.configer.get('rpn', 'loss')['pos_ratio']
         # Calc indicies of anchors which are located completely inside of the image
         # whose size is speficied.
-        target_bboxes = list()
-        target_labels = list()
-        for i in range(len(gt_bboxes)):
-            index_inside = (((anchor_boxes[:, 0] - anchor_boxes[:, 2] / 2) >= 0)
-                            & ((anchor_boxes[:, 1] - anchor_boxes[:, 3] / 2) >= 0)
-                            & ((anchor_boxes[:, 0] + anchor_boxes[:, 2] / 2) < meta[i]['border_size'][0])
-                            & ((anchor_boxes[:, 1] + anchor_boxes[:, 3] / 2) < meta[i]['border_size'][1]))
-            index_inside = index_inside.nonzero().contiguous().view(-1, )
-            default_boxes = anchor_boxes[index_inside]
-            loc = torch.zeros_like(default_boxes)
-            label = torch.ones((default_boxes.size(0),)).mul_(-1).long()
-
-            if gt_bboxes[i].numel() > 0:
-                # label: 1 is positive, 0 is negative, -1 is dont care
-                ious = DetHelper.bbox_iou(gt_bboxes[i],
-                                          torch.cat([default_boxes[:, :2] - default_boxes[:, 2:] / 2,
-                                                     default_boxes[:, :2] + default_boxes[:, 2:] / 2], 1))
-
-                max_ious, argmax_ious = ious.max(0, keepdim=False)
-                _, gt_argmax_ious = ious.max(1, keepdim=False)
-
-                # assign negative labels first so that positive labels can clobber them
-                label[max_ious < neg_iou_thresh] = 0
-
-                # positive label: for each gt, anchor with highest iou
-                label[gt_argmax_ious] = 1
-
-                # positive label: above threshold IOU
-                label[max_ious >= pos_iou_thresh] = 1
-
-                # subsample positive labels if we have too many
-                n_pos = int(pos_ratio * n_sample)
-                pos_index = (label == 1).nonzero().contiguous().view(-1, ).numpy()
-                if len(pos_index) > n_pos:
-                    disable_index = np.random.choice(pos_index, size=(len(pos_index) - n_pos), replace=False)
-                    label[disable_index] = -1
-
-                # subsample negative labels if we have too many
-                n_neg = n_sample - torch.sum(label == 1).item()
-                neg_index = (label == 0).nonzero().contiguous().view(-1, ).numpy()
-
-                if len(neg_index) > n_neg:
-                    disable_index = np.random.choice(neg_index, size=(len(neg_index) - n_neg), replace=False)
-                    label[disable_index] = -1
-
-                boxes = gt_bboxes[i][argmax_ious]  # [8732,4]
-                cxcy = (boxes[:, :2] + boxes[:, 2:]) / 2 - default_boxes[:, :2]  # [8732,2]
-                cxcy /= default_boxes[:, 2:]
-                wh = (boxes[:, 2:] - boxes[:, :2]) / default_boxes[:, 2:]  # [8732,2]
-                wh = torch.log(wh)
-                loc = torch.cat([cxcy, wh], 1)  # [8732,4]
-                # loc = loc[:, [1, 0, 3, 2]]
-            else:
-                # subsample negative labels if we have too many
-                n_neg = n_sample // 2
-                neg_index = (label == -1).nonzero().contiguous().view(-1, ).numpy()
-                if len(neg_index) > n_neg:
-                    disable_index = np.random.choice(neg_index, size=n_neg, replace=False)
-                    label[disable_index] = 0
-
-            ret_label = torch.ones((anchor_boxes.size(0),), dtype=torch.long).mul_(-1)
-            ret_label[index_inside] = torch.LongTensor(label)
-            ret_loc = torch.zeros((anchor_boxes.size(0), 4))
-            ret_loc[index_inside] = loc
-            target_bboxes.append(ret_loc)
-            target_labels.append(ret_label)
-
-        return torch.stack(target_bboxes, 0), torch.stack(target_labels, 0)
\ No newline at end of file
+        border_size = torch.Tensor([meta[i]['border_size'] for i in range(len(gt_bboxes))]).to(device)
+        default_boxes = torch.cat([anchor_boxes[:, :2] - anchor_boxes[:, 2:] / 2,
+                                   anchor_boxes[:, :2] + anchor_boxes[:, 2:] / 2], 1)  # [A,4]
+        inside = (default_boxes[None, :, :2] >= 0).all(2) \
+            & (default_boxes[None, :, 2:] < border_size[:, None, :]).all(2)  # [B,A]
+
+        gt_boxes, _, valid = DetHelper.pad_gt(gt_bboxes, device=device)
+        has_gt = valid.any(1, keepdim=True)  # [B,1]
+        # ious of the padded gt are -1, and the gt argmax only looks at the inside anchors.
+        ious = DetHelper.batch_bbox_iou(gt_boxes, default_boxes)  # [B,M,A]
+        ious = ious.masked_fill(~valid.unsqueeze(2), -1.)
+        max_ious, argmax_ious = ious.max(1)  # [B,A]
+        gt_argmax_ious = ious.masked_fill(~inside.unsqueeze(1), -2.).max(2)[1]  # [B,M]
+
+        # label: 1 is positive, 0 is negative, -1 is dont care
+        label = torch.full(inside.size(), -1, dtype=torch.long, device=device)
+        # assign negative labels first so that positive labels can clobber them
+        label[inside & has_gt & (max_ious < neg_iou_thresh)] = 0
+        # positive label: for each gt, anchor with highest iou
+        batch_index, object_index = valid.nonzero(as_tuple=True)
+        label[batch_index, gt_argmax_ious[batch_index, object_index]] = 1
+        # positive label: above threshold IOU
+        label[inside & has_gt & (max_ious >= pos_iou_thresh)] = 1
+
+        # subsample positive labels if we have too many
+        n_pos = int(pos_ratio * n_sample)
+        positive = label == 1
+        label[positive & (DetHelper.random_rank(positive) >= n_pos)] = -1
+
+        # subsample negative labels if we have too many
+        n_neg = n_sample - (label == 1).sum(1, keepdim=True)
+        negative = label == 0
+        label[negative & (DetHelper.random_rank(negative) >= n_neg)] = -1
+
+        # the images without gt sample n_sample // 2 negatives from the inside anchors, if there are more of them.
+        candidate = inside & ~has_gt
+        n_candidate = candidate.sum(1, keepdim=True)
+        label[candidate & (DetHelper.random_rank(candidate) < n_sample // 2) & (n_candidate > n_sample // 2)] = 0
+
+        boxes = torch.gather(gt_boxes, 1, argmax_ious.unsqueeze(2).expand(-1, -1, 4))  # [B,A,4]
+        cxcy = (boxes[:, :, :2] + boxes[:, :, 2:]) / 2 - anchor_boxes[None, :, :2]  # [B,A,2]
+        cxcy /= anchor_boxes[None, :, 2:]
+        wh = (boxes[:, :, 2:] - boxes[:, :, :2]) / anchor_boxes[None, :, 2:]  # [B,A,2]
+        wh = torch.log(wh)
+        loc = torch.cat([cxcy, wh], 2)  # [B,A,4]
+        # loc = loc[:, [1, 0, 3, 2]]
+        loc = torch.where((inside & has_gt).unsqueeze(2), loc, torch.zeros_like(loc))
+        return loc, label
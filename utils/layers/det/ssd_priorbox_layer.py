@@ -13,6 +13,7 @@ import math
 import numpy as np
 import torch
 
+from utils.layers.det.anchor_cache import ANCHOR_CACHE
 from utils.tools.logger import Logger as Log
 
 
@@ -24,6 +25,20 @@ class SSDPriorBoxLayer(object):
         self.clip = clip
 
     def __call__(self, feat_list, input_size):
+        anchor_config = dict(
+            anchor_method=self.configer.get('gt', 'anchor_method'),
+            cur_anchor_sizes=self.configer.get('gt', 'cur_anchor_sizes'),
+            aspect_ratio_list=self.configer.get('gt', 'aspect_ratio_list'),
+            scale_ratio_list=self.configer.get('gt', 'scale_ratio_list')
+            if self.configer.exists('gt', 'scale_ratio_list') else None,
+            num_anchor_list=self.configer.get('gt', 'num_anchor_list'),
+            clip=self.clip
+        )
+        key = ANCHOR_CACHE.make_key('ssd', input_size, feat_list, anchor_config)
+        return ANCHOR_CACHE.get(key, lambda: self.__build_anchors(feat_list, input_size,
+                                                                  anchor_config).to(feat_list[0].device))
+
+    def __build_anchors(self, feat_list, input_size, anchor_config):
         img_w, img_h = input_size
         feature_map_w = [feat.size(3) for feat in feat_list]
         feature_map_h = [feat.size(2) for feat in feat_list]
@@ -36,34 +51,33 @@ class SSDPriorBoxLayer(object):
             fm_h = feature_map_h[i]
             boxes = []
             stride_offset_w, stride_offset_h = 0.5 * stride_w_list[i], 0.5 * stride_h_list[i]
-            if self.configer.get('gt', 'anchor_method') == 'ssd':
-                s_w = self.configer.get('gt', 'cur_anchor_sizes')[i]
-                s_h = self.configer.get('gt', 'cur_anchor_sizes')[i]
+            if anchor_config['anchor_method'] == 'ssd':
+                s_w = anchor_config['cur_anchor_sizes'][i]
+                s_h = anchor_config['cur_anchor_sizes'][i]
                 boxes.append((stride_offset_w, stride_offset_h, s_w, s_h))
-                extra_s = math.sqrt(self.configer.get('gt', 'cur_anchor_sizes')[i]
-                                    * self.configer.get('gt', 'cur_anchor_sizes')[i + 1])
+                extra_s = math.sqrt(anchor_config['cur_anchor_sizes'][i] * anchor_config['cur_anchor_sizes'][i + 1])
 
                 boxes.append((stride_offset_w, stride_offset_h, extra_s, extra_s))
 
-                for ar in self.configer.get('gt', 'aspect_ratio_list')[i]:
+                for ar in anchor_config['aspect_ratio_list'][i]:
                     boxes.append((stride_offset_w, stride_offset_h, s_w * math.sqrt(ar), s_h / math.sqrt(ar)))
                     boxes.append((stride_offset_w, stride_offset_h, s_w / math.sqrt(ar), s_h * math.sqrt(ar)))
 
-            elif self.configer.get('gt', 'anchor_method') == 'retina':
-                s_w = self.configer.get('gt', 'cur_anchor_sizes')[i]
-                s_h = self.configer.get('gt', 'cur_anchor_sizes')[i]
-                for sr in self.configer.get('gt', 'scale_ratio_list'):
+            elif anchor_config['anchor_method'] == 'retina':
+                s_w = anchor_config['cur_anchor_sizes'][i]
+                s_h = anchor_config['cur_anchor_sizes'][i]
+                for sr in anchor_config['scale_ratio_list']:
                     s_w = sr * s_w
                     s_h = sr * s_h
-                    for ar in self.configer.get('gt', 'aspect_ratio_list'):
+                    for ar in anchor_config['aspect_ratio_list']:
                         boxes.append((stride_offset_w, stride_offset_h, s_w * ar, s_h / ar))
 
             else:
-                Log.error('Anchor Method {} not valid.'.format(self.configer.get('gt', 'anchor_method')))
+                Log.error('Anchor Method {} not valid.'.format(anchor_config['anchor_method']))
                 exit(1)
 
             anchor_bases = torch.FloatTensor(np.array(boxes))
-            assert anchor_bases.size(0) == self.configer.get('gt', 'num_anchor_list')[i]
+            assert anchor_bases.size(0) == anchor_config['num_anchor_list'][i]
             anchors = anchor_bases.contiguous().view(1, -1, 4).repeat(fm_h * fm_w, 1, 1).contiguous().view(-1, 4)
             grid_len_h = np.arange(0, img_h - stride_offset_h, stride_h_list[i])
             grid_len_w = np.arange(0, img_w - stride_offset_w, stride_w_list[i])
@@ -73,14 +87,13 @@ class SSDPriorBoxLayer(object):
             y_offset = torch.FloatTensor(b).view(-1, 1)
 
             x_y_offset = torch.cat((x_offset, y_offset), 1).contiguous().view(-1, 1, 2)
-            x_y_offset = x_y_offset.repeat(1, self.configer.get('gt', 'num_anchor_list')[i], 1).contiguous().view(-1, 2)
+            x_y_offset = x_y_offset.repeat(1, anchor_config['num_anchor_list'][i], 1).contiguous().view(-1, 2)
             anchors[:, :2] = anchors[:, :2] + x_y_offset
             anchor_boxes_list.append(anchors)
 
         anchor_boxes = torch.cat(anchor_boxes_list, 0)
-        if self.clip:
+        if anchor_config['clip']:
             anchor_boxes[:, 0::2].clamp_(min=0., max=img_w - 1)
             anchor_boxes[:, 1::2].clamp_(min=0., max=img_h - 1)
 
         return anchor_boxes
-
@@ -25,45 +25,46 @@ class SSDTargetGenerator(object):
         self.fr_proirbox_layer = SSDPriorBoxLayer(configer)
 
     def __call__(self, feat_list, gt_bboxes, gt_labels, input_size):
-        anchor_boxes = self.fr_proirbox_layer(feat_list, input_size)
-        target_bboxes = list()
-        target_labels = list()
-        for i in range(len(gt_bboxes)):
-            if gt_bboxes[i] is None or len(gt_bboxes[i]) == 0:
-                loc = torch.zeros_like(anchor_boxes)
-                conf = torch.zeros((anchor_boxes.size(0),)).long()
-
-            else:
-
-                iou = DetHelper.bbox_iou(gt_bboxes[i],
-                                         torch.cat([anchor_boxes[:, :2] - anchor_boxes[:, 2:] / 2,
-                                                    anchor_boxes[:, :2] + anchor_boxes[:, 2:] / 2], 1))  # [#obj,8732]
-
-                prior_box_iou, max_idx = iou.max(0, keepdim=False)  # [1,8732]
-
-                boxes = gt_bboxes[i][max_idx]  # [8732,4]
-                variances = [0.1, 0.2]
-                cxcy = (boxes[:, :2] + boxes[:, 2:]) / 2 - anchor_boxes[:, :2]  # [8732,2]
-                cxcy /= variances[0] * anchor_boxes[:, 2:]
-                wh = (boxes[:, 2:] - boxes[:, :2]) / anchor_boxes[:, 2:]  # [8732,2]
-                wh = torch.log(wh) / variances[1]
-                loc = torch.cat([cxcy, wh], 1)  # [8732,4]
-
-                conf = 1 + gt_labels[i][max_idx]  # [8732,], background class = 0
-
-                if self.configer.get('gt', 'anchor_method') == 'retina':
-                    conf[prior_box_iou < self.configer.get('gt', 'iou_threshold')] = -1
-                    conf[prior_box_iou < self.configer.get('gt', 'iou_threshold') - 0.1] = 0
-                else:
-                    conf[prior_box_iou < self.configer.get('gt', 'iou_threshold')] = 0  # background
-
-                # According to IOU, it give every prior box a class label.
-                # Then if the IOU is lower than the threshold, the class label is 0(background).
-                class_iou, prior_box_idx = iou.max(1, keepdim=False)
-                conf_class_idx = prior_box_idx.cpu().numpy()
-                conf[conf_class_idx] = gt_labels[i] + 1
-
-            target_bboxes.append(loc)
-            target_labels.append(conf)
-
-        return torch.stack(target_bboxes, 0), torch.stack(target_labels, 0)
\ No newline at end of file
+        """Match the whole batch at once, on the device of feat_list.
+
+        The gt is padded to [B, maxObj], so the iou is a single [B, maxObj, numAnchors] tensor.
+        """
+        device = feat_list[0].device
+        anchor_boxes = self.fr_proirbox_layer(feat_list, input_size).to(device)
+        anchor_corners = torch.cat([anchor_boxes[:, :2] - anchor_boxes[:, 2:] / 2,
+                                    anchor_boxes[:, :2] + anchor_boxes[:, 2:] / 2], 1)
+
+        bboxes, labels, valid = DetHelper.pad_gt(gt_bboxes, gt_labels, device=device)
+        iou = DetHelper.batch_bbox_iou(bboxes, anchor_corners)  # [B,#obj,8732]
+        iou[~valid] = -1.0
+
+        prior_box_iou, max_idx = iou.max(1, keepdim=False)  # [B,8732]
+
+        boxes = bboxes.gather(1, max_idx.unsqueeze(2).expand(-1, -1, 4))  # [B,8732,4]
+        variances = [0.1, 0.2]
+        cxcy = (boxes[:, :, :2] + boxes[:, :, 2:]) / 2 - anchor_boxes[:, :2]  # [B,8732,2]
+        cxcy /= variances[0] * anchor_boxes[:, 2:]
+        wh = (boxes[:, :, 2:] - boxes[:, :, :2]) / anchor_boxes[:, 2:]  # [B,8732,2]
+        wh = torch.log(wh) / variances[1]
+        loc = torch.cat([cxcy, wh], 2)  # [B,8732,4]
+
+        conf = 1 + labels.gather(1, max_idx)  # [B,8732], background class = 0
+
+        if self.configer.get('gt', 'anchor_method') == 'retina':
+            conf[prior_box_iou < self.configer.get('gt', 'iou_threshold')] = -1
+            conf[prior_box_iou < self.configer.get('gt', 'iou_threshold') - 0.1] = 0
+        else:
+            conf[prior_box_iou < self.configer.get('gt', 'iou_threshold')] = 0  # background
+
+        # According to IOU, it give every prior box a class label.
+        # Then if the IOU is lower than the threshold, the class label is 0(background).
+        # The best prior of every object is forced to its label.
+        class_iou, prior_box_idx = iou.max(2, keepdim=False)  # [B,#obj]
+        batch_idx, obj_idx = valid.nonzero(as_tuple=True)
+        conf[batch_idx, prior_box_idx[batch_idx, obj_idx]] = labels[batch_idx, obj_idx] + 1
+
+        # Images without objects are all background.
+        has_object = valid.any(1)
+        loc = torch.where(has_object[:, None, None], loc, torch.zeros_like(loc))
+        conf = torch.where(has_object[:, None], conf, torch.zeros_like(conf))
+        return loc, conf
@@ -12,6 +12,7 @@ import time
 import numpy as np
 import torch
 
+from utils.layers.det.anchor_cache import ANCHOR_CACHE
 from utils.tools.logger import Logger as Log
 
 
@@ -51,30 +52,15 @@ class YOLODetectionLayer(object):
             prediction_list.append(layer_out)
 
             detect_out = layer_out.clone()
-            # Add the center offsets
-            grid_len_h = np.arange(grid_size_h)
-            grid_len_w = np.arange(grid_size_w)
-            a, b = np.meshgrid(grid_len_w, grid_len_h)
-
-            x_offset = torch.FloatTensor(a).view(-1, 1)
-            y_offset = torch.FloatTensor(b).view(-1, 1)
-
-            x_offset = x_offset.to(self.device)
-            y_offset = y_offset.to(self.device)
-
-            x_y_offset = torch.cat((x_offset, y_offset), 1).contiguous().view(1, -1, 2)
-            x_y_offset = x_y_offset.repeat(num_anchors, 1, 1).view(-1, 2).unsqueeze(0)
-
+            # Add the center offsets, the grid and the anchor sizes are cached per feature map.
+            anchor_config = dict(feat_stride=feat_stride, anchors=in_anchors)
+            key = ANCHOR_CACHE.make_key('yolo', [grid_size_w, grid_size_h], [layer_out_list[i]], anchor_config)
+            x_y_offset, anchor_wh = ANCHOR_CACHE.get(key, lambda: self.__build_grid(anchors, grid_size_w, grid_size_h,
+                                                                                    layer_out.device))
             detect_out[:, :, :2] += x_y_offset
 
             # log space transform height and the width
-            anchors = torch.FloatTensor(anchors)
-
-            anchors = anchors.to(self.device)
-
-            anchors = anchors.contiguous().view(3, 1, 2)\
-                .repeat(1, grid_size_h * grid_size_w, 1).contiguous().view(-1, 2).unsqueeze(0)
-            detect_out[:, :, 2:4] = torch.exp(detect_out[:, :, 2:4]) * anchors
+            detect_out[:, :, 2:4] = torch.exp(detect_out[:, :, 2:4]) * anchor_wh
 
             detect_out[:, :, 0] /= grid_size_w
             detect_out[:, :, 1] /= grid_size_h
@@ -84,3 +70,21 @@ class YOLODetectionLayer(object):
             detect_list.append(detect_out)
 
         return layer_out_list, torch.cat(prediction_list, 1), torch.cat(detect_list, 1)
+
+    @staticmethod
+    def __build_grid(anchors, grid_size_w, grid_size_h, device):
+        num_anchors = len(anchors)
+        grid_len_h = np.arange(grid_size_h)
+        grid_len_w = np.arange(grid_size_w)
+        a, b = np.meshgrid(grid_len_w, grid_len_h)
+
+        x_offset = torch.FloatTensor(a).view(-1, 1)
+        y_offset = torch.FloatTensor(b).view(-1, 1)
+
+        x_y_offset = torch.cat((x_offset, y_offset), 1).contiguous().view(1, -1, 2)
+        x_y_offset = x_y_offset.repeat(num_anchors, 1, 1).view(-1, 2).unsqueeze(0)
+
+        anchors = torch.FloatTensor(anchors)
+        anchors = anchors.contiguous().view(num_anchors, 1, 2)\
+            .repeat(1, grid_size_h * grid_size_w, 1).contiguous().view(-1, 2).unsqueeze(0)
+        return x_y_offset.to(device), anchors.to(device)